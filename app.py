@@ -8,6 +8,7 @@ from config import config
 from models import db, User
 from auth import auth, setup_rate_limiting
 from routes import main
+from webhooks import webhooks
 
 def create_app(config_name=None):
     """Application factory pattern"""
@@ -47,6 +48,11 @@ def create_app(config_name=None):
     app.register_blueprint(auth, url_prefix='/auth')
     app.register_blueprint(main)
     
+    # Webhooks authenticate with a shared secret and are called by Pathao, not browsers
+    app.register_blueprint(webhooks, url_prefix='/webhooks')
+    csrf.exempt(webhooks)
+    limiter.exempt(webhooks)
+    
     # Currency template filter
     @app.template_filter('currency')
     def currency_filter(amount):
@@ -110,4 +116,11 @@ if __name__ == '__main__':
     print("🔐 Secure Order Management System")
     print("=" * 50)
     
+    # The development server processes background jobs itself; under
+    # gunicorn, run `python3 run_worker.py` alongside instead. With the
+    # reloader, only the child process that serves requests starts them.
+    if not app.debug or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        from job_queue import start_workers
+        start_workers(app)
+    
     app.run(host='0.0.0.0', port=port)
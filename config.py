@@ -23,6 +23,18 @@ class Config:
     
     # Application Settings
     ITEMS_PER_PAGE = 20
+    STOCK_HOLD_MINUTES = 15  # How long the order form holds selected stock
+    ORDER_IMPORT_CHUNK_SIZE = 200  # Orders committed per bulk import transaction
+    IDEMPOTENCY_KEY_HOURS = 24  # How long resubmitted requests are replayed
+    
+    # Background Jobs
+    JOB_WORKER_THREADS = int(os.environ.get('JOB_WORKER_THREADS', 2))  # Worker threads per worker process
+    JOB_POLL_SECONDS = 2  # Idle wait between queue checks
+    JOB_MAX_ATTEMPTS = 5
+    JOB_RETRY_BASE_SECONDS = 30  # Backoff doubles after each failed attempt
+    JOB_RETRY_MAX_SECONDS = 900
+    JOB_LOCK_TIMEOUT_SECONDS = 300  # Running jobs older than this are retried or failed
+    JOB_RETENTION_DAYS = 7  # Finished jobs are purged after this
     
     # Currency Configuration
     CURRENCY_SYMBOL = '৳'
@@ -37,6 +49,34 @@ class Config:
     PATHAO_PASSWORD = os.environ.get('PATHAO_PASSWORD')
     PATHAO_GRANT_TYPE = os.environ.get('PATHAO_GRANT_TYPE')
     CACHE_DURATION_HOURS = 24  # Cache location data for 24 hours
+    LOCATION_INDEX_CHECK_SECONDS = 5  # How often workers check for refreshed location data
+    PATHAO_REFRESH_CHECK_SECONDS = 60  # Stale reads look for a running refresh at most this often
+    ADDRESS_CACHE_SIZE = 2000  # Parsed addresses kept in memory per process
+    ADDRESS_CACHE_TTL_HOURS = 720  # Parsed addresses are reused for 30 days
+    PATHAO_DEFAULT_STORE_ID = os.environ.get('PATHAO_DEFAULT_STORE_ID')  # Store quoted on the order form (default: first active store)
+    DELIVERY_QUOTE_TTL_HOURS = 24  # Delivery charge quotes are reused this long
+    DELIVERY_QUOTE_PREFETCH_ZONES = 50  # Most-ordered zones quoted ahead of time
+    DELIVERY_QUOTE_PREFETCH_DAYS = 30  # Order history that picks those zones
+    PATHAO_MAX_CONCURRENT_REQUESTS = 8  # Parallel requests when shipping or syncing in bulk
+    PATHAO_HTTP_POOL_SIZE = int(os.environ.get('PATHAO_HTTP_POOL_SIZE', 10))  # Keep-alive connections per process
+    PATHAO_CONNECT_TIMEOUT = 5  # Seconds to open a connection
+    PATHAO_READ_TIMEOUT = 30  # Seconds to wait for a response
+    PATHAO_MAX_RETRIES = 3  # Retries for idempotent calls on timeouts and 429/5xx
+    PATHAO_RETRY_BACKOFF_SECONDS = 0.5  # Jittered backoff doubles after each retry
+    PATHAO_RETRY_BACKOFF_MAX_SECONDS = 8
+    PATHAO_CIRCUIT_FAILURE_THRESHOLD = 5  # Consecutive failures that open an endpoint's circuit
+    PATHAO_CIRCUIT_RESET_SECONDS = 30  # Open circuits let a trial call through after this
+    PATHAO_CIRCUIT_SYNC_SECONDS = 2  # How often workers exchange circuit state
+    PATHAO_TOKEN_LOCK_SECONDS = 60  # A token renewal claim older than this is taken over
+    PATHAO_TOKEN_WAIT_SECONDS = 15  # How long other workers wait for a renewed token
+    DELIVERY_SYNC_BATCH_SIZE = 100  # Deliveries fetched and written per batch
+    DELIVERY_SYNC_UPDATE_ORDERS = True  # Move order status along with the delivery status
+    PATHAO_WEBHOOK_SECRET = os.environ.get('PATHAO_WEBHOOK_SECRET')  # Sent by Pathao in X-PATHAO-Signature
+    WEBHOOK_BATCH_SIZE = 500  # Inbox events merged per transaction
+    WEBHOOK_BATCH_DELAY_SECONDS = 2  # Wait for more callbacks before merging
+    WEBHOOK_RETENTION_DAYS = 30  # Merged callbacks are kept this long
+    WEBHOOK_UNKNOWN_RETRY_HOURS = 24  # Callbacks for consignments not recorded yet wait this long
+    WEBHOOK_UNKNOWN_RETRY_SECONDS = 300  # Delay between merge attempts for those callbacks
 
 class DevelopmentConfig(Config):
     DEBUG = True
@@ -0,0 +1,143 @@
+from collections import defaultdict
+from datetime import datetime, UTC
+from flask import current_app
+from sqlalchemy import select, update
+from models import db, Order, PathaoDelivery
+from pathao_service import PathaoService
+from job_queue import JobError, job_handler
+
+SYNC_DELIVERIES_JOB = 'pathao_sync_delivery_statuses'
+
+# Order statuses a delivery may move an order out of, by target status
+ADVANCEABLE_ORDER_STATUSES = {
+    'processing': ('pending',),
+    'completed': ('pending', 'processing'),
+    'cancelled': ('pending', 'processing')
+}
+
+
+def delivery_rows_query():
+    """Columns needed to decide whether a delivery's status changed"""
+    return select(
+        PathaoDelivery.id,
+        PathaoDelivery.consignment_id,
+        PathaoDelivery.merchant_order_id,
+        PathaoDelivery.order_status,
+        PathaoDelivery.status_at
+    )
+
+
+def apply_status_updates(deliveries, updates, update_orders):
+    """Write new delivery statuses with one bulk UPDATE.
+
+    deliveries are rows from delivery_rows_query(); updates maps
+    consignment ids to (status, status time or None). Updates older than
+    the stored status are skipped, as are unchanged statuses unless they
+    carry a newer time, which is recorded so later stale updates are still
+    recognised. With update_orders, orders are moved forward to match.
+    Does not commit. Returns (deliveries changed, orders updated).
+    """
+    now = datetime.now(UTC)
+    changes = []
+    order_moves = defaultdict(list)
+    for row in deliveries:
+        if row.consignment_id not in updates:
+            continue
+        status, status_at = updates[row.consignment_id]
+        newer = bool(status_at) and (row.status_at is None or status_at > row.status_at)
+        if status_at and row.status_at and not newer:
+            continue
+        if status == row.order_status and not newer:
+            continue
+
+        changes.append({
+            'id': row.id,
+            'order_status': status,
+            'is_final': PathaoDelivery.is_final_status(status),
+            'status_at': status_at if newer else row.status_at,
+            'updated_at': now
+        })
+        order_status = PathaoDelivery.order_status_for(status)
+        if order_status and status != row.order_status:
+            order_moves[order_status].append(row.merchant_order_id)
+
+    if not changes:
+        return 0, 0
+
+    db.session.execute(update(PathaoDelivery), changes)
+    orders_updated = advance_orders(order_moves, now) if update_orders else 0
+    return len(changes), orders_updated
+
+
+def advance_orders(order_moves, now):
+    """Move orders forward to match their delivery; never backwards"""
+    orders_updated = 0
+    for order_status, order_ids in order_moves.items():
+        result = db.session.execute(
+            update(Order)
+            .where(
+                Order.id.in_(order_ids),
+                Order.status.in_(ADVANCEABLE_ORDER_STATUSES[order_status])
+            )
+            .values(status=order_status, updated_at=now)
+            .execution_options(synchronize_session=False)
+        )
+        orders_updated += result.rowcount
+    return orders_updated
+
+
+class DeliveryStatusSync:
+    """Refresh the status of deliveries that are still in flight.
+
+    Deliveries in a final status are never read again, so the cost of a
+    run follows the number of open parcels rather than the whole history.
+    Each batch is fetched from Pathao concurrently, and only changed rows
+    are written, with one bulk UPDATE per batch.
+    """
+
+    def __init__(self, batch_size=None, update_orders=None):
+        config = current_app.config
+        self.batch_size = batch_size or config['DELIVERY_SYNC_BATCH_SIZE']
+        self.update_orders = config['DELIVERY_SYNC_UPDATE_ORDERS'] if update_orders is None else update_orders
+        self.stats = {'checked': 0, 'changed': 0, 'unavailable': 0, 'orders_updated': 0}
+
+    def in_flight_batches(self):
+        """Yield batches of open deliveries in id order"""
+        last_id = 0
+        while True:
+            rows = db.session.execute(
+                delivery_rows_query()
+                .where(PathaoDelivery.is_final.is_(False), PathaoDelivery.id > last_id)
+                .order_by(PathaoDelivery.id)
+                .limit(self.batch_size)
+            ).all()
+            if not rows:
+                return
+            yield rows
+            last_id = rows[-1].id
+
+    def run(self):
+        """Sync every open delivery and return the run statistics"""
+        for rows in self.in_flight_batches():
+            self.sync_batch(rows)
+        return self.stats
+
+    def sync_batch(self, rows):
+        """Fetch and store the status of one batch of deliveries"""
+        statuses = PathaoService.get_order_statuses([row.consignment_id for row in rows])
+        changed, orders_updated = apply_status_updates(rows, statuses, self.update_orders)
+        db.session.commit()
+
+        self.stats['checked'] += len(rows)
+        self.stats['changed'] += changed
+        self.stats['unavailable'] += len(rows) - len(statuses)
+        self.stats['orders_updated'] += orders_updated
+
+
+@job_handler(SYNC_DELIVERIES_JOB)
+def sync_delivery_statuses(payload):
+    """Background job wrapper around DeliveryStatusSync"""
+    try:
+        return DeliveryStatusSync(update_orders=payload.get('update_orders')).run()
+    except RuntimeError as e:
+        raise JobError(str(e))
@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+"""
+Stand-in for the Pathao merchant API, for functional and load testing offline.
+
+Usage:
+  python3 fake_pathao.py [--port 8001] [--latency-ms 150] [--jitter-ms 50] [--error-rate 0.02]
+      [--token-expiry 3600] [--cities 64] [--zones-per-city 40] [--stores 3] [--status-step 60]
+
+Then point the app at it:
+  export PATHAO_BASE_URL=http://localhost:8001
+
+Serves the /aladdin/api/v1/... routes used by PathaoService with generated
+cities, zones and stores. Tokens expire after --token-expiry seconds and
+are rejected with 401 afterwards; --error-rate of requests fail with 503.
+Created orders advance one status every --status-step seconds; delivery
+prices depend on city, delivery type and weight. GET /stats
+shows request counts per route.
+"""
+
+import argparse
+import hashlib
+import math
+import random
+import threading
+import time
+import uuid
+from collections import Counter
+from datetime import datetime, UTC
+
+from flask import Flask, jsonify, request
+
+ORDER_STATUS_FLOW = ['Pending', 'Pickup_Requested', 'Assigned_for_Pickup', 'Picked', 'In_Transit', 'Delivered']
+
+
+class FakePathao:
+    """In-memory state of the fake API"""
+
+    def __init__(self, cities=64, zones_per_city=40, stores=3, token_expiry=3600, status_step=60, seed=1):
+        rng = random.Random(seed)
+        self.token_expiry = token_expiry
+        self.status_step = status_step
+        self.cities = [{'city_id': city_id, 'city_name': f'City {city_id}'} for city_id in range(1, cities + 1)]
+        self.zones = {
+            city['city_id']: [
+                {'zone_id': city['city_id'] * 1000 + number, 'zone_name': f"{city['city_name']} Zone {number}"}
+                for number in range(1, rng.randint(max(1, zones_per_city // 2), zones_per_city) + 1)
+            ]
+            for city in self.cities
+        }
+        self.stores = [
+            {'store_id': 100 + number, 'store_name': f'Store {number}', 'store_address': f'{number} Warehouse Road',
+             'is_active': 1, 'city_id': 1, 'zone_id': 1001}
+            for number in range(1, stores + 1)
+        ]
+        self.access_tokens = {}  # token -> expiry (epoch seconds)
+        self.refresh_tokens = set()
+        self.orders = {}  # consignment id -> (merchant order id, created epoch seconds)
+        self.lock = threading.Lock()
+        self.requests = Counter()
+
+    def issue_token(self):
+        access_token = uuid.uuid4().hex
+        refresh_token = uuid.uuid4().hex
+        with self.lock:
+            self.access_tokens[access_token] = time.time() + self.token_expiry
+            self.refresh_tokens.add(refresh_token)
+        return {
+            'token_type': 'Bearer',
+            'expires_in': self.token_expiry,
+            'access_token': access_token,
+            'refresh_token': refresh_token
+        }
+
+    def token_valid(self, header):
+        token = header[len('Bearer '):] if header and header.startswith('Bearer ') else None
+        return token is not None and self.access_tokens.get(token, 0) > time.time()
+
+    def order_status(self, created):
+        step = int((time.time() - created) / self.status_step) if self.status_step else 0
+        return ORDER_STATUS_FLOW[min(step, len(ORDER_STATUS_FLOW) - 1)]
+
+    @staticmethod
+    def delivery_price(city_id, delivery_type, weight):
+        """Inside the stores' city 60, elsewhere 110; on demand +40; +15 per kg over 1 kg"""
+        price = 60 if city_id == 1 else 110
+        if delivery_type == 12:
+            price += 40
+        return price + 15 * max(0, math.ceil(weight - 1))
+
+    def zone_for_address(self, address):
+        """Pick a stable zone for an address so repeated parses agree"""
+        digest = int(hashlib.sha256(address.casefold().encode()).hexdigest(), 16)
+        city = self.cities[digest % len(self.cities)]
+        zones = self.zones[city['city_id']]
+        return city, zones[digest % len(zones)]
+
+
+def create_fake_pathao(state, latency_ms=0, jitter_ms=0, error_rate=0.0):
+    app = Flask(__name__)
+    api = '/aladdin/api/v1'
+
+    def listing(items):
+        return jsonify({'code': 200, 'type': 'success', 'data': {'data': items}})
+
+    def error(code, message):
+        return jsonify({'code': code, 'type': 'error', 'message': message}), code
+
+    @app.before_request
+    def simulate_network():
+        state.requests[request.url_rule.rule if request.url_rule else request.path] += 1
+        if request.path == '/stats':
+            return None
+        delay = latency_ms + random.uniform(-jitter_ms, jitter_ms)
+        if delay > 0:
+            time.sleep(delay / 1000)
+        if random.random() < error_rate:
+            return error(503, 'Service temporarily unavailable')
+        if request.path != f'{api}/issue-token' and not state.token_valid(request.headers.get('Authorization')):
+            return error(401, 'Unauthenticated')
+        return None
+
+    @app.route(f'{api}/issue-token', methods=['POST'])
+    def issue_token():
+        data = request.get_json(silent=True) or {}
+        if data.get('grant_type') == 'refresh_token':
+            with state.lock:
+                if data.get('refresh_token') not in state.refresh_tokens:
+                    return error(401, 'Invalid refresh token')
+                state.refresh_tokens.discard(data['refresh_token'])
+        return jsonify(state.issue_token())
+
+    @app.route(f'{api}/city-list')
+    def city_list():
+        return listing(state.cities)
+
+    @app.route(f'{api}/cities/<int:city_id>/zone-list')
+    def zone_list(city_id):
+        if city_id not in state.zones:
+            return error(404, 'City not found')
+        return listing(state.zones[city_id])
+
+    @app.route(f'{api}/stores')
+    def stores():
+        return listing(state.stores)
+
+    @app.route(f'{api}/address-parser', methods=['POST'])
+    def address_parser():
+        address = ((request.get_json(silent=True) or {}).get('address') or '').strip()
+        if not address:
+            return error(422, 'The address field is required.')
+        city, zone = state.zone_for_address(address)
+        return jsonify({'code': 200, 'type': 'success', 'data': {
+            'district_id': city['city_id'],
+            'district_name': city['city_name'],
+            'zone_id': zone['zone_id'],
+            'zone_name': zone['zone_name'],
+            'hub_id': city['city_id'],
+            'is_implicit': False,
+            'score': 100
+        }})
+
+    @app.route(f'{api}/orders', methods=['POST'])
+    def create_order():
+        data = request.get_json(silent=True) or {}
+        missing = [field for field in ('store_id', 'merchant_order_id', 'recipient_name', 'recipient_phone',
+                                       'recipient_address', 'delivery_type', 'item_type', 'item_quantity',
+                                       'item_weight', 'amount_to_collect') if data.get(field) in (None, '')]
+        if missing:
+            return error(422, f"Missing fields: {', '.join(missing)}")
+
+        consignment_id = 'DT' + uuid.uuid4().hex[:12].upper()
+        with state.lock:
+            state.orders[consignment_id] = (data['merchant_order_id'], time.time())
+        return jsonify({'code': 200, 'type': 'success', 'message': 'Order Created Successfully', 'data': {
+            'consignment_id': consignment_id,
+            'merchant_order_id': data['merchant_order_id'],
+            'order_status': 'Pending',
+            'delivery_fee': state.delivery_price(int(data.get('recipient_city') or 0), int(data['delivery_type']),
+                                                 float(data['item_weight']))
+        }})
+
+    @app.route(f'{api}/merchant/price-plan', methods=['POST'])
+    def price_plan():
+        data = request.get_json(silent=True) or {}
+        missing = [field for field in ('store_id', 'item_type', 'delivery_type', 'item_weight', 'recipient_city',
+                                       'recipient_zone') if data.get(field) in (None, '')]
+        if missing:
+            return error(422, f"Missing fields: {', '.join(missing)}")
+
+        price = state.delivery_price(int(data['recipient_city']), int(data['delivery_type']), float(data['item_weight']))
+        return jsonify({'code': 200, 'type': 'success', 'message': 'price', 'data': {
+            'price': price,
+            'discount': 0,
+            'promo_discount': 0,
+            'plan_id': 1,
+            'cod_enabled': 1,
+            'cod_percentage': 0.01,
+            'additional_charge': 0,
+            'final_price': price
+        }})
+
+    @app.route(f'{api}/orders/<consignment_id>/info')
+    def order_info(consignment_id):
+        order = state.orders.get(consignment_id)
+        if not order:
+            return error(404, 'Order not found')
+        merchant_order_id, created = order
+        return jsonify({'code': 200, 'type': 'success', 'data': {
+            'consignment_id': consignment_id,
+            'merchant_order_id': merchant_order_id,
+            'order_status': state.order_status(created),
+            'updated_at': datetime.now(UTC).strftime('%Y-%m-%d %H:%M:%S')
+        }})
+
+    @app.route('/stats')
+    def stats():
+        return jsonify({
+            'requests': dict(state.requests),
+            'orders': len(state.orders),
+            'active_tokens': sum(expiry > time.time() for expiry in state.access_tokens.values())
+        })
+
+    return app
+
+
+def fake_pathao():
+    parser = argparse.ArgumentParser(description='Run a stand-in Pathao API for testing')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8001)
+    parser.add_argument('--latency-ms', type=float, default=0, help='Added delay per request')
+    parser.add_argument('--jitter-ms', type=float, default=0, help='Random +/- variation of the delay')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of requests answered with 503')
+    parser.add_argument('--token-expiry', type=int, default=3600, help='Access token lifetime in seconds')
+    parser.add_argument('--cities', type=int, default=64)
+    parser.add_argument('--zones-per-city', type=int, default=40, help='Maximum zones per city')
+    parser.add_argument('--stores', type=int, default=3)
+    parser.add_argument('--status-step', type=int, default=60, help='Seconds between order status changes')
+    parser.add_argument('--seed', type=int, default=1, help='Seed for the generated dataset')
+    args = parser.parse_args()
+
+    state = FakePathao(args.cities, args.zones_per_city, args.stores, args.token_expiry, args.status_step, args.seed)
+    app = create_fake_pathao(state, args.latency_ms, args.jitter_ms, args.error_rate)
+    zones = sum(len(zones) for zones in state.zones.values())
+    print(f"Fake Pathao API with {len(state.cities)} cities, {zones} zones, {len(state.stores)} stores "
+          f"on http://{args.host}:{args.port}")
+    app.run(host=args.host, port=args.port, threaded=True)
+
+if __name__ == '__main__':
+    fake_pathao()
@@ -1,7 +1,8 @@
 from flask_wtf import FlaskForm
 from wtforms import StringField, PasswordField, SelectField, TextAreaField, IntegerField, DecimalField, HiddenField
-from wtforms.validators import DataRequired, Email, Length, NumberRange, ValidationError, EqualTo, Regexp
+from wtforms.validators import DataRequired, Email, Length, NumberRange, Optional, ValidationError, EqualTo, Regexp
 from models import User, Product, ProductType, SizeGroup, Customer
+from order_service import InventorySnapshot
 
 class LoginForm(FlaskForm):
     username = StringField('Username', validators=[
@@ -210,9 +211,10 @@ class OrderItemForm(FlaskForm):
     def validate_quantity(self, quantity):
         if self.product_id.data:
             product = Product.query.get(self.product_id.data)
-            if product and quantity.data > product.get_total_available_quantity():
+            if product:
                 available = product.get_total_available_quantity()
-                raise ValidationError(f'Only {available} items available (including compatible sizes)')
+                if quantity.data > available:
+                    raise ValidationError(f'Only {available} items available (including compatible sizes)')
 
 class CreateOrderForm(FlaskForm):
     # Customer Information
@@ -231,36 +233,79 @@ class CreateOrderForm(FlaskForm):
     ])
     
     # Location Selection (Pathao Integration)
-    city_id = SelectField('City', coerce=int, validators=[
+    # Options are loaded over AJAX; submitted values are checked in validate_zone_id
+    city_id = SelectField('City', coerce=int, validate_choice=False, validators=[
         DataRequired(message='Please select a city')
     ])
-    zone_id = SelectField('Zone', coerce=int, validators=[
+    zone_id = SelectField('Zone', coerce=int, validate_choice=False, validators=[
         DataRequired(message='Please select a zone')
     ])
     
     # Products will be handled via JavaScript and submitted as JSON
     products_data = HiddenField('Products Data')
     
+    # Identifies the stock holds placed while this form is being filled in
+    hold_key = HiddenField('Hold Key', validators=[
+        Length(max=64, message='Invalid hold key')
+    ])
+    
+    # Lets a resubmitted form replay the original result instead of creating a duplicate order
+    idempotency_key = HiddenField('Request Key', validators=[
+        Length(max=64, message='Invalid request key')
+    ])
+    
+    # Parcel details sent to Pathao; they also decide the delivery charge quote
+    item_weight = DecimalField('Parcel Weight (kg)', places=1, validators=[
+        DataRequired(message='Parcel weight is required'),
+        NumberRange(min=0.1, max=30, message='Parcel weight must be between 0.1 and 30 kg')
+    ], default=0.5)
+    delivery_type = SelectField('Delivery Type', coerce=int, choices=[
+        (48, 'Normal Delivery'),
+        (12, 'On Demand Delivery')
+    ], default=48)
+    
     # Order Financial Details
+    # Left blank, the delivery charge is quoted from Pathao
     delivery_charge = IntegerField('Delivery Charges', validators=[
+        Optional(),
         NumberRange(min=0, message='Delivery charges cannot be negative')
-    ], default=0)
+    ])
     discount = IntegerField('Discount', validators=[
         NumberRange(min=0, message='Discount cannot be negative')
     ], default=0)
     
     def __init__(self, *args, **kwargs):
         super(CreateOrderForm, self).__init__(*args, **kwargs)
+        self.inventory_snapshot = None
+        self.product_lines = []
+        self.location_names = {}
         
-        # Load all location data from database for validation
-        from models import PathaoCity, PathaoZone
+        self.city_id.choices = [(0, 'Select City')]
+        self.zone_id.choices = [(0, 'Select Zone')]
+    
+    def validate_zone_id(self, zone_id):
+        """Check the submitted city/zone pair with a single indexed lookup"""
+        from pathao_service import PathaoService
         
-        self.city_id.choices = [(0, 'Select City')] + [
-            (city.city_id, city.city_name) for city in PathaoCity.query.all()
-        ]
-        self.zone_id.choices = [(0, 'Select Zone')] + [
-            (zone.zone_id, zone.zone_name) for zone in PathaoZone.query.all()
-        ]
+        if not self.city_id.data:
+            return
+        
+        location_names = PathaoService.lookup_location(self.city_id.data, zone_id.data)
+        if not location_names:
+            raise ValidationError('Please select a zone in the selected city')
+        self.location_names = location_names
+    
+    def validate(self, extra_validators=None):
+        """Validate the fields, then settle the delivery charge and check stock.
+        
+        Quoting may call Pathao and commit (token renewal, quote cache), so
+        it happens before the stock check locks the product rows that
+        fulfilment goes on to use. Neither runs for a submission with
+        invalid fields, which therefore never holds those locks.
+        """
+        if not super(CreateOrderForm, self).validate(extra_validators):
+            return False
+        return self.quote_delivery_charge() and self.check_stock()
     
     def validate_products_data(self, products_data):
         """Validate the products data submitted via JavaScript"""
@@ -278,6 +323,7 @@ class CreateOrderForm(FlaskForm):
             raise ValidationError('Please select at least one product')
         
         # Validate each product
+        lines = []
         for i, product_data in enumerate(products):
             if not isinstance(product_data, dict):
                 raise ValidationError(f'Invalid product data format for item {i+1}')
@@ -294,14 +340,54 @@ class CreateOrderForm(FlaskForm):
             if quantity < 1:
                 raise ValidationError(f'Quantity must be at least 1 for item {i+1}')
             
-            # Check if product exists and is in stock
-            product = Product.query.get(product_id)
+            lines.append((product_id, quantity))
+        
+        # Stock is checked in check_stock once the other fields are valid
+        self.product_lines = lines
+    
+    def quote_delivery_charge(self):
+        """Fill in a blank delivery charge from Pathao's rates"""
+        from pathao_service import PathaoService
+        
+        if self.delivery_charge.data is not None:
+            return True
+        
+        quote = PathaoService.get_delivery_quote(
+            self.city_id.data, self.zone_id.data, self.item_weight.data, self.delivery_type.data
+        )
+        if not quote:
+            # Never save an order with a charge nobody set
+            self.delivery_charge.errors.append('Pathao rates are unavailable right now. Please enter the delivery charge.')
+            return False
+        self.delivery_charge.data = round(quote['price'])
+        return True
+    
+    def check_stock(self):
+        """Check stock for all product lines together"""
+        # Load all products and compatible sizes once; fulfilment reuses this snapshot
+        snapshot = InventorySnapshot.load(
+            [product_id for product_id, _ in self.product_lines],
+            for_update=True,
+            exclude_hold_key=self.hold_key.data
+        )
+        self.inventory_snapshot = snapshot
+        
+        # Check stock for all lines together, then hand back the allocations
+        state = snapshot.checkpoint()
+        for i, (product_id, quantity) in enumerate(self.product_lines):
+            product = snapshot.get(product_id)
             if not product:
-                raise ValidationError(f'Product not found for item {i+1}')
+                self.products_data.errors.append(f'Product not found for item {i+1}')
+                return False
             
-            if not product.can_fulfill_order(quantity):
-                available = product.get_total_available_quantity()
-                raise ValidationError(f'Only {available} items available for {product.get_display_name()} (including compatible sizes)')
+            if snapshot.allocate(product_id, quantity) is None:
+                available = snapshot.total_available(product_id)
+                self.products_data.errors.append(
+                    f'Only {available} items available for {product.get_display_name()} (including compatible sizes)'
+                )
+                return False
+        snapshot.restore(state)
+        return True
     
     def validate_customer_phone(self, phone):
         # Remove all non-digit characters for validation
@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+"""
+Bulk-import orders from a CSV or JSON-lines file.
+
+Usage: python3 import_orders.py orders.csv --user admin [--chunk-size 500] [--report report.json]
+"""
+
+import argparse
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from app import create_app
+from models import User
+from order_import import OrderImporter
+
+def import_orders():
+    parser = argparse.ArgumentParser(description='Bulk-import orders from a CSV or JSON-lines file')
+    parser.add_argument('path', help='CSV (.csv) or JSON-lines (.jsonl) file')
+    parser.add_argument('--user', required=True, help='Username the orders are created under')
+    parser.add_argument('--format', choices=['csv', 'jsonl'], help='File format (default: from extension)')
+    parser.add_argument('--chunk-size', type=int, help='Orders committed per transaction')
+    parser.add_argument('--report', help='Write the per-row result report to this JSON file')
+    args = parser.parse_args()
+
+    fmt = args.format or ('csv' if args.path.lower().endswith('.csv') else 'jsonl')
+
+    app = create_app()
+
+    with app.app_context():
+        user = User.query.filter_by(username=args.user).first()
+        if not user:
+            print(f"User '{args.user}' not found.")
+            sys.exit(1)
+
+        importer = OrderImporter(user.id, chunk_size=args.chunk_size)
+        with open(args.path, 'rb') as stream:
+            report = importer.run(OrderImporter.read_rows(stream, fmt))
+
+        for result in report['results']:
+            if result['status'] == 'failed':
+                print(f"Row {result['row']}: {result['error']}")
+
+        if args.report:
+            with open(args.report, 'w') as f:
+                json.dump(report, f, indent=2)
+
+        print(f"Done. {report['created']} orders created, {report['failed']} rows failed.")
+
+if __name__ == '__main__':
+    import_orders()
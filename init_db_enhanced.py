@@ -12,7 +12,7 @@ from datetime import datetime, timedelta, UTC
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
 from app import create_app
-from models import db, User, PathaoCity
+from models import db, User
 from pathao_service import PathaoService
 
 def init_database():
@@ -55,15 +55,14 @@ def create_users():
 
 
 def create_pathao_data():
-    """Create Pathao cities and zones"""
-    print("Fetching Pathao Cities")
-    PathaoService.get_cities(force_refresh = True)
-    # for each PathaoCity, retrieve PathaoZoneS
-    print("Fetching Pathao Zones")
-    for city in PathaoCity.query.all():
-        PathaoService.get_zones(force_refresh = True, city_id = city.city_id)
-    print("Fetching Pathao Stores")
-    PathaoService.get_stores(force_refresh = True)
+    """Create Pathao cities, zones and stores"""
+    print("Fetching Pathao Cities, Zones and Stores")
+    try:
+        summary = PathaoService.refresh_location_data()
+    except Exception as e:
+        print(f"⚠️  Failed to fetch Pathao data: {str(e)}")
+        return
+    print(f"   {summary['cities']} cities, {summary['zones']} zones, {summary['stores']} stores")
 
 if __name__ == '__main__':
     init_database()
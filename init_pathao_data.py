@@ -1,42 +1,46 @@
 #!/usr/bin/env python3
 """
-Repopulate Pathao tables (cities, zones, stores, token) without touching other data.
+Refresh Pathao tables (cities, zones, stores) without touching other data.
+
+Usage:
+  python3 init_pathao_data.py [--workers 8]
+
+Zone lists are fetched concurrently and the new data replaces the old in a
+single transaction, so location data stays available while this runs.
 """
 
+import argparse
 import os
 import sys
+import time
 
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
 from app import create_app
-from models import db, PathaoCity, PathaoZone, PathaoToken, PathaoStore
 from pathao_service import PathaoService
 
 def refresh_pathao_data():
+    parser = argparse.ArgumentParser(description='Refresh Pathao cities, zones and stores')
+    parser.add_argument('--workers', type=int, help='Parallel zone requests (default: PATHAO_MAX_CONCURRENT_REQUESTS)')
+    args = parser.parse_args()
+
     app = create_app()
 
     with app.app_context():
-        print("Clearing Pathao tables...")
-        PathaoZone.query.delete()
-        PathaoCity.query.delete()
-        PathaoStore.query.delete()
-        PathaoToken.query.delete()
-        db.session.commit()
-
-        print("Fetching cities...")
-        PathaoService.get_cities(force_refresh=True)
-
-        print("Fetching zones...")
-        for city in PathaoCity.query.all():
-            PathaoService.get_zones(force_refresh=True, city_id=city.city_id)
-
-        print("Fetching stores...")
-        PathaoService.get_stores(force_refresh=True)
-
-        cities = PathaoCity.query.count()
-        zones = PathaoZone.query.count()
-        stores = PathaoStore.query.count()
-        print(f"Done. {cities} cities, {zones} zones, {stores} stores.")
+        print("Fetching cities, zones and stores...")
+        started = time.perf_counter()
+        try:
+            summary = PathaoService.refresh_location_data(max_workers=args.workers)
+        except Exception as e:
+            print(f"Refresh failed, existing data kept: {str(e)}")
+            sys.exit(1)
+
+        stores = summary['stores'] if summary['stores'] is not None else 'unchanged'
+        print(f"Done in {time.perf_counter() - started:.1f}s. "
+              f"{summary['cities']} cities, {summary['zones']} zones, {stores} stores.")
+        if summary['failed_cities']:
+            print(f"Zones not refreshed for cities: {', '.join(map(str, summary['failed_cities']))}")
+            sys.exit(1)
 
 if __name__ == '__main__':
     refresh_pathao_data()
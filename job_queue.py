@@ -0,0 +1,174 @@
+import json
+import os
+import random
+import socket
+import threading
+from datetime import datetime, timedelta, UTC
+from sqlalchemy import delete
+from models import db, BackgroundJob
+
+# kind -> (handler, on_failure)
+HANDLERS = {}
+# Kinds never handed to another worker when theirs stops mid-job
+NO_RECLAIM_KINDS = set()
+
+
+class JobError(Exception):
+    """Raised by a handler when an attempt failed and may be retried"""
+
+
+class JobNeedsCheck(Exception):
+    """Raised by a handler when an attempt may have taken effect.
+
+    The job fails without a retry and without on_failure, for a person
+    to check what happened.
+    """
+
+
+def job_handler(kind, on_failure=None, reclaim=True):
+    """Register a function as the handler for a job kind.
+
+    The handler receives the job payload and runs inside an app context;
+    its database changes are committed together with the job's success.
+    on_failure(payload, error) runs when the last attempt has failed.
+    With reclaim=False a job whose worker stopped mid-run is failed for a
+    person to check instead of being run again, for handlers whose side
+    effects must not be repeated; on_failure does not run for it.
+    """
+    def decorator(func):
+        HANDLERS[kind] = (func, on_failure)
+        if not reclaim:
+            NO_RECLAIM_KINDS.add(kind)
+        return func
+    return decorator
+
+
+def retry_delay(attempts, config):
+    """Exponential backoff with jitter for the attempt that just failed"""
+    delay = min(
+        config['JOB_RETRY_BASE_SECONDS'] * 2 ** (attempts - 1),
+        config['JOB_RETRY_MAX_SECONDS']
+    )
+    return delay * random.uniform(0.5, 1.0)
+
+
+def run_job(app, job_id):
+    """Run one claimed job and record its outcome"""
+    job = db.session.get(BackgroundJob, job_id)
+    handler, on_failure = HANDLERS.get(job.kind, (None, None))
+    payload = job.payload_data
+
+    try:
+        if handler is None:
+            raise LookupError(f'No handler registered for job kind {job.kind}')
+        result = handler(payload)
+    except Exception as e:
+        db.session.rollback()
+        error = str(e) or e.__class__.__name__
+        job = db.session.get(BackgroundJob, job_id)
+        job.last_error = error
+        job.locked_by = None
+        job.locked_at = None
+
+        if isinstance(e, JobError) and job.attempts < job.max_attempts:
+            job.status = 'queued'
+            job.run_at = datetime.now(UTC) + timedelta(
+                seconds=retry_delay(job.attempts, app.config)
+            )
+            app.logger.warning(f"Job {job.id} ({job.kind}) attempt {job.attempts} failed, retrying: {error}")
+        else:
+            job.status = 'failed'
+            app.logger.error(f"Job {job.id} ({job.kind}) failed after {job.attempts} attempts: {error}")
+            if on_failure and not isinstance(e, JobNeedsCheck):
+                on_failure(payload, error)
+        db.session.commit()
+        return
+
+    job.status = 'succeeded'
+    job.result = json.dumps(result or {})
+    job.last_error = None
+    job.locked_by = None
+    job.locked_at = None
+    db.session.commit()
+
+
+def purge_finished_jobs(retention_days):
+    """Delete succeeded and failed jobs older than the retention period"""
+    cutoff = datetime.now(UTC) - timedelta(days=retention_days)
+    db.session.execute(delete(BackgroundJob).where(
+        BackgroundJob.status.in_(['succeeded', 'failed']),
+        BackgroundJob.updated_at < cutoff
+    ))
+    db.session.commit()
+
+
+def fail_abandoned_jobs(app):
+    """Fail running jobs whose worker stopped and that must not be run again"""
+    no_reclaim_kinds = sorted(NO_RECLAIM_KINDS)
+    for job_id, kind, payload, error in BackgroundJob.fail_abandoned(
+        app.config['JOB_LOCK_TIMEOUT_SECONDS'], no_reclaim_kinds
+    ):
+        app.logger.error(f"Job {job_id} ({kind}) failed: {error}")
+        on_failure = HANDLERS.get(kind, (None, None))[1]
+        if on_failure and kind not in NO_RECLAIM_KINDS:
+            on_failure(json.loads(payload), error)
+    db.session.commit()
+
+
+class JobWorker(threading.Thread):
+    """Thread that claims and runs due jobs until stopped"""
+
+    PURGE_INTERVAL_SECONDS = 3600
+    ABANDONED_CHECK_SECONDS = 60
+
+    def __init__(self, app, name):
+        super().__init__(name=name, daemon=True)
+        self.app = app
+        self.worker_id = f'{socket.gethostname()}:{os.getpid()}:{name}'
+        self.stop_event = threading.Event()
+
+    def run(self):
+        config = self.app.config
+        last_purge = None
+        last_abandoned_check = None
+        while not self.stop_event.is_set():
+            job_id = None
+            try:
+                with self.app.app_context():
+                    now = datetime.now(UTC)
+                    if last_purge is None or (now - last_purge).total_seconds() > self.PURGE_INTERVAL_SECONDS:
+                        purge_finished_jobs(config['JOB_RETENTION_DAYS'])
+                        last_purge = now
+                    if (last_abandoned_check is None or
+                            (now - last_abandoned_check).total_seconds() > self.ABANDONED_CHECK_SECONDS):
+                        fail_abandoned_jobs(self.app)
+                        last_abandoned_check = now
+
+                    job_id = BackgroundJob.claim_next(
+                        self.worker_id, config['JOB_LOCK_TIMEOUT_SECONDS'], sorted(NO_RECLAIM_KINDS)
+                    )
+                    if job_id:
+                        run_job(self.app, job_id)
+            except Exception as e:
+                self.app.logger.error(f"Job worker {self.worker_id} error: {str(e)}")
+
+            if not job_id:
+                self.stop_event.wait(config['JOB_POLL_SECONDS'])
+
+    def stop(self):
+        self.stop_event.set()
+
+
+def start_workers(app, count=None):
+    """Start background worker threads for this process"""
+    # Make sure every handler is registered before the first claim
+    import shipping  # noqa: F401
+    import delivery_sync  # noqa: F401
+    import webhook_inbox  # noqa: F401
+    import pathao_service  # noqa: F401
+
+    count = app.config['JOB_WORKER_THREADS'] if count is None else count
+    workers = [JobWorker(app, f'job-worker-{index}') for index in range(count)]
+    for worker in workers:
+        worker.start()
+    return workers
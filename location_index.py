@@ -0,0 +1,100 @@
+import json
+import threading
+import time
+from types import MappingProxyType
+from flask import current_app
+from sqlalchemy import select
+from models import db, PathaoCity, PathaoZone, CacheVersion
+
+LOCATION_CACHE = 'pathao_locations'
+
+
+class LocationIndex:
+    """Read-only snapshot of Pathao cities and zones.
+
+    Built once per version of the location tables and shared by every
+    request in the process, so lookups are dictionary reads and the
+    /api/cities and /api/zones payloads are serialised only once.
+    """
+
+    def __init__(self, version, cities, zones):
+        self.version = version
+        self.city_names = MappingProxyType({city_id: name for city_id, name, _ in cities})
+        self.zones = MappingProxyType({zone_id: (city_id, name) for zone_id, city_id, name, _ in zones})
+
+        city_zones = {}
+        for zone_id, city_id, name, _ in zones:
+            city_zones.setdefault(city_id, []).append((zone_id, name))
+        self.city_zones = MappingProxyType({city_id: tuple(items) for city_id, items in city_zones.items()})
+
+        # Last refresh times, to tell when the data is due for a refresh
+        self.cities_updated_at = max((updated for *_, updated in cities if updated), default=None)
+        zones_updated_at = {}
+        for _, city_id, _, updated in zones:
+            if updated and (city_id not in zones_updated_at or updated > zones_updated_at[city_id]):
+                zones_updated_at[city_id] = updated
+        self.zones_updated_at = MappingProxyType(zones_updated_at)
+
+        self.cities_json = json.dumps(
+            [{'id': city_id, 'name': name} for city_id, name, _ in cities]
+        ).encode()
+        self._zones_json = {
+            city_id: json.dumps([{'id': zone_id, 'name': name} for zone_id, name in items]).encode()
+            for city_id, items in self.city_zones.items()
+        }
+
+    @classmethod
+    def load(cls, version):
+        cities = db.session.execute(
+            select(PathaoCity.city_id, PathaoCity.city_name, PathaoCity.last_updated)
+            .order_by(PathaoCity.city_name)
+        ).all()
+        zones = db.session.execute(
+            select(PathaoZone.zone_id, PathaoZone.city_id, PathaoZone.zone_name, PathaoZone.last_updated)
+            .order_by(PathaoZone.zone_name)
+        ).all()
+        return cls(version, cities, zones)
+
+    def zones_json(self, city_id):
+        return self._zones_json.get(city_id, b'[]')
+
+    def lookup(self, city_id, zone_id):
+        """Location names if the zone belongs to the city, else None"""
+        zone = self.zones.get(zone_id)
+        if not zone or zone[0] != city_id:
+            return None
+        return {'city_name': self.city_names.get(city_id), 'zone_name': zone[1]}
+
+
+_indexes = {}  # Database URL -> (index, monotonic time of last version check)
+_indexes_lock = threading.Lock()
+
+
+def get_location_index():
+    """Get this process's location index, rebuilding it if the data changed.
+
+    The version stamp is read at most every LOCATION_INDEX_CHECK_SECONDS,
+    so changes made by another worker show up within that interval.
+    """
+    key = str(db.engine.url)
+    index, checked_at = _indexes.get(key, (None, 0))
+    now = time.monotonic()
+    if index is not None and now - checked_at < current_app.config['LOCATION_INDEX_CHECK_SECONDS']:
+        return index
+
+    # Read the stamp before the data, so an index is never newer than its stamp
+    version = CacheVersion.current(LOCATION_CACHE)
+    with _indexes_lock:
+        index, _ = _indexes.get(key, (None, 0))
+        if index is None or index.version != version:
+            index = LocationIndex.load(version)
+        _indexes[key] = (index, now)
+    return index
+
+
+def invalidate_location_index():
+    """Make the next get_location_index call check the version stamp"""
+    key = str(db.engine.url)
+    with _indexes_lock:
+        if key in _indexes:
+            _indexes[key] = (_indexes[key][0], 0)
@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+"""
+Bring an existing database up to date with the current models.
+
+db.create_all() only creates missing tables; this script also adds
+columns and indexes declared on tables that already exist, merges
+duplicate customers before their phone numbers become unique, and
+rebuilds order item tracking codes before they become unique. Safe to
+run repeatedly.
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from sqlalchemy import inspect, select, update, delete, func, text, bindparam
+from app import create_app
+from models import db, Customer, Order, OrderItem, Product, PathaoDelivery
+
+BATCH_SIZE = 500
+
+def add_missing_columns():
+    """Add declared columns that are missing from existing tables.
+
+    New columns are added as nullable; backfills happen in later steps.
+    """
+    inspector = inspect(db.engine)
+    preparer = db.engine.dialect.identifier_preparer
+    for table in db.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {column['name'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            column_type = column.type.compile(dialect=db.engine.dialect)
+            print(f"  {table.name}.{column.name}")
+            with db.engine.begin() as conn:
+                conn.execute(text(
+                    f'ALTER TABLE {preparer.format_table(table)} '
+                    f'ADD COLUMN {preparer.format_column(column)} {column_type}'
+                ))
+
+def create_missing_indexes(unique):
+    """Create any declared index that does not exist yet.
+
+    Unique indexes are created separately, once duplicate rows are merged;
+    an existing non-unique index of the same name is replaced.
+    """
+    inspector = inspect(db.engine)
+    for table in db.metadata.sorted_tables:
+        existing = {index['name']: bool(index['unique']) for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if bool(index.unique) != unique or existing.get(index.name) == unique:
+                continue
+            if index.name in existing:
+                print(f"  replacing {index.name}")
+                index.drop(db.engine)
+            index.create(db.engine)
+
+def backfill_customer_phones(batch_size=BATCH_SIZE):
+    """Fill Customer.phone_normalized in small committed batches"""
+    total = 0
+    last_id = 0
+    while True:
+        rows = db.session.execute(
+            select(Customer.id, Customer.phone)
+            .where(Customer.phone_normalized.is_(None), Customer.id > last_id)
+            .order_by(Customer.id)
+            .limit(batch_size)
+        ).all()
+        if not rows:
+            break
+
+        # Numbers without digits stay NULL rather than colliding on ''
+        db.session.execute(update(Customer), [
+            {'id': customer_id, 'phone_normalized': Customer.normalize_phone(phone) or None}
+            for customer_id, phone in rows
+        ])
+        db.session.commit()
+        total += len(rows)
+        last_id = rows[-1].id
+    print(f"  {total} customers backfilled")
+
+def backfill_delivery_final_flags(batch_size=BATCH_SIZE):
+    """Fill PathaoDelivery.is_final from the stored status in small committed batches"""
+    total = 0
+    while True:
+        rows = db.session.execute(
+            select(PathaoDelivery.id, PathaoDelivery.order_status)
+            .where(PathaoDelivery.is_final.is_(None))
+            .order_by(PathaoDelivery.id)
+            .limit(batch_size)
+        ).all()
+        if not rows:
+            break
+
+        db.session.execute(update(PathaoDelivery), [
+            {'id': delivery_id, 'is_final': PathaoDelivery.is_final_status(status)}
+            for delivery_id, status in rows
+        ])
+        db.session.commit()
+        total += len(rows)
+    print(f"  {total} deliveries backfilled")
+
+def rebuild_tracking_codes(batch_size=BATCH_SIZE):
+    """Give order items the current, collision-free tracking codes in small committed batches"""
+    total = 0
+    last_id = 0
+    while True:
+        rows = db.session.execute(
+            select(OrderItem.id, OrderItem.tracking_code, Product.product_code, Product.size)
+            .join(Product, OrderItem.product_id == Product.id)
+            .where(OrderItem.id > last_id)
+            .order_by(OrderItem.id)
+            .limit(batch_size)
+        ).all()
+        if not rows:
+            break
+
+        changes = []
+        for row in rows:
+            tracking_code = OrderItem.format_tracking_code(row, row.id)
+            if row.tracking_code != tracking_code:
+                changes.append({'id': row.id, 'tracking_code': tracking_code})
+        if changes:
+            db.session.execute(update(OrderItem), changes)
+            db.session.commit()
+        total += len(changes)
+        last_id = rows[-1].id
+    print(f"  {total} tracking codes rebuilt")
+
+def merge_duplicate_customers(batch_size=BATCH_SIZE):
+    """Merge customers sharing a normalized phone into the oldest record.
+
+    The kept record takes the name and address of the most recent one.
+    Orders are re-pointed a batch of duplicates at a time, with a commit
+    after each batch, so no transaction holds order rows for long.
+    """
+    phones = db.session.scalars(
+        select(Customer.phone_normalized)
+        .where(Customer.phone_normalized.isnot(None))
+        .group_by(Customer.phone_normalized)
+        .having(func.count() > 1)
+    ).all()
+    db.session.commit()
+
+    order_table = Order.__table__
+    repoint = update(order_table).where(
+        order_table.c.customer_id == bindparam('duplicate_id')
+    ).values(customer_id=bindparam('keep_id'))
+
+    merged = 0
+    for start in range(0, len(phones), batch_size):
+        batch = phones[start:start + batch_size]
+        customers = db.session.execute(
+            select(Customer.id, Customer.phone_normalized, Customer.name, Customer.address)
+            .where(Customer.phone_normalized.in_(batch))
+            .order_by(Customer.id)
+        ).all()
+
+        groups = {}
+        for customer in customers:
+            groups.setdefault(customer.phone_normalized, []).append(customer)
+
+        keep_rows = []
+        repoint_rows = []
+        for group in groups.values():
+            keep, latest = group[0], group[-1]
+            keep_rows.append({'id': keep.id, 'name': latest.name, 'address': latest.address})
+            repoint_rows.extend(
+                {'duplicate_id': duplicate.id, 'keep_id': keep.id} for duplicate in group[1:]
+            )
+
+        db.session.execute(repoint, repoint_rows)
+        db.session.execute(
+            delete(Customer).where(Customer.id.in_([row['duplicate_id'] for row in repoint_rows]))
+        )
+        db.session.execute(update(Customer), keep_rows)
+        db.session.commit()
+        merged += len(repoint_rows)
+    print(f"  {merged} duplicate customers merged")
+
+def migrate():
+    app = create_app()
+
+    with app.app_context():
+        print("Creating missing tables...")
+        db.create_all()
+
+        print("Adding missing columns...")
+        add_missing_columns()
+
+        print("Creating missing indexes...")
+        create_missing_indexes(unique=False)
+
+        print("Normalizing customer phone numbers...")
+        backfill_customer_phones()
+
+        print("Flagging finished deliveries...")
+        backfill_delivery_final_flags()
+
+        print("Merging duplicate customers...")
+        merge_duplicate_customers()
+
+        print("Rebuilding order item tracking codes...")
+        rebuild_tracking_codes()
+
+        print("Creating missing unique indexes...")
+        create_missing_indexes(unique=True)
+
+        print("Done.")
+
+if __name__ == '__main__':
+    migrate()
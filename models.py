@@ -1,10 +1,24 @@
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import func, select, update, and_, or_, case, tuple_
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import joinedload, selectinload
 from flask_login import UserMixin
 from werkzeug.security import generate_password_hash, check_password_hash
-from datetime import datetime, UTC
+from datetime import datetime, timedelta, UTC
+import hashlib
+import json
+import re
 
 db = SQLAlchemy()
 
+def dialect_insert(model):
+    """INSERT construct for the current database that supports ON CONFLICT clauses"""
+    if db.session.get_bind().dialect.name == 'postgresql':
+        return postgresql_insert(model)
+    return sqlite_insert(model)
+
 class User(UserMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(80), unique=True, nullable=False)
@@ -37,6 +51,8 @@ class Customer(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
     phone = db.Column(db.String(20), nullable=False)
+    # Digits-only phone used to recognise returning customers (see normalize_phone)
+    phone_normalized = db.Column(db.String(20), unique=True, index=True)
     address = db.Column(db.Text, nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.now(UTC))
     updated_at = db.Column(db.DateTime, default=datetime.now(UTC), onupdate=datetime.now(UTC))
@@ -44,6 +60,71 @@ class Customer(db.Model):
     # Relationships
     orders = db.relationship('Order', backref='customer', lazy=True)
     
+    @staticmethod
+    def normalize_phone(phone):
+        """Reduce a phone number to its digits in local form.
+        
+        Bangladeshi numbers written with the country code (+880 / 880 / 0088)
+        are brought to the 11-digit local form, so '+880 1711-000000' and
+        '01711000000' are the same customer.
+        """
+        digits = re.sub(r'\D', '', phone or '')
+        if digits.startswith('00'):
+            digits = digits[2:]
+        if digits.startswith('880') and len(digits) == 13:
+            digits = digits[2:]
+        return digits
+    
+    @classmethod
+    def upsert_many(cls, customers):
+        """Insert customers, or update the existing ones with the same phone.
+        
+        customers is a list of dicts with name, phone and address. The latest
+        name and address win. Runs as a single INSERT ... ON CONFLICT, so
+        concurrent orders for a new phone number cannot create duplicates.
+        Returns {normalized phone: customer id}.
+        """
+        now = datetime.now(UTC)
+        rows = {}
+        for customer in customers:
+            key = cls.normalize_phone(customer['phone'])
+            rows[key] = {
+                'name': customer['name'],
+                'phone': customer['phone'],
+                'phone_normalized': key,
+                'address': customer['address'],
+                'created_at': now,
+                'updated_at': now
+            }
+        if not rows:
+            return {}
+        
+        stmt = dialect_insert(cls)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['phone_normalized'],
+            set_={
+                'name': stmt.excluded.name,
+                'phone': stmt.excluded.phone,
+                'address': stmt.excluded.address,
+                'updated_at': stmt.excluded.updated_at
+            }
+        ).returning(cls.phone_normalized, cls.id)
+        return dict(db.session.execute(stmt, list(rows.values())).all())
+    
+    @classmethod
+    def upsert(cls, name, phone, address):
+        """Insert or update a single customer and return its id"""
+        ids = cls.upsert_many([{'name': name, 'phone': phone, 'address': address}])
+        return ids[cls.normalize_phone(phone)]
+    
+    @classmethod
+    def find_by_phone(cls, phone):
+        """Look up a customer by any formatting of their phone number"""
+        key = cls.normalize_phone(phone)
+        if not key:
+            return None
+        return cls.query.filter_by(phone_normalized=key).first()
+    
     def __repr__(self):
         return f'<Customer {self.name}>'
 
@@ -76,6 +157,8 @@ class PathaoToken(db.Model):
     refresh_token = db.Column(db.Text, nullable=False)
     expires_at = db.Column(db.DateTime, nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.now(UTC))
+    refreshing_by = db.Column(db.String(100))  # Worker renewing the token, if any
+    refresh_started_at = db.Column(db.DateTime)
     
     @property
     def is_expired(self):
@@ -85,9 +168,227 @@ class PathaoToken(db.Model):
             expires_at = expires_at.replace(tzinfo=UTC)
         return datetime.now(UTC) >= expires_at
     
+    @property
+    def is_usable(self):
+        return bool(self.access_token) and not self.is_expired
+    
+    @classmethod
+    def current(cls):
+        return cls.query.order_by(cls.id).first()
+    
+    @classmethod
+    def ensure_row(cls):
+        """Get the token row, creating an expired placeholder if there is none.
+        
+        Renewal claims are taken on this row, so it must exist before the
+        first token is issued. Commits.
+        """
+        token = cls.current()
+        if token:
+            return token
+        
+        try:
+            with db.session.begin_nested():
+                db.session.add(cls(id=1, access_token='', refresh_token='', expires_at=datetime.now(UTC)))
+        except IntegrityError:
+            pass  # Created by another worker
+        db.session.commit()
+        return cls.current()
+    
+    @classmethod
+    def claim_refresh(cls, token_id, worker_id, lease_seconds):
+        """Atomically take the right to renew the token.
+        
+        Only one worker across all processes holds the claim at a time; a
+        claim older than the lease is assumed abandoned. Commits. Returns
+        True if the claim was taken.
+        """
+        now = datetime.now(UTC)
+        result = db.session.execute(
+            update(cls)
+            .where(
+                cls.id == token_id,
+                or_(cls.refresh_started_at.is_(None), cls.refresh_started_at < now - timedelta(seconds=lease_seconds))
+            )
+            .values(refreshing_by=worker_id, refresh_started_at=now)
+            .execution_options(synchronize_session=False)
+        )
+        db.session.commit()
+        return result.rowcount == 1
+    
     def __repr__(self):
         return f'<PathaoToken expires_at={self.expires_at}>'
 
+class CacheVersion(db.Model):
+    """Version stamps that let every worker notice when cached data changed"""
+    name = db.Column(db.String(50), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=lambda: datetime.now(UTC))
+    
+    @classmethod
+    def bump(cls, name):
+        """Advance a stamp inside the current transaction; commits with the data it guards"""
+        stmt = dialect_insert(cls).values(name=name, version=1, updated_at=datetime.now(UTC))
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['name'],
+            set_={'version': cls.version + 1, 'updated_at': stmt.excluded.updated_at}
+        )
+        db.session.execute(stmt)
+    
+    @classmethod
+    def current(cls, name):
+        """Current stamp, or 0 if the data has never been written"""
+        return db.session.scalar(select(cls.version).where(cls.name == name)) or 0
+    
+    def __repr__(self):
+        return f'<CacheVersion {self.name}={self.version}>'
+
+class PathaoCircuit(db.Model):
+    """Circuit breaker state of a Pathao endpoint, shared by all workers"""
+    endpoint = db.Column(db.String(50), primary_key=True)  # e.g. 'city-list', 'create-order'
+    state = db.Column(db.String(20), nullable=False, default='closed')  # closed, open
+    failures = db.Column(db.Integer, nullable=False, default=0)  # Consecutive failures
+    opened_at = db.Column(db.DateTime)
+    last_error = db.Column(db.Text)
+    updated_at = db.Column(db.DateTime, nullable=False)  # Time of the last state change
+    updated_by = db.Column(db.String(100))  # Worker that changed the state
+    
+    def __repr__(self):
+        return f'<PathaoCircuit {self.endpoint} {self.state}>'
+
+class AddressParseCache(db.Model):
+    """Pathao address-parser results, keyed by a hash of the normalised address"""
+    address_hash = db.Column(db.String(64), primary_key=True)
+    address = db.Column(db.Text, nullable=False)  # Normalised address
+    result = db.Column(db.Text, nullable=False)  # JSON returned by the parser
+    created_at = db.Column(db.DateTime, default=lambda: datetime.now(UTC))
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+    
+    @staticmethod
+    def normalize(address):
+        """Case, spacing and comma differences do not make a different address"""
+        address = re.sub(r'\s*,\s*', ', ', address or '')
+        address = re.sub(r'\s+', ' ', address)
+        return address.strip(' ,.').casefold()
+    
+    @staticmethod
+    def hash_address(normalized):
+        return hashlib.sha256(normalized.encode()).hexdigest()
+    
+    @classmethod
+    def lookup(cls, address_hash):
+        """Get (result, expires_at) for an unexpired entry, or None"""
+        row = db.session.execute(
+            select(cls.result, cls.expires_at).where(
+                cls.address_hash == address_hash,
+                cls.expires_at > datetime.now(UTC)
+            )
+        ).first()
+        if not row:
+            return None
+        return json.loads(row.result), row.expires_at
+    
+    @classmethod
+    def store(cls, address_hash, address, result, expires_at):
+        """Save a result and drop expired entries.
+        
+        Runs on its own connection so the caller's transaction is not committed.
+        """
+        now = datetime.now(UTC)
+        stmt = dialect_insert(cls).values(
+            address_hash=address_hash,
+            address=address,
+            result=json.dumps(result),
+            created_at=now,
+            expires_at=expires_at
+        )
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['address_hash'],
+            set_={'result': stmt.excluded.result, 'created_at': now, 'expires_at': stmt.excluded.expires_at}
+        )
+        with db.engine.begin() as conn:
+            conn.execute(cls.__table__.delete().where(cls.expires_at <= now))
+            conn.execute(stmt)
+    
+    def __repr__(self):
+        return f'<AddressParseCache {self.address}>'
+
+class DeliveryQuote(db.Model):
+    """Pathao price-plan quotes, keyed by everything the price depends on"""
+    store_id = db.Column(db.Integer, primary_key=True)
+    city_id = db.Column(db.Integer, primary_key=True)
+    zone_id = db.Column(db.Integer, primary_key=True)
+    weight_grams = db.Column(db.Integer, primary_key=True)  # Parcel weight, in grams so it can be a key
+    delivery_type = db.Column(db.Integer, primary_key=True)  # 48 normal, 12 on demand
+    price = db.Column(db.Numeric(10, 2), nullable=False)  # Pathao's final_price
+    plan = db.Column(db.Text, nullable=False)  # JSON returned by the price-plan API
+    created_at = db.Column(db.DateTime, default=lambda: datetime.now(UTC))
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+    
+    KEY_COLUMNS = ('store_id', 'city_id', 'zone_id', 'weight_grams', 'delivery_type')
+    
+    @staticmethod
+    def plan_price(plan):
+        """The charge to the merchant from a price-plan response"""
+        return plan.get('final_price', plan.get('price')) or 0
+    
+    @classmethod
+    def lookup(cls, key):
+        """Get (plan, expires_at) for a quote key, expired or not, or None"""
+        row = db.session.execute(
+            select(cls.plan, cls.expires_at).where(
+                *(getattr(cls, column) == value for column, value in zip(cls.KEY_COLUMNS, key))
+            )
+        ).first()
+        if not row:
+            return None
+        return json.loads(row.plan), row.expires_at.replace(tzinfo=UTC)
+    
+    @classmethod
+    def fresh_keys(cls, keys):
+        """The subset of quote keys with an unexpired quote"""
+        keys = list(keys)
+        if not keys:
+            return set()
+        rows = db.session.execute(
+            select(*(getattr(cls, column) for column in cls.KEY_COLUMNS)).where(
+                tuple_(*(getattr(cls, column) for column in cls.KEY_COLUMNS)).in_(keys),
+                cls.expires_at > datetime.now(UTC)
+            )
+        ).all()
+        return {tuple(row) for row in rows}
+    
+    @classmethod
+    def store(cls, plans_by_key, expires_at, purge_before):
+        """Save {key: plan} quotes and drop entries that expired before purge_before.
+        
+        Runs on its own connection so the caller's transaction is not committed.
+        """
+        if not plans_by_key:
+            return
+        now = datetime.now(UTC)
+        stmt = dialect_insert(cls)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=list(cls.KEY_COLUMNS),
+            set_={
+                'price': stmt.excluded.price,
+                'plan': stmt.excluded.plan,
+                'created_at': stmt.excluded.created_at,
+                'expires_at': stmt.excluded.expires_at
+            }
+        )
+        rows = [
+            dict(zip(cls.KEY_COLUMNS, key), price=cls.plan_price(plan),
+                 plan=json.dumps(plan), created_at=now, expires_at=expires_at)
+            for key, plan in plans_by_key.items()
+        ]
+        with db.engine.begin() as conn:
+            conn.execute(cls.__table__.delete().where(cls.expires_at <= purge_before))
+            conn.execute(stmt, rows)
+    
+    def __repr__(self):
+        return f'<DeliveryQuote {self.store_id}/{self.city_id}/{self.zone_id} {self.weight_grams}g: {self.price}>'
+
 class ProductType(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(50), unique=True, nullable=False)
@@ -210,42 +511,42 @@ class Product(db.Model):
             Product.id != self.id
         ).all()
     
-    def get_total_available_quantity(self):
-        """Get total quantity available including compatible sizes"""
-        total = self.quantity
-        for compatible in self.get_compatible_products():
-            total += compatible.quantity
-        return total
+    @classmethod
+    def total_available_quantities(cls, products, exclude_hold_key=None):
+        """Get available quantities of many products from one inventory snapshot.
+        
+        Returns {product id: quantity including compatible sizes, minus
+        active holds}. Use this for lists rather than calling
+        get_total_available_quantity per product.
+        """
+        from order_service import InventorySnapshot
+        snapshot = InventorySnapshot.load(
+            [product.id for product in products], exclude_hold_key=exclude_hold_key
+        )
+        return {product.id: snapshot.total_available(product.id) for product in products}
+    
+    def get_total_available_quantity(self, exclude_hold_key=None):
+        """Get total quantity available including compatible sizes, minus active holds"""
+        return Product.total_available_quantities([self], exclude_hold_key)[self.id]
     
-    def can_fulfill_order(self, requested_quantity):
+    def can_fulfill_order(self, requested_quantity, exclude_hold_key=None):
         """Check if order can be fulfilled using this product and compatible sizes"""
-        return self.get_total_available_quantity() >= requested_quantity
+        return self.get_total_available_quantity(exclude_hold_key) >= requested_quantity
     
     def fulfill_order(self, requested_quantity):
-        """Fulfill order by reducing stock from this product and compatible sizes"""
-        if not self.can_fulfill_order(requested_quantity):
-            return False
+        """Fulfill order by atomically reducing stock from this product and compatible sizes"""
+        from order_service import InventorySnapshot, StockShortfallError
         
-        remaining = requested_quantity
-        
-        # First, use stock from the exact product
-        if self.quantity > 0:
-            used = min(self.quantity, remaining)
-            self.quantity -= used
-            remaining -= used
-        
-        # Then use stock from compatible sizes
-        if remaining > 0:
-            for compatible in self.get_compatible_products():
-                if remaining <= 0:
-                    break
-                if compatible.quantity > 0:
-                    used = min(compatible.quantity, remaining)
-                    compatible.quantity -= used
-                    remaining -= used
-        
-        self.updated_at = datetime.now(UTC)
-        return remaining == 0
+        lines = [(self.id, requested_quantity)]
+        snapshot = InventorySnapshot.load([self.id], for_update=True)
+        try:
+            # A savepoint undoes decrements already made to compatible sizes
+            with db.session.begin_nested():
+                snapshot.allocate_lines(lines)
+                snapshot.apply(lines)
+        except StockShortfallError:
+            return False
+        return True
     
     def auto_assign_size_group(self):
         """Automatically assign size group based on product type and size"""
@@ -270,10 +571,48 @@ class Product(db.Model):
     def __repr__(self):
         return f'<Product {self.name} ({self.product_type.name}) - {self.product_code} - {self.size}>'
 
+class StockHold(db.Model):
+    """Temporary reservation of stock while an order form is being filled in"""
+    id = db.Column(db.Integer, primary_key=True)
+    hold_key = db.Column(db.String(64), nullable=False, index=True)  # One key per order form
+    product_id = db.Column(db.Integer, db.ForeignKey('product.id'), nullable=False, index=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    quantity = db.Column(db.Integer, nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+    created_at = db.Column(db.DateTime, default=lambda: datetime.now(UTC))
+    
+    # A form holds each product at most once; quantity changes update the row
+    __table_args__ = (db.UniqueConstraint('hold_key', 'product_id', name='_hold_key_product_uc'),)
+    
+    @classmethod
+    def held_quantities(cls, product_ids=None, exclude_key=None):
+        """Get {product_id: held quantity} for active holds in a single grouped query"""
+        query = db.session.query(cls.product_id, func.sum(cls.quantity)).filter(
+            cls.expires_at > datetime.now(UTC)
+        )
+        if product_ids is not None:
+            query = query.filter(cls.product_id.in_(list(product_ids)))
+        if exclude_key:
+            query = query.filter(cls.hold_key != exclude_key)
+        return dict(query.group_by(cls.product_id).all())
+    
+    @classmethod
+    def sweep_expired(cls):
+        """Delete all expired holds in one statement"""
+        return cls.query.filter(cls.expires_at <= datetime.now(UTC)).delete(synchronize_session=False)
+    
+    @classmethod
+    def release(cls, hold_key):
+        """Delete all holds placed under a form's hold key"""
+        return cls.query.filter_by(hold_key=hold_key).delete(synchronize_session=False)
+    
+    def __repr__(self):
+        return f'<StockHold {self.hold_key} - {self.product_id} x {self.quantity}>'
+
 class Order(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    customer_id = db.Column(db.Integer, db.ForeignKey('customer.id'), nullable=False)
+    customer_id = db.Column(db.Integer, db.ForeignKey('customer.id'), nullable=False, index=True)
     
     # Pathao Location Information
     city_id = db.Column(db.Integer, nullable=True)  # Pathao city_id
@@ -281,6 +620,8 @@ class Order(db.Model):
     zone_id = db.Column(db.Integer, nullable=True)  # Pathao zone_id  
     zone_name = db.Column(db.String(100), nullable=True)
     shipping_requested = db.Column(db.Boolean, default=False)  # Whether shipping is requested
+    item_weight = db.Column(db.Numeric(6, 2), nullable=True)  # Parcel weight in kg sent to Pathao
+    delivery_type = db.Column(db.Integer, nullable=True)  # Pathao delivery type: 48 normal, 12 on demand
     
     # Order Financial Details
     delivery_charge = db.Column(db.Numeric(10, 2), nullable=False, default=0.00)
@@ -318,9 +659,12 @@ class Order(db.Model):
         """Get final total including delivery charges and discount"""
         return int(self.products_subtotal) + int(self.delivery_charge) - int(self.discount)
     
-    def calculate_total(self):
+    def calculate_total(self, products_subtotal=None):
         """Calculate total amount including delivery charges and discount"""
-        self.total_amount = self.final_total
+        if products_subtotal is None:
+            self.total_amount = self.final_total
+        else:
+            self.total_amount = int(products_subtotal) + int(self.delivery_charge) - int(self.discount)
         return self.total_amount
     
     def __repr__(self):
@@ -332,7 +676,7 @@ class OrderItem(db.Model):
     product_id = db.Column(db.Integer, db.ForeignKey('product.id'), nullable=False)
     quantity = db.Column(db.Integer, nullable=False)
     unit_price = db.Column(db.Numeric(10, 2), nullable=False)
-    tracking_code = db.Column(db.String(12), nullable=True)  # Will be populated after insert
+    tracking_code = db.Column(db.String(12), nullable=True, index=True, unique=True)  # Set at insert from a reserved ID
     
     @property
     def subtotal(self):
@@ -340,35 +684,30 @@ class OrderItem(db.Model):
         return self.quantity * self.unit_price
     
     def generate_tracking_code(self):
-        """Generate tracking code: product_code + size(max 4 chars) + padded ID"""
+        """Generate tracking code: product_code + size, then the item ID in base 36"""
         if not self.product or not self.id:
             return None
+        return OrderItem.format_tracking_code(self.product, self.id)
+    
+    TRACKING_ID_CHARS = 6  # Base 36, enough for any 32-bit item ID
+    
+    @staticmethod
+    def format_tracking_code(product, item_id):
+        """Build a tracking code for the given product and order item ID.
         
-        # Get product code (max 5 chars as per Product model)
-        product_code = self.product.product_code or ""
-        
-        # Get size, truncate to max 4 chars
-        size = (self.product.size or "")[:4]
-        
-        # Calculate remaining space for ID padding
-        used_chars = len(product_code) + len(size)
-        id_padding = 12 - used_chars
-        
-        # Ensure we have at least 1 character for ID
-        if id_padding < 1:
-            # If product_code + size is too long, truncate size further
-            max_size_chars = 12 - len(product_code) - 1  # Reserve 1 char for ID minimum
-            size = size[:max(0, max_size_chars)]
-            id_padding = 12 - len(product_code) - len(size)
-        
-        # Format ID with zero padding
-        padded_id = str(self.id).zfill(id_padding)
+        The full item ID always fills the last TRACKING_ID_CHARS characters,
+        so no two items can share a code whatever their product codes.
+        """
+        digits = ''
+        while item_id:
+            item_id, remainder = divmod(item_id, 36)
+            digits = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ'[remainder] + digits
         
-        # If ID is too long even with no padding, truncate from left
-        if len(padded_id) > id_padding:
-            padded_id = padded_id[-id_padding:]
+        # Product code (max 5 chars) first, then as much of the size as fits
+        prefix = f"{product.product_code or ''}{product.size or ''}"
+        prefix = prefix[:12 - OrderItem.TRACKING_ID_CHARS]
         
-        return f"{product_code}{size}{padded_id}"
+        return f"{prefix}{digits.zfill(OrderItem.TRACKING_ID_CHARS)}"
     
     def update_tracking_code(self):
         """Update the tracking code field"""
@@ -378,6 +717,266 @@ class OrderItem(db.Model):
     def __repr__(self):
         return f'<OrderItem {self.id} - {self.tracking_code or "No tracking code"}>'
 
+class IdSequence(db.Model):
+    """Counters used to reserve blocks of primary keys before a bulk insert"""
+    name = db.Column(db.String(50), primary_key=True)  # Table name
+    next_id = db.Column(db.Integer, nullable=False)
+    
+    @classmethod
+    def reserve(cls, model, count):
+        """Reserve count primary keys for model inside the current transaction.
+        
+        PostgreSQL draws them from the table's own serial sequence. Other
+        backends use a counter row that never falls behind the table's
+        highest id, so reserved ids cannot clash with ordinary inserts.
+        """
+        if count < 1:
+            return []
+        
+        table = model.__table__
+        if db.session.get_bind().dialect.name == 'postgresql':
+            sequence = func.pg_get_serial_sequence(table.name, 'id')
+            return list(db.session.scalars(
+                select(func.nextval(sequence)).select_from(func.generate_series(1, count))
+            ))
+        
+        table_next = select(func.coalesce(func.max(table.c.id), 0) + 1).scalar_subquery()
+        stmt = sqlite_insert(cls).values(name=table.name, next_id=table_next + count)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['name'],
+            set_={'next_id': func.max(cls.next_id, table_next) + count}
+        ).returning(cls.next_id)
+        end = db.session.scalar(stmt)
+        return list(range(end - count, end))
+    
+    def __repr__(self):
+        return f'<IdSequence {self.name} next={self.next_id}>'
+
+class IdempotencyKey(db.Model):
+    """Result of a state-changing request, replayed when the same request key is resubmitted"""
+    id = db.Column(db.Integer, primary_key=True)
+    scope = db.Column(db.String(50), nullable=False)  # e.g. 'create_order', 'request_shipping'
+    key = db.Column(db.String(64), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='pending')  # pending, completed
+    response = db.Column(db.Text)  # JSON result of the original request
+    created_at = db.Column(db.DateTime, default=lambda: datetime.now(UTC))
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+    
+    __table_args__ = (db.UniqueConstraint('scope', 'key', name='_idempotency_scope_key_uc'),)
+    
+    @property
+    def is_completed(self):
+        """Check if the original request has finished"""
+        return self.status == 'completed'
+    
+    @property
+    def result(self):
+        """Get the stored result of the original request"""
+        return json.loads(self.response) if self.response else {}
+    
+    @classmethod
+    def lookup(cls, scope, key, user_id):
+        """Find an unexpired record for this request key"""
+        return cls.query.filter(
+            cls.scope == scope,
+            cls.key == key,
+            cls.user_id == user_id,
+            cls.expires_at > datetime.now(UTC)
+        ).first()
+    
+    @classmethod
+    def claim(cls, scope, key, user_id, ttl_hours):
+        """Claim a request key before doing the work.
+        
+        The claim is committed on its own connection so concurrent duplicates
+        see it straight away, without committing (and expiring) anything the
+        request has already loaded. Returns (record, True) when claimed, or
+        (existing record, False) when the key was already used.
+        """
+        table = cls.__table__
+        now = datetime.now(UTC)
+        try:
+            with db.engine.begin() as conn:
+                conn.execute(table.delete().where(table.c.expires_at <= now))
+                record_id = conn.execute(table.insert().values(
+                    scope=scope,
+                    key=key,
+                    user_id=user_id,
+                    status='pending',
+                    created_at=now,
+                    expires_at=now + timedelta(hours=ttl_hours)
+                )).inserted_primary_key[0]
+        except IntegrityError:
+            return cls.lookup(scope, key, user_id), False
+        return db.session.get(cls, record_id), True
+    
+    def complete(self, result):
+        """Store the result; committed together with the request's own changes"""
+        self.status = 'completed'
+        self.response = json.dumps(result)
+    
+    def release(self):
+        """Forget the claim after a failed request so it can be retried"""
+        db.session.rollback()
+        IdempotencyKey.query.filter_by(id=self.id).delete(synchronize_session=False)
+        db.session.commit()
+    
+    def __repr__(self):
+        return f'<IdempotencyKey {self.scope}:{self.key} {self.status}>'
+
+class BackgroundJob(db.Model):
+    """Persistent work item processed outside the web request (see job_queue.py)"""
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(50), nullable=False)  # Registered handler name
+    reference = db.Column(db.String(100), index=True)  # What the job is about, e.g. 'order:42'
+    payload = db.Column(db.Text, nullable=False)  # JSON arguments for the handler
+    status = db.Column(db.String(20), nullable=False, default='queued')  # queued, running, succeeded, failed
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False, default=5)
+    run_at = db.Column(db.DateTime, nullable=False)  # Earliest time of the next attempt
+    locked_by = db.Column(db.String(100))
+    locked_at = db.Column(db.DateTime)
+    result = db.Column(db.Text)  # JSON returned by the handler
+    last_error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=lambda: datetime.now(UTC))
+    updated_at = db.Column(db.DateTime, default=lambda: datetime.now(UTC), onupdate=lambda: datetime.now(UTC))
+    
+    __table_args__ = (db.Index('ix_background_job_status_run_at', 'status', 'run_at'),)
+    
+    ACTIVE_STATUSES = ('queued', 'running')
+    
+    @property
+    def is_active(self):
+        """Check if the job is still waiting or running"""
+        return self.status in self.ACTIVE_STATUSES
+    
+    @property
+    def payload_data(self):
+        """Get the decoded handler arguments"""
+        return json.loads(self.payload)
+    
+    @property
+    def result_data(self):
+        """Get the decoded handler result"""
+        return json.loads(self.result) if self.result else {}
+    
+    @classmethod
+    def enqueue(cls, kind, payload, reference=None, max_attempts=5, delay_seconds=0):
+        """Add a job to the queue; it is committed with the caller's transaction"""
+        job = cls(**cls._new_job_values(kind, payload, reference, max_attempts, delay_seconds))
+        db.session.add(job)
+        return job
+    
+    @classmethod
+    def enqueue_now(cls, kind, payload, reference=None, max_attempts=5, delay_seconds=0):
+        """Add a job to the queue on its own connection, committed at once.
+        
+        For read paths, which must not commit whatever transaction the
+        caller has open. Returns the job id.
+        """
+        values = cls._new_job_values(kind, payload, reference, max_attempts, delay_seconds)
+        with db.engine.begin() as conn:
+            return conn.execute(cls.__table__.insert().values(**values)).inserted_primary_key[0]
+    
+    @staticmethod
+    def _new_job_values(kind, payload, reference, max_attempts, delay_seconds):
+        return {
+            'kind': kind,
+            'reference': reference,
+            'payload': json.dumps(payload),
+            'status': 'queued',
+            'attempts': 0,
+            'max_attempts': max_attempts,
+            'run_at': datetime.now(UTC) + timedelta(seconds=delay_seconds)
+        }
+    
+    @classmethod
+    def latest_for(cls, reference, kind=None):
+        """Get the most recent job for a reference"""
+        query = cls.query.filter_by(reference=reference)
+        if kind:
+            query = query.filter_by(kind=kind)
+        return query.order_by(cls.id.desc()).first()
+    
+    @classmethod
+    def claim_next(cls, worker_id, lock_timeout_seconds, no_reclaim_kinds=()):
+        """Atomically take the next due job and mark it running.
+        
+        Running jobs whose worker has not finished within the lock timeout
+        are assumed dead and handed out again, if they have attempts left
+        and are not of no_reclaim_kinds (see fail_abandoned). Returns the
+        job id, or None.
+        """
+        now = datetime.now(UTC)
+        claimable = or_(
+            and_(cls.status == 'queued', cls.run_at <= now),
+            and_(
+                cls.status == 'running',
+                cls.locked_at < now - timedelta(seconds=lock_timeout_seconds),
+                cls.attempts < cls.max_attempts,
+                cls.kind.notin_(no_reclaim_kinds)
+            )
+        )
+        candidate = select(cls.id).where(claimable).order_by(cls.run_at).limit(1)
+        if db.session.get_bind().dialect.name == 'postgresql':
+            candidate = candidate.with_for_update(skip_locked=True)
+        
+        job_id = db.session.scalar(
+            update(cls)
+            .where(cls.id == candidate.scalar_subquery(), claimable)
+            .values(status='running', locked_by=worker_id, locked_at=now, attempts=cls.attempts + 1)
+            .returning(cls.id)
+        )
+        db.session.commit()
+        return job_id
+    
+    @classmethod
+    def fail_abandoned(cls, lock_timeout_seconds, no_reclaim_kinds=()):
+        """Fail running jobs whose worker stopped and that claim_next won't hand out.
+        
+        Those are jobs of no_reclaim_kinds, which may already have taken
+        effect and need a person to check, and jobs without attempts left.
+        Committed with the caller's transaction. Returns the failed jobs as
+        (id, kind, payload, error) tuples.
+        """
+        now = datetime.now(UTC)
+        no_reclaim = cls.kind.in_(no_reclaim_kinds)
+        error = case(
+            (no_reclaim, 'Worker stopped during the job; not run again as it may already have taken effect'),
+            else_='Worker stopped during the last attempt'
+        )
+        return db.session.execute(
+            update(cls)
+            .where(
+                cls.status == 'running',
+                cls.locked_at < now - timedelta(seconds=lock_timeout_seconds),
+                or_(no_reclaim, cls.attempts >= cls.max_attempts)
+            )
+            .values(status='failed', locked_by=None, locked_at=None, last_error=error)
+            .returning(cls.id, cls.kind, cls.payload, cls.last_error)
+            .execution_options(synchronize_session=False)
+        ).all()
+    
+    def __repr__(self):
+        return f'<BackgroundJob {self.id} {self.kind} {self.status}>'
+
+class PathaoWebhookEvent(db.Model):
+    """Delivery status callback from Pathao, kept until merged into PathaoDelivery"""
+    id = db.Column(db.Integer, primary_key=True)
+    consignment_id = db.Column(db.String(50), nullable=False, index=True)
+    event = db.Column(db.String(50))  # e.g. 'order.delivered'
+    order_status = db.Column(db.String(50), nullable=False)
+    event_time = db.Column(db.DateTime, nullable=False)
+    payload = db.Column(db.Text, nullable=False)  # Raw callback body, for audit and replay
+    received_at = db.Column(db.DateTime, default=lambda: datetime.now(UTC))
+    processed_at = db.Column(db.DateTime)  # NULL until merged or expired
+    
+    __table_args__ = (db.Index('ix_pathao_webhook_event_pending', 'processed_at', 'id'),)
+    
+    def __repr__(self):
+        return f'<PathaoWebhookEvent {self.consignment_id} {self.order_status}>'
+
 # Login attempt tracking for security
 class LoginAttempt(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -405,13 +1004,52 @@ class PathaoDelivery(db.Model):
     consignment_id = db.Column(db.String(50), unique=True, nullable=False)  # Pathao's tracking ID
     merchant_order_id = db.Column(db.Integer, db.ForeignKey('order.id'), nullable=False)
     order_status = db.Column(db.String(50), nullable=False)  # Pending, Pickup_Requested, etc.
+    is_final = db.Column(db.Boolean, nullable=False, default=False)  # No further status changes expected
+    status_at = db.Column(db.DateTime)  # Pathao's time for order_status, used to ignore stale updates
     delivery_fee = db.Column(db.Numeric(10, 2), nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.now(UTC))
     updated_at = db.Column(db.DateTime, default=datetime.now(UTC), onupdate=datetime.now(UTC))
     
+    # Status sync only reads in-flight deliveries
+    __table_args__ = (db.Index('ix_pathao_delivery_final_id', 'is_final', 'id'),)
+    
     # Relationships
     order = db.relationship('Order', backref='pathao_delivery', lazy=True)
     
+    FINAL_STATUSES = {
+        'delivered', 'partial_delivery', 'completed',
+        'return', 'returned', 'paid_return', 'pickup_cancelled', 'cancelled'
+    }
+    
+    # Order status implied by a delivery status; other statuses mean 'processing'
+    ORDER_STATUSES = {
+        'pending': None,
+        'pickup_requested': None,
+        'delivered': 'completed',
+        'partial_delivery': 'completed',
+        'completed': 'completed',
+        'return': 'cancelled',
+        'returned': 'cancelled',
+        'paid_return': 'cancelled',
+        'pickup_cancelled': 'cancelled',
+        'cancelled': 'cancelled'
+    }
+    
+    @staticmethod
+    def status_key(status):
+        """Normalise a Pathao status, e.g. 'Pickup Requested' -> 'pickup_requested'"""
+        return (status or '').strip().lower().replace(' ', '_').replace('-', '_')
+    
+    @classmethod
+    def is_final_status(cls, status):
+        """Check if a status is one Pathao will not move on from"""
+        return cls.status_key(status) in cls.FINAL_STATUSES
+    
+    @classmethod
+    def order_status_for(cls, status):
+        """Get the order status a delivery status implies, or None to leave it"""
+        return cls.ORDER_STATUSES.get(cls.status_key(status), 'processing')
+    
     @property
     def is_delivered(self):
         """Check if delivery is completed"""
@@ -431,9 +1069,43 @@ class PathaoDelivery(db.Model):
     def update_status(self, new_status, new_delivery_fee=None):
         """Update delivery status and optionally delivery fee"""
         self.order_status = new_status
+        self.is_final = self.is_final_status(new_status)
         if new_delivery_fee is not None:
             self.delivery_fee = new_delivery_fee
         self.updated_at = datetime.now(UTC)
     
     def __repr__(self):
         return f'<PathaoDelivery {self.consignment_id} - {self.order_status}>'
+
+# Named eager-loading profiles for pages that list or show many related rows.
+# Built on demand, as backref attributes only exist once the mappers are configured.
+LOAD_PROFILES = {
+    # Product rows with their type and size group (whose name shows the type too)
+    'inventory': lambda: (
+        joinedload(Product.product_type),
+        joinedload(Product.size_group).joinedload(SizeGroup.product_type)
+    ),
+    # Order rows with the customer name and item count
+    'orders': lambda: (
+        joinedload(Order.customer),
+        selectinload(Order.order_items)
+    ),
+    # Recent orders with the customer name
+    'dashboard': lambda: (
+        joinedload(Order.customer),
+    ),
+    # One order with its customer and every item's product and type
+    'order_details': lambda: (
+        joinedload(Order.customer),
+        selectinload(Order.order_items).joinedload(OrderItem.product).joinedload(Product.product_type)
+    ),
+    # Orders with customers, and items with products for the top-product totals
+    'report': lambda: (
+        joinedload(Order.customer),
+        selectinload(Order.order_items).joinedload(OrderItem.product)
+    )
+}
+
+def load_profile(name):
+    """Loader options of a named profile, for query.options(*load_profile(name))"""
+    return LOAD_PROFILES[name]()
@@ -0,0 +1,257 @@
+import csv
+import io
+import json
+import re
+from datetime import datetime, UTC
+from sqlalchemy.orm import joinedload
+from flask import current_app
+from models import db, Product, Order, Customer
+from location_index import get_location_index
+from order_service import InventorySnapshot, StockShortfallError, insert_order_items, insert_returning_ids
+
+PHONE_PATTERN = re.compile(r'^[\d\+\-\(\)\s]+$')
+
+
+class OrderImporter:
+    """Validate and create orders from a stream of rows, committing in chunks.
+
+    Each row is one order. CSV rows list their items in a ``products``
+    column as ``product_id:quantity`` pairs separated by ``;``; JSON-lines
+    rows may instead give ``products`` as a list of
+    ``{"product_id": ..., "quantity": ...}`` objects, like the
+    ``products_data`` field of the order form.
+    """
+
+    REQUIRED_FIELDS = ('customer_name', 'customer_phone', 'customer_address', 'city_id', 'zone_id', 'products')
+
+    def __init__(self, user_id, chunk_size=None):
+        self.user_id = user_id
+        self.chunk_size = chunk_size or current_app.config['ORDER_IMPORT_CHUNK_SIZE']
+        self.results = []
+        self._load_index()
+
+    def _load_index(self):
+        """Preload products, stock and locations so rows validate without queries"""
+        products = Product.query.options(joinedload(Product.product_type)).all()
+        self.snapshot = InventorySnapshot.for_products(products)
+        locations = get_location_index()
+        self.cities = locations.city_names
+        self.zones = locations.zones
+
+        # Keep the preloaded catalog usable across chunk commits
+        for product_type in {product.product_type for product in products}:
+            db.session.expunge(product_type)
+        for product in products:
+            db.session.expunge(product)
+
+    @staticmethod
+    def read_rows(stream, fmt):
+        """Yield (row_number, row) pairs from a CSV or JSON-lines byte stream"""
+        text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+        if fmt == 'csv':
+            for number, row in enumerate(csv.DictReader(text), start=1):
+                yield number, row
+        elif fmt == 'jsonl':
+            for number, line in enumerate(text, start=1):
+                if not line.strip():
+                    continue
+                try:
+                    yield number, json.loads(line)
+                except json.JSONDecodeError:
+                    yield number, None
+        else:
+            raise ValueError(f'Unsupported import format: {fmt}')
+
+    @staticmethod
+    def _parse_products(value):
+        """Parse the products column into (product_id, quantity) lines"""
+        if isinstance(value, list):
+            items = [(item.get('product_id'), item.get('quantity')) for item in value if isinstance(item, dict)]
+        else:
+            items = [
+                tuple(part.split(':', 1)) if ':' in part else (part, None)
+                for part in str(value).split(';') if part.strip()
+            ]
+
+        try:
+            lines = [(int(product_id), int(quantity)) for product_id, quantity in items]
+        except (ValueError, TypeError):
+            raise ValueError('Invalid product ID or quantity')
+
+        if not lines:
+            raise ValueError('Please select at least one product')
+        if any(quantity < 1 for _, quantity in lines):
+            raise ValueError('Quantity must be at least 1')
+        return lines
+
+    def parse_row(self, row):
+        """Validate a row against the preloaded index and return an order spec"""
+        if not isinstance(row, dict):
+            raise ValueError('Invalid row format')
+
+        missing = [field for field in self.REQUIRED_FIELDS if not row.get(field)]
+        if missing:
+            raise ValueError(f'Missing fields: {", ".join(missing)}')
+
+        name = str(row['customer_name']).strip()
+        phone = str(row['customer_phone']).strip()
+        address = str(row['customer_address']).strip()
+        if not 2 <= len(name) <= 100:
+            raise ValueError('Customer name must be between 2 and 100 characters')
+        if not PHONE_PATTERN.match(phone) or len(re.sub(r'\D', '', phone)) < 10 or len(phone) > 20:
+            raise ValueError('Invalid contact number')
+        if not 10 <= len(address) <= 500:
+            raise ValueError('Address must be between 10 and 500 characters')
+
+        try:
+            city_id = int(row['city_id'])
+            zone_id = int(row['zone_id'])
+            delivery_charge = int(row.get('delivery_charge') or 0)
+            discount = int(row.get('discount') or 0)
+        except (ValueError, TypeError):
+            raise ValueError('Invalid city, zone, delivery charge or discount')
+
+        if city_id not in self.cities:
+            raise ValueError(f'Unknown city {city_id}')
+        if self.zones.get(zone_id, (None,))[0] != city_id:
+            raise ValueError(f'Zone {zone_id} does not belong to city {city_id}')
+        if delivery_charge < 0 or discount < 0:
+            raise ValueError('Delivery charges and discount cannot be negative')
+
+        return {
+            'customer': {'name': name, 'phone': phone, 'address': address},
+            'city_id': city_id,
+            'city_name': self.cities[city_id],
+            'zone_id': zone_id,
+            'zone_name': self.zones[zone_id][1],
+            'delivery_charge': delivery_charge,
+            'discount': discount,
+            'lines': self._parse_products(row['products'])
+        }
+
+    def run(self, rows):
+        """Import all rows and return the per-row result report"""
+        chunk = []
+        chunk_state = None
+        for number, row in rows:
+            try:
+                spec = self.parse_row(row)
+            except ValueError as e:
+                self.results.append({'row': number, 'status': 'failed', 'error': str(e)})
+                continue
+
+            if not chunk:
+                chunk_state = self.snapshot.checkpoint()
+            spec['row'] = number
+            if not self._allocate(spec):
+                continue
+
+            chunk.append(spec)
+            if len(chunk) >= self.chunk_size:
+                self._write_chunk(chunk, chunk_state)
+                chunk = []
+
+        if chunk:
+            self._write_chunk(chunk, chunk_state)
+
+        self.results.sort(key=lambda result: result['row'])
+        return self.report()
+
+    def _allocate(self, spec):
+        """Take a row's stock from the snapshot, or record the row as failed"""
+        state = self.snapshot.checkpoint()
+        try:
+            self.snapshot.allocate_lines(spec['lines'])
+        except ValueError as e:
+            self.snapshot.restore(state)
+            self.results.append({'row': spec['row'], 'status': 'failed', 'error': str(e)})
+            return False
+        return True
+
+    def _write_chunk(self, chunk, chunk_state, recheck=True):
+        """Write one chunk of validated orders with a handful of bulk statements.
+
+        If other orders took stock since the catalog was loaded, the chunk's
+        products are reloaded once and the rows that still fit are written;
+        only the others are reported as failed.
+        """
+        lines = [line for spec in chunk for line in spec['lines']]
+        try:
+            self.snapshot.apply(lines)
+
+            # Returning customers are matched on their phone number
+            customer_ids = Customer.upsert_many([spec['customer'] for spec in chunk])
+
+            now = datetime.now(UTC)
+            order_rows = []
+            for spec in chunk:
+                customer_id = customer_ids[Customer.normalize_phone(spec['customer']['phone'])]
+                subtotal = sum(
+                    quantity * self.snapshot.get(product_id).price
+                    for product_id, quantity in spec['lines']
+                )
+                order_rows.append({
+                    'user_id': self.user_id,
+                    'customer_id': customer_id,
+                    'city_id': spec['city_id'],
+                    'city_name': spec['city_name'],
+                    'zone_id': spec['zone_id'],
+                    'zone_name': spec['zone_name'],
+                    'delivery_charge': spec['delivery_charge'],
+                    'discount': spec['discount'],
+                    'total_amount': int(subtotal) + spec['delivery_charge'] - spec['discount'],
+                    'status': 'pending',
+                    'created_at': now,
+                    'updated_at': now
+                })
+            order_ids = insert_returning_ids(Order, order_rows)
+
+            insert_order_items([
+                {
+                    'order_id': order_id,
+                    'product_id': product_id,
+                    'quantity': quantity,
+                    'unit_price': self.snapshot.get(product_id).price
+                }
+                for spec, order_id in zip(chunk, order_ids)
+                for product_id, quantity in spec['lines']
+            ], self.snapshot.products)
+
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            # Give the chunk's stock back so later rows can still use it
+            self.snapshot.restore(chunk_state)
+            if recheck and isinstance(e, StockShortfallError):
+                self._recheck_chunk(chunk)
+                return
+            message = str(e) if isinstance(e, StockShortfallError) else 'Failed to save order batch'
+            current_app.logger.error(f"Error importing order batch: {str(e)}")
+            self.results.extend(
+                {'row': spec['row'], 'status': 'failed', 'error': message} for spec in chunk
+            )
+            return
+
+        self.snapshot.decrements.clear()
+        self.results.extend(
+            {'row': spec['row'], 'status': 'created', 'order_id': order_id}
+            for spec, order_id in zip(chunk, order_ids)
+        )
+
+    def _recheck_chunk(self, chunk):
+        """Re-validate a chunk against current stock and write the rows that still fit"""
+        self.snapshot.refresh({product_id for spec in chunk for product_id, _ in spec['lines']})
+        chunk_state = self.snapshot.checkpoint()
+        valid = [spec for spec in chunk if self._allocate(spec)]
+        if valid:
+            self._write_chunk(valid, chunk_state, recheck=False)
+
+    def report(self):
+        """Summarise the import results"""
+        created = sum(1 for result in self.results if result['status'] == 'created')
+        return {
+            'total': len(self.results),
+            'created': created,
+            'failed': len(self.results) - created,
+            'results': self.results
+        }
@@ -0,0 +1,341 @@
+from collections import defaultdict
+from datetime import datetime, UTC
+from sqlalchemy import and_, or_, select, insert, update, bindparam
+from sqlalchemy.orm import aliased, joinedload
+from models import db, Product, OrderItem, StockHold, IdSequence
+
+
+class StockShortfallError(ValueError):
+    """Raised when one or more order lines cannot be covered by current stock"""
+
+    def __init__(self, shortfalls):
+        self.shortfalls = shortfalls
+        super().__init__('; '.join(
+            f"Only {s['available']} items available for {s['name']}" for s in shortfalls
+        ))
+
+
+class InventorySnapshot:
+    """In-memory view of requested products and their size-group siblings"""
+
+    def __init__(self, products, held=None, locked=False):
+        self.products = {product.id: product for product in products}
+        self.available = {product.id: product.quantity for product in products}
+        self.decrements = defaultdict(int)
+
+        # Products are compatible when they share type, name and size group
+        self._groups = defaultdict(list)
+        for product in sorted(products, key=lambda p: p.id):
+            if product.size_group_id:
+                self._groups[self._group_key(product)].append(product.id)
+
+        self.held = held or {}
+        self._consume_holds()
+
+        # Whether the product rows are locked until the transaction ends
+        self.locked = locked
+
+    @staticmethod
+    def _group_key(product):
+        return (product.product_type_id, product.name, product.size_group_id)
+
+    @staticmethod
+    def _locks_rows():
+        """Row locks are only taken on PostgreSQL; other backends rely on conditional updates"""
+        return db.session.get_bind().dialect.name == 'postgresql'
+
+    @classmethod
+    def for_products(cls, products, exclude_hold_key=None):
+        """Build a snapshot from already loaded products plus active holds"""
+        return cls(products, StockHold.held_quantities(exclude_key=exclude_hold_key))
+
+    @classmethod
+    def load(cls, product_ids, for_update=False, exclude_hold_key=None):
+        """Load products and all compatible siblings in a single query.
+
+        With for_update=True the rows are locked (SELECT ... FOR UPDATE) on
+        PostgreSQL, in id order, until the transaction ends. Active stock
+        holds, other than those placed under exclude_hold_key, are
+        subtracted from the available quantities.
+        """
+        product_ids = {int(product_id) for product_id in product_ids}
+        if not product_ids:
+            return cls([])
+
+        requested = aliased(Product)
+        sibling_ids = select(Product.id).join(
+            requested,
+            or_(
+                Product.id == requested.id,
+                and_(
+                    requested.size_group_id.isnot(None),
+                    Product.size_group_id == requested.size_group_id,
+                    Product.product_type_id == requested.product_type_id,
+                    Product.name == requested.name
+                )
+            )
+        ).where(requested.id.in_(product_ids))
+
+        query = Product.query.options(
+            joinedload(Product.product_type, innerjoin=True)
+        ).filter(Product.id.in_(sibling_ids)).order_by(Product.id)
+
+        locked = for_update and cls._locks_rows()
+        if locked:
+            query = query.with_for_update(of=Product)
+            # Locked rows may have changed since they were last loaded
+            query = query.populate_existing()
+
+        products = query.all()
+        held = StockHold.held_quantities(
+            [product.id for product in products], exclude_key=exclude_hold_key
+        )
+        return cls(products, held, locked)
+
+    def get(self, product_id):
+        """Get a product from the snapshot"""
+        return self.products.get(product_id)
+
+    def compatible_ids(self, product_id):
+        """Get ids of compatible products, excluding the product itself"""
+        product = self.products[product_id]
+        if not product.size_group_id:
+            return []
+        return [pid for pid in self._groups[self._group_key(product)] if pid != product_id]
+
+    def total_available(self, product_id):
+        """Get remaining quantity including compatible sizes"""
+        return self.available[product_id] + sum(
+            self.available[pid] for pid in self.compatible_ids(product_id)
+        )
+
+    def allocate(self, product_id, quantity):
+        """Reserve stock in memory, exact product first, then compatible sizes.
+
+        Returns a list of (product_id, quantity) pairs, or None if there is
+        not enough stock.
+        """
+        if self.total_available(product_id) < quantity:
+            return None
+
+        allocations = self._consume(product_id, quantity)
+        for pid, used in allocations:
+            self.decrements[pid] += used
+        return allocations
+
+    def checkpoint(self):
+        """Capture allocation state so a failed group of lines can be undone"""
+        return dict(self.available), dict(self.decrements)
+
+    def restore(self, state):
+        """Return to a state captured by checkpoint()"""
+        available, decrements = state
+        self.available = dict(available)
+        self.decrements = defaultdict(int, decrements)
+
+    def refresh(self, product_ids):
+        """Reload current stock of products and their compatible sizes.
+
+        Pending allocations of those products are dropped; other products
+        keep their in-memory state.
+        """
+        refreshed = set()
+        for product_id in product_ids:
+            if product_id in self.products:
+                refreshed.add(product_id)
+                refreshed.update(self.compatible_ids(product_id))
+        if not refreshed:
+            return
+
+        current = dict(db.session.execute(
+            select(Product.id, Product.quantity).where(Product.id.in_(sorted(refreshed)))
+        ).all())
+        for pid in refreshed:
+            self.available[pid] = current.get(pid, 0)
+            self.decrements.pop(pid, None)
+        for product_id, quantity in sorted(self.held.items()):
+            if product_id in refreshed:
+                self._consume(product_id, quantity)
+
+    def _consume_holds(self):
+        """Stock held by other order forms is consumed the same way an order would"""
+        for product_id, quantity in sorted(self.held.items()):
+            if product_id in self.products:
+                self._consume(product_id, quantity)
+
+    def _consume(self, product_id, quantity):
+        """Take up to quantity from available stock, exact product first"""
+        allocations = []
+        remaining = quantity
+        for pid in [product_id] + self.compatible_ids(product_id):
+            if remaining <= 0:
+                break
+            used = min(self.available[pid], remaining)
+            if used > 0:
+                self.available[pid] -= used
+                allocations.append((pid, used))
+                remaining -= used
+        return allocations
+
+    def allocate_lines(self, lines):
+        """Allocate (product_id, quantity) lines, raising StockShortfallError for every line that fails"""
+        shortfalls = []
+        for product_id, quantity in lines:
+            product = self.get(product_id)
+            if not product:
+                raise ValueError(f'Product with ID {product_id} not found')
+
+            if self.allocate(product_id, quantity) is None:
+                shortfalls.append({
+                    'product_id': product_id,
+                    'name': product.get_display_name(),
+                    'requested': quantity,
+                    'available': self.total_available(product_id)
+                })
+
+        if shortfalls:
+            raise StockShortfallError(shortfalls)
+
+    def apply(self, lines):
+        """Atomically decrement allocated stock in the database.
+
+        Every decrement is a conditional UPDATE (quantity >= n), so concurrent
+        orders can never drive stock negative. If any row no longer has
+        enough stock, the lines are re-checked against current quantities
+        and StockShortfallError is raised; the caller must roll back.
+        """
+        if not self.decrements:
+            return
+
+        table = Product.__table__
+        stmt = update(table).where(
+            table.c.id == bindparam('pid'),
+            table.c.quantity >= bindparam('amount')
+        ).values(
+            quantity=table.c.quantity - bindparam('amount'),
+            updated_at=bindparam('now')
+        )
+        now = datetime.now(UTC)
+        params = [
+            {'pid': pid, 'amount': amount, 'now': now}
+            for pid, amount in sorted(self.decrements.items())
+        ]
+
+        if self.locked:
+            # Rows are locked by load(for_update=True): one executemany is enough
+            result = db.session.execute(stmt, params)
+            # Not expected while the rows are locked; report every row if it happens
+            failed = [] if result.rowcount == len(params) else [p['pid'] for p in params]
+        else:
+            failed = [
+                p['pid'] for p in params
+                if db.session.execute(stmt, p).rowcount != 1
+            ]
+
+        # Keep ORM instances in step with the database
+        for pid in self.decrements:
+            if self.products[pid] in db.session:
+                db.session.expire(self.products[pid], ['quantity', 'updated_at'])
+
+        if failed:
+            self._raise_shortfalls(lines, failed)
+
+    def _raise_shortfalls(self, lines, failed):
+        """Rebuild availability from current rows and report which lines fall short"""
+        failed = set(failed)
+        current = dict(db.session.execute(
+            select(Product.id, Product.quantity).where(Product.id.in_(list(self.products)))
+        ).all())
+        for pid, quantity in current.items():
+            # Undo our own successful decrements to see what other orders left
+            self.available[pid] = quantity if pid in failed else quantity + self.decrements[pid]
+        self.decrements.clear()
+        self._consume_holds()
+
+        self.allocate_lines(lines)
+
+        # Stock freed up again in the meantime; report the rows that failed
+        raise StockShortfallError([
+            {
+                'product_id': pid,
+                'name': self.products[pid].get_display_name(),
+                'requested': None,
+                'available': current.get(pid, 0)
+            }
+            for pid in sorted(failed)
+        ])
+
+
+def insert_returning_ids(model, rows):
+    """Bulk insert rows and return their new ids in the same order as rows.
+
+    SQLite cannot batch an INSERT ... RETURNING whose output must follow
+    parameter order and would fall back to one statement per row. Its rowids
+    are assigned in VALUES order, so the unordered ids are sorted instead.
+    """
+    if db.session.get_bind().dialect.name == 'sqlite':
+        return sorted(db.session.scalars(insert(model).returning(model.id), rows).all())
+    return db.session.scalars(
+        insert(model).returning(model.id, sort_by_parameter_order=True), rows
+    ).all()
+
+
+def insert_order_items(rows, products):
+    """Insert order item rows, with their tracking codes, in one statement.
+
+    Item ids are reserved up front so tracking codes can be built before
+    the insert. products maps product ids to products; returns the new
+    item ids.
+    """
+    item_ids = IdSequence.reserve(OrderItem, len(rows))
+    db.session.execute(insert(OrderItem), [
+        dict(
+            row,
+            id=item_id,
+            tracking_code=OrderItem.format_tracking_code(products[row['product_id']], item_id)
+        )
+        for item_id, row in zip(item_ids, rows)
+    ])
+    return item_ids
+
+
+class OrderAssembler:
+    """Set-based creation of order items and stock decrements for one order"""
+
+    def __init__(self, products_data, snapshot=None, hold_key=None):
+        self.lines = [
+            (int(product_data['product_id']), int(product_data['quantity']))
+            for product_data in products_data
+        ]
+        self.hold_key = hold_key
+        self.snapshot = snapshot or InventorySnapshot.load(
+            (pid for pid, _ in self.lines), for_update=True, exclude_hold_key=hold_key
+        )
+
+    def write(self, order):
+        """Insert all order items and apply stock decrements in bulk.
+
+        Returns the products subtotal of the order.
+        """
+        self.snapshot.allocate_lines(self.lines)
+        self.snapshot.apply(self.lines)
+
+        # The order's own holds become real decrements
+        if self.hold_key:
+            StockHold.release(self.hold_key)
+
+        rows = []
+        subtotal = 0
+        for product_id, quantity in self.lines:
+            product = self.snapshot.get(product_id)
+            rows.append({
+                'order_id': order.id,
+                'product_id': product_id,
+                'quantity': quantity,
+                'unit_price': product.price
+            })
+            subtotal += quantity * product.price
+
+        insert_order_items(rows, self.snapshot.products)
+
+        return subtotal
@@ -0,0 +1,177 @@
+import asyncio
+import time
+import httpx
+from flask import current_app
+from pathao_http import get_client, never_sent as request_never_sent
+
+
+class AsyncPathaoClient:
+    """asyncio counterpart of PathaoHttpClient for bulk fan-out.
+
+    Requests run on one event loop over an httpx connection pool, with at
+    most max_concurrency in flight. Retry rules, circuit breakers and
+    latency stats are those of the process's PathaoHttpClient, so bulk
+    calls show up in /admin/pathao and respect open circuits.
+    """
+
+    def __init__(self, client, max_concurrency):
+        self.client = client
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        connect_timeout, read_timeout = client.timeout
+        self.session = httpx.AsyncClient(
+            base_url=client.base_url,
+            timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+            limits=httpx.Limits(max_connections=max_concurrency, max_keepalive_connections=max_concurrency)
+        )
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.session.aclose()
+
+    async def request(self, method, path, endpoint=None, idempotent=None, **kwargs):
+        """Send a request to the Pathao API; see PathaoHttpClient.request"""
+        method = method.upper()
+        endpoint = endpoint or path
+        if idempotent is None:
+            idempotent = method in self.client.IDEMPOTENT_METHODS
+        breaker = self.client.circuit(endpoint)
+
+        attempt = 0
+        while True:
+            breaker.before_call()
+            async with self.semaphore:
+                started = time.perf_counter()
+                try:
+                    response = await self.session.request(method, path, **kwargs)
+                except httpx.TransportError as e:
+                    breaker.record(True, str(e) or type(e).__name__)
+                    can_retry = idempotent or isinstance(e, httpx.ConnectTimeout)
+                    retrying = can_retry and attempt < self.client.max_retries
+                    self.client.record_call(endpoint, (time.perf_counter() - started) * 1000, True, retrying)
+                    if not retrying:
+                        raise
+                    response = None
+                except Exception as e:
+                    # Not retried, but recorded so a half-open trial always finishes
+                    breaker.record(True, str(e) or type(e).__name__)
+                    self.client.record_call(endpoint, (time.perf_counter() - started) * 1000, True, False)
+                    raise
+
+            if response is not None:
+                failed = response.status_code >= 500 or response.status_code == 429
+                breaker.record(failed, f'HTTP {response.status_code}' if failed else None)
+                retrying = (idempotent and response.status_code in self.client.RETRY_STATUSES
+                            and attempt < self.client.max_retries)
+                self.client.record_call(endpoint, (time.perf_counter() - started) * 1000,
+                                        response.status_code >= 400, retrying)
+                if not retrying:
+                    return response
+
+            # Back off outside the semaphore so waiting calls don't hold a slot
+            await asyncio.sleep(self.client.backoff_delay(attempt, response))
+            attempt += 1
+
+
+def never_sent(error):
+    """Whether a failed sync or async request is known not to have reached Pathao"""
+    return request_never_sent(error) or isinstance(error, (httpx.ConnectError, httpx.ConnectTimeout))
+
+
+def raise_for_status(response):
+    """Like response.raise_for_status(), with a one-line message for error lists"""
+    if response.is_error:
+        raise httpx.HTTPStatusError(
+            f'{response.status_code} {response.reason_phrase} for url: {response.url}',
+            request=response.request, response=response
+        )
+
+
+class AsyncPathaoService:
+    """Coroutine versions of PathaoService's per-item calls.
+
+    Same arguments as their PathaoService namesakes, with an
+    AsyncPathaoClient as the client. Run them through run_concurrently.
+    """
+
+    @staticmethod
+    async def fetch_list(client, token, path, endpoint):
+        """Get a Pathao list endpoint's items"""
+        headers = {
+            "Authorization": f"Bearer {token}",
+            "Content-Type": "application/json; charset=UTF-8"
+        }
+
+        response = await client.request('GET', path, endpoint=endpoint, headers=headers)
+        raise_for_status(response)
+        return response.json().get('data', {}).get('data', [])
+
+    @staticmethod
+    async def submit_order(client, token, order_data):
+        """Send a prepared order to Pathao. Not retried once sent."""
+        headers = {
+            "Authorization": f"Bearer {token}",
+            "Content-Type": "application/json"
+        }
+
+        response = await client.request('POST', '/aladdin/api/v1/orders', endpoint='create-order',
+                                        headers=headers, json=order_data)
+        raise_for_status(response)
+        return response.json()
+
+    @staticmethod
+    async def fetch_price_plan(client, token, body):
+        """Get Pathao's price plan for a parcel"""
+        headers = {
+            "Authorization": f"Bearer {token}",
+            "Content-Type": "application/json; charset=UTF-8"
+        }
+
+        response = await client.request('POST', '/aladdin/api/v1/merchant/price-plan', endpoint='price-plan',
+                                        idempotent=True, headers=headers, json=body)
+        raise_for_status(response)
+        return response.json().get('data', {})
+
+    @staticmethod
+    async def fetch_order_info(client, token, consignment_id):
+        """Get the current state of a consignment from Pathao"""
+        headers = {"Authorization": f"Bearer {token}"}
+
+        response = await client.request(
+            'GET', f'/aladdin/api/v1/orders/{consignment_id}/info', endpoint='order-info', headers=headers
+        )
+        raise_for_status(response)
+        return response.json().get('data', {})
+
+
+async def gather_calls(client, func, args_by_key):
+    """Await func(client, *args) for every key.
+
+    Returns {key: (result, None)} or {key: (None, exception)}.
+    """
+    async def call(key, args):
+        try:
+            return key, (await func(client, *args), None)
+        except Exception as e:
+            return key, (None, e)
+
+    return dict(await asyncio.gather(*(call(key, args) for key, args in args_by_key.items())))
+
+
+def run_concurrently(func, args_by_key, max_concurrency=None):
+    """Run an AsyncPathaoService call for every key in one event loop.
+
+    Entry point for sync code (views, job handlers, CLI scripts); must not
+    be called from a running event loop. The token is passed in the args,
+    so every call of a batch shares the one PathaoService.get_access_token
+    returned. Returns outcomes like gather_calls.
+    """
+    max_concurrency = max_concurrency or current_app.config['PATHAO_MAX_CONCURRENT_REQUESTS']
+    client = get_client()
+
+    async def run():
+        async with AsyncPathaoClient(client, max_concurrency) as async_client:
+            return await gather_calls(async_client, func, args_by_key)
+
+    return asyncio.run(run())
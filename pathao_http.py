@@ -0,0 +1,352 @@
+import os
+import random
+import socket
+import threading
+import time
+from collections import deque
+from datetime import datetime, UTC
+from requests import Session
+from requests.adapters import HTTPAdapter
+from requests.exceptions import ConnectionError, ConnectTimeout, RequestException, Timeout
+from urllib3.exceptions import NewConnectionError
+from flask import current_app
+from sqlalchemy import select
+from models import db, dialect_insert, PathaoCircuit
+
+
+class CircuitOpenError(RequestException):
+    """Raised instead of calling an endpoint whose circuit is open"""
+
+
+def never_sent(error):
+    """Whether a failed request is known not to have reached Pathao"""
+    if isinstance(error, (CircuitOpenError, ConnectTimeout)):
+        return True
+    if isinstance(error, ConnectionError) and error.args:
+        # Refused connections and failed DNS lookups arrive wrapped in a MaxRetryError
+        return isinstance(getattr(error.args[0], 'reason', None), NewConnectionError)
+    return False
+
+
+class EndpointStats:
+    """Call counts and latencies for one API endpoint"""
+
+    SAMPLE_SIZE = 500  # Recent latencies kept for percentiles
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.retries = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.recent_ms = deque(maxlen=self.SAMPLE_SIZE)
+
+    def record(self, elapsed_ms, failed):
+        self.calls += 1
+        self.errors += int(failed)
+        self.total_ms += elapsed_ms
+        self.max_ms = max(self.max_ms, elapsed_ms)
+        self.recent_ms.append(elapsed_ms)
+
+    def summary(self):
+        recent = sorted(self.recent_ms)
+
+        def percentile(p):
+            return round(recent[min(len(recent) - 1, int(len(recent) * p / 100))], 1) if recent else None
+
+        return {
+            'calls': self.calls,
+            'errors': self.errors,
+            'retries': self.retries,
+            'total_ms': round(self.total_ms, 1),
+            'avg_ms': round(self.total_ms / self.calls, 1) if self.calls else None,
+            'p50_ms': percentile(50),
+            'p95_ms': percentile(95),
+            'max_ms': round(self.max_ms, 1)
+        }
+
+
+class CircuitBreaker:
+    """Closed / open / half-open state of one API endpoint.
+
+    After failure_threshold consecutive failures (connection errors,
+    timeouts, 429 and 5xx responses) the circuit opens and calls fail
+    at once with CircuitOpenError. After reset_seconds one trial call is
+    let through (half-open); its success closes the circuit, its failure
+    opens it again.
+    """
+
+    def __init__(self, endpoint, failure_threshold, reset_seconds):
+        self.endpoint = endpoint
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_at = None  # Epoch seconds
+        self.last_error = None
+        self.changed_at = 0.0  # Epoch seconds of the last state change
+        self.dirty = False  # State changed here and not yet shared with other workers
+        self.trial_running = False
+        self.lock = threading.Lock()
+
+    @property
+    def display_state(self):
+        if self.state == 'open' and (self.trial_running or time.time() - self.opened_at >= self.reset_seconds):
+            return 'half_open'
+        return self.state
+
+    @property
+    def is_open(self):
+        return self.display_state == 'open'
+
+    def _change(self, state):
+        self.state = state
+        self.changed_at = time.time()
+        self.dirty = True
+        if state == 'open':
+            self.opened_at = self.changed_at
+        else:
+            self.failures = 0
+
+    def before_call(self):
+        """Raise CircuitOpenError unless a call may be made now"""
+        with self.lock:
+            if self.state == 'closed':
+                return
+            if self.trial_running or time.time() - self.opened_at < self.reset_seconds:
+                raise CircuitOpenError(f'Pathao {self.endpoint} is unavailable (circuit open)')
+            self.trial_running = True
+
+    def record(self, failed, error=None):
+        with self.lock:
+            trial = self.trial_running
+            self.trial_running = False
+            if not failed:
+                if self.state != 'closed':
+                    self._change('closed')
+                self.failures = 0
+                return
+
+            self.failures += 1
+            self.last_error = error
+            if trial or (self.state == 'closed' and self.failures >= self.failure_threshold):
+                self._change('open')
+
+    def reset(self):
+        with self.lock:
+            self.trial_running = False
+            self._change('closed')
+
+    def adopt(self, row):
+        """Take over a newer state recorded by another worker"""
+        updated_at = row.updated_at.replace(tzinfo=UTC).timestamp()
+        with self.lock:
+            if updated_at <= self.changed_at:
+                return
+            self.state = row.state
+            self.failures = row.failures
+            self.opened_at = row.opened_at.replace(tzinfo=UTC).timestamp() if row.opened_at else None
+            self.last_error = row.last_error
+            self.changed_at = updated_at
+            self.dirty = False
+
+    def to_row(self):
+        with self.lock:
+            self.dirty = False
+            return {
+                'endpoint': self.endpoint,
+                'state': self.state,
+                'failures': self.failures,
+                'opened_at': datetime.fromtimestamp(self.opened_at, UTC) if self.opened_at else None,
+                'last_error': self.last_error,
+                'updated_at': datetime.fromtimestamp(self.changed_at, UTC)
+            }
+
+    def summary(self):
+        return {
+            'state': self.display_state,
+            'failures': self.failures,
+            'opened_at': datetime.fromtimestamp(self.opened_at, UTC) if self.state == 'open' else None,
+            'last_error': self.last_error
+        }
+
+
+class PathaoHttpClient:
+    """Keep-alive HTTP session for the Pathao API with retries and latency stats.
+
+    One client is shared per process (see get_client), so connections are
+    reused across requests and threads. Idempotent calls are retried on
+    connection errors, timeouts and 429/5xx gateway responses with jittered
+    exponential backoff; other calls are only retried when the connection
+    could not be opened, as the request never reached Pathao. Every
+    endpoint has a CircuitBreaker, so an unavailable endpoint fails fast.
+    """
+
+    IDEMPOTENT_METHODS = {'GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'}
+    RETRY_STATUSES = {429, 502, 503, 504}
+
+    def __init__(self, base_url, pool_size=10, connect_timeout=5, read_timeout=30,
+                 max_retries=3, backoff_seconds=0.5, backoff_max_seconds=8,
+                 failure_threshold=5, circuit_reset_seconds=30):
+        self.base_url = base_url.rstrip('/') if base_url else ''
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+        self.backoff_max_seconds = backoff_max_seconds
+
+        self.session = Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+        self._stats = {}
+        self._stats_lock = threading.Lock()
+
+        self.failure_threshold = failure_threshold
+        self.circuit_reset_seconds = circuit_reset_seconds
+        self.circuits = {}
+        self.circuits_synced_at = None  # Monotonic time of the last sync_circuits
+
+    def backoff_delay(self, attempt, response=None):
+        """Seconds to wait before the next attempt, honouring Retry-After when given"""
+        delay = random.uniform(0, min(self.backoff_max_seconds, self.backoff_seconds * 2 ** attempt))
+        retry_after = response.headers.get('Retry-After') if response is not None else None
+        if retry_after and retry_after.isdigit():
+            delay = min(self.backoff_max_seconds, int(retry_after))
+        return delay
+
+    def _backoff(self, attempt, response=None):
+        time.sleep(self.backoff_delay(attempt, response))
+
+    def record_call(self, endpoint, elapsed_ms, failed, retried):
+        with self._stats_lock:
+            stats = self._stats.setdefault(endpoint, EndpointStats())
+            stats.record(elapsed_ms, failed)
+            stats.retries += int(retried)
+
+    def circuit(self, endpoint):
+        with self._stats_lock:
+            breaker = self.circuits.get(endpoint)
+            if breaker is None:
+                breaker = CircuitBreaker(endpoint, self.failure_threshold, self.circuit_reset_seconds)
+                self.circuits[endpoint] = breaker
+            return breaker
+
+    def request(self, method, path, endpoint=None, idempotent=None, **kwargs):
+        """Send a request to the Pathao API and return the response.
+
+        endpoint names the call in the latency stats and circuit breakers
+        (default: path). idempotent overrides the method-based retry
+        decision, e.g. for read-only POST endpoints. Raises
+        CircuitOpenError without calling Pathao while the circuit is open.
+        """
+        method = method.upper()
+        endpoint = endpoint or path
+        if idempotent is None:
+            idempotent = method in self.IDEMPOTENT_METHODS
+        kwargs.setdefault('timeout', self.timeout)
+        breaker = self.circuit(endpoint)
+
+        attempt = 0
+        while True:
+            breaker.before_call()
+            started = time.perf_counter()
+            try:
+                response = self.session.request(method, self.base_url + path, **kwargs)
+            except (ConnectionError, Timeout) as e:
+                breaker.record(True, str(e))
+                can_retry = idempotent or isinstance(e, ConnectTimeout)
+                retrying = can_retry and attempt < self.max_retries
+                self.record_call(endpoint, (time.perf_counter() - started) * 1000, True, retrying)
+                if not retrying:
+                    raise
+                self._backoff(attempt)
+                attempt += 1
+                continue
+            except Exception as e:
+                # Not retried, but recorded so a half-open trial always finishes
+                breaker.record(True, str(e) or type(e).__name__)
+                self.record_call(endpoint, (time.perf_counter() - started) * 1000, True, False)
+                raise
+
+            failed = response.status_code >= 500 or response.status_code == 429
+            breaker.record(failed, f'HTTP {response.status_code}' if failed else None)
+            retrying = idempotent and response.status_code in self.RETRY_STATUSES and attempt < self.max_retries
+            self.record_call(endpoint, (time.perf_counter() - started) * 1000, response.status_code >= 400, retrying)
+            if not retrying:
+                return response
+            self._backoff(attempt, response)
+            attempt += 1
+
+    def stats(self):
+        """Per-endpoint latency summary, slowest total first"""
+        with self._stats_lock:
+            summaries = {endpoint: stats.summary() for endpoint, stats in self._stats.items()}
+        return dict(sorted(summaries.items(), key=lambda item: -item[1]['total_ms']))
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_client():
+    """Get this process's shared client for the configured Pathao API"""
+    config = current_app.config
+    # Sessions must not be shared with forked worker processes
+    key = (os.getpid(), config['PATHAO_BASE_URL'])
+    client = _clients.get(key)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(key)
+            if client is None:
+                client = PathaoHttpClient(
+                    config['PATHAO_BASE_URL'],
+                    pool_size=config['PATHAO_HTTP_POOL_SIZE'],
+                    connect_timeout=config['PATHAO_CONNECT_TIMEOUT'],
+                    read_timeout=config['PATHAO_READ_TIMEOUT'],
+                    max_retries=config['PATHAO_MAX_RETRIES'],
+                    backoff_seconds=config['PATHAO_RETRY_BACKOFF_SECONDS'],
+                    backoff_max_seconds=config['PATHAO_RETRY_BACKOFF_MAX_SECONDS'],
+                    failure_threshold=config['PATHAO_CIRCUIT_FAILURE_THRESHOLD'],
+                    circuit_reset_seconds=config['PATHAO_CIRCUIT_RESET_SECONDS']
+                )
+                _clients[key] = client
+
+    synced_at = client.circuits_synced_at
+    if synced_at is None or time.monotonic() - synced_at >= config['PATHAO_CIRCUIT_SYNC_SECONDS']:
+        sync_circuits(client)
+    return client
+
+
+def sync_circuits(client):
+    """Share circuit state with other workers through PathaoCircuit.
+
+    Local state changes are written (unless another worker recorded a
+    newer one) and newer states from other workers are adopted. Runs on
+    its own connection so the caller's transaction is not committed.
+    """
+    client.circuits_synced_at = time.monotonic()
+    worker_id = f'{socket.gethostname()}:{os.getpid()}'
+    try:
+        with db.engine.begin() as conn:
+            for breaker in list(client.circuits.values()):
+                if not breaker.dirty:
+                    continue
+                stmt = dialect_insert(PathaoCircuit).values(updated_by=worker_id, **breaker.to_row())
+                conn.execute(stmt.on_conflict_do_update(
+                    index_elements=['endpoint'],
+                    set_={
+                        'state': stmt.excluded.state,
+                        'failures': stmt.excluded.failures,
+                        'opened_at': stmt.excluded.opened_at,
+                        'last_error': stmt.excluded.last_error,
+                        'updated_at': stmt.excluded.updated_at,
+                        'updated_by': stmt.excluded.updated_by
+                    },
+                    where=PathaoCircuit.updated_at < stmt.excluded.updated_at
+                ))
+
+            for row in conn.execute(select(PathaoCircuit)).all():
+                client.circuit(row.endpoint).adopt(row)
+    except Exception as e:
+        current_app.logger.error(f"Error syncing Pathao circuit state: {str(e)}")
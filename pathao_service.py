@@ -1,11 +1,32 @@
-import requests
 import json
+import os
+import socket
+import threading
+import time
+from collections import OrderedDict
 from datetime import datetime, timedelta, UTC
-from models import db, PathaoCity, PathaoZone, PathaoToken, PathaoStore
+from sqlalchemy import delete, func, select
+from models import db, dialect_insert, PathaoCity, PathaoZone, PathaoToken, PathaoStore, CacheVersion, BackgroundJob, AddressParseCache, DeliveryQuote, Order
+from job_queue import job_handler
+from location_index import LOCATION_CACHE, get_location_index, invalidate_location_index
+from pathao_http import get_client
+from pathao_async import AsyncPathaoService, never_sent, run_concurrently
 from flask import current_app
 
+REFRESH_CACHE_JOB = 'pathao_refresh_cache'
+
 class PathaoService:
     CACHE_DURATION_HOURS = 24  # Cache location data for 24 hours
+    DEFAULT_ITEM_WEIGHT = 0.5  # kg, for orders without a parcel weight
+    DELIVERY_TYPES = {48: 'Normal Delivery', 12: 'On Demand Delivery'}
+    DEFAULT_DELIVERY_TYPE = 48
+    _token_cache = None  # Process-local copy of the access token
+    _token_lock = threading.Lock()
+    _cache_stats = {'hits': 0, 'stale_hits': 0, 'misses': 0, 'refreshes_queued': 0, 'quote_hits': 0, 'quote_misses': 0}
+    _cache_stats_lock = threading.Lock()
+    _refresh_checked = {}  # Cache key -> when this process last looked for a running refresh
+    _address_cache = OrderedDict()  # Address hash -> (parsed address, expiry), least recently used first
+    _address_cache_lock = threading.Lock()
     
     @staticmethod
     def get_config():
@@ -21,34 +42,110 @@ class PathaoService:
 
     @classmethod
     def get_access_token(cls):
-        """Get valid access token, refresh if needed"""
-        try:
-            # Check if we have a valid token in database
-            token_record = PathaoToken.query.first()
-            
-            if token_record and not token_record.is_expired:
-                return token_record.access_token
-            
-            # Need to get new token
-            if token_record and token_record.refresh_token:
-                # Try to refresh existing token
-                new_token = cls._refresh_token(token_record.refresh_token)
-                if new_token:
-                    return new_token
-            
-            # Get completely new token
-            return cls._issue_new_token()
+        """Get valid access token, refresh if needed.
+        
+        Served from a process-local copy until it expires, so most calls do
+        not touch the database. Renewal is single-flight: threads in a
+        process wait on a lock, and across processes the worker that claims
+        the token row renews it while the others wait for the new token.
+        """
+        token = cls._cached_token()
+        if token:
+            return token
+        
+        with cls._token_lock:
+            token = cls._cached_token()
+            if token:
+                return token
             
-        except Exception as e:
-            current_app.logger.error(f"Error getting access token: {str(e)}")
-            return None
+            try:
+                return cls._renew_token()
+            except Exception as e:
+                db.session.rollback()
+                current_app.logger.error(f"Error getting access token: {str(e)}")
+                return None
+    
+    @classmethod
+    def _cached_token(cls):
+        cached = cls._token_cache
+        if cached and datetime.now(UTC) < cached['expires_at']:
+            return cached['token']
+        return None
+    
+    @classmethod
+    def _remember_token(cls, token_record):
+        expires_at = token_record.expires_at
+        if expires_at.tzinfo is None:
+            expires_at = expires_at.replace(tzinfo=UTC)
+        cls._token_cache = {'token': token_record.access_token, 'expires_at': expires_at}
+        return token_record.access_token
+    
+    @classmethod
+    def _renew_token(cls):
+        """Get the token from the database, renewing it if no other worker is"""
+        config = current_app.config
+        token_record = PathaoToken.ensure_row()
+        if token_record.is_usable:
+            return cls._remember_token(token_record)
+        
+        worker_id = f'{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}'
+        if not PathaoToken.claim_refresh(token_record.id, worker_id, config['PATHAO_TOKEN_LOCK_SECONDS']):
+            return cls._wait_for_token(token_record.id, config['PATHAO_TOKEN_WAIT_SECONDS'])
+        
+        fresh_token = None
+        try:
+            # Another worker may have finished renewing just before the claim
+            token_record = db.session.get(PathaoToken, token_record.id, populate_existing=True)
+            if not token_record.is_usable:
+                data = None
+                if token_record.refresh_token:
+                    data = cls._refresh_token(token_record.refresh_token)
+                if not data:
+                    data = cls._issue_new_token()
+                if data:
+                    cls._store_token(token_record, data)
+                    fresh_token = data['access_token']
+        finally:
+            token_record.refreshing_by = None
+            token_record.refresh_started_at = None
+            db.session.commit()
+        
+        if token_record.is_usable:
+            return cls._remember_token(token_record)
+        # A token just issued is still valid even if it is already inside the
+        # renewal margin; use it for this call and renew again on the next
+        return fresh_token
+    
+    @classmethod
+    def _wait_for_token(cls, token_id, wait_seconds):
+        """Wait for the worker holding the renewal claim to store a new token"""
+        deadline = time.monotonic() + wait_seconds
+        while time.monotonic() < deadline:
+            time.sleep(0.2)
+            token_record = db.session.get(PathaoToken, token_id, populate_existing=True)
+            if token_record.is_usable:
+                return cls._remember_token(token_record)
+            if token_record.refresh_started_at is None:
+                break  # The renewal failed
+        
+        current_app.logger.error("Error getting access token: no token renewed by other worker")
+        return None
+    
+    @staticmethod
+    def _store_token(token_record, data):
+        # Calculate expiry time, renewing early for safety: an hour early, or
+        # a tenth of the lifetime for tokens that live less than ten hours
+        expires_in = data.get('expires_in', 432000)  # Default 5 days
+        margin = min(3600, expires_in // 10)
+        token_record.access_token = data['access_token']
+        token_record.refresh_token = data['refresh_token']
+        token_record.expires_at = datetime.now(UTC) + timedelta(seconds=expires_in - margin)
     
     @classmethod
     def _issue_new_token(cls):
-        """Issue a new access token"""
+        """Issue a new access token; returns the token response or None"""
         try:
             config = cls.get_config()
-            url = f"{config['BASE_URL']}/aladdin/api/v1/issue-token"
             payload = {
                 "client_id": config["CLIENT_ID"],
                 "client_secret": config["CLIENT_SECRET"],
@@ -57,31 +154,12 @@ class PathaoService:
                 "password": config["PASSWORD"]
             }
             
-            response = requests.post(url, json=payload, timeout=30)
+            # Issuing a token has no side effects worth protecting, so it may be retried
+            response = get_client().request(
+                'POST', '/aladdin/api/v1/issue-token', endpoint='issue-token', idempotent=True, json=payload
+            )
             response.raise_for_status()
-            
-            data = response.json()
-            
-            # Calculate expiry time (subtract 1 hour for safety)
-            expires_in = data.get('expires_in', 432000)  # Default 5 days
-            expires_at = datetime.now(UTC) + timedelta(seconds=expires_in - 3600)
-            
-            # Save token to database
-            token_record = PathaoToken.query.first()
-            if token_record:
-                token_record.access_token = data['access_token']
-                token_record.refresh_token = data['refresh_token']
-                token_record.expires_at = expires_at
-            else:
-                token_record = PathaoToken(
-                    access_token=data['access_token'],
-                    refresh_token=data['refresh_token'],
-                    expires_at=expires_at
-                )
-                db.session.add(token_record)
-            
-            db.session.commit()
-            return data['access_token']
+            return response.json()
             
         except Exception as e:
             current_app.logger.error(f"Error issuing new token: {str(e)}")
@@ -89,10 +167,9 @@ class PathaoService:
     
     @classmethod
     def _refresh_token(cls, refresh_token):
-        """Refresh access token using refresh token"""
+        """Refresh access token using refresh token; returns the token response or None"""
         try:
             config = cls.get_config()
-            url = f"{config['BASE_URL']}/aladdin/api/v1/issue-token"
             payload = {
                 "client_id": config["CLIENT_ID"],
                 "client_secret": config["CLIENT_SECRET"],
@@ -100,24 +177,11 @@ class PathaoService:
                 "refresh_token": refresh_token
             }
             
-            response = requests.post(url, json=payload, timeout=30)
+            response = get_client().request(
+                'POST', '/aladdin/api/v1/issue-token', endpoint='issue-token', idempotent=True, json=payload
+            )
             response.raise_for_status()
-            
-            data = response.json()
-            
-            # Calculate expiry time
-            expires_in = data.get('expires_in', 432000)
-            expires_at = datetime.now(UTC) + timedelta(seconds=expires_in - 3600)
-            
-            # Update token in database
-            token_record = PathaoToken.query.first()
-            if token_record:
-                token_record.access_token = data['access_token']
-                token_record.refresh_token = data['refresh_token']
-                token_record.expires_at = expires_at
-                db.session.commit()
-            
-            return data['access_token']
+            return response.json()
             
         except Exception as e:
             current_app.logger.error(f"Error refreshing token: {str(e)}")
@@ -125,31 +189,33 @@ class PathaoService:
     
     @classmethod
     def get_cities(cls, force_refresh=False):
-        """Get list of cities with caching"""
+        """Get list of cities with caching.
+        
+        Cached cities are returned even when stale, with a refresh queued
+        in the background; Pathao is only called inline when there are none.
+        """
         try:
             # Check cache first
             if not force_refresh:
-                cache_cutoff = datetime.now(UTC) - timedelta(hours=cls.CACHE_DURATION_HOURS)
-                cached_cities = PathaoCity.query.filter(
-                    PathaoCity.last_updated > cache_cutoff
-                ).all()
-                
+                cached_cities = PathaoCity.query.all()
                 if cached_cities:
+                    cls._check_freshness(
+                        'cities', max(city.last_updated for city in cached_cities), {'dataset': 'cities'}
+                    )
                     return cached_cities
+                cls._count_cache('misses')
             
             # Fetch from API
             access_token = cls.get_access_token()
             if not access_token:
                 return []
             
-            config = cls.get_config()
-            url = f"{config['BASE_URL']}/aladdin/api/v1/city-list"
             headers = {
                 "Authorization": f"Bearer {access_token}",
                 "Content-Type": "application/json; charset=UTF-8"
             }
             
-            response = requests.get(url, headers=headers, timeout=30)
+            response = get_client().request('GET', '/aladdin/api/v1/city-list', endpoint='city-list', headers=headers)
             response.raise_for_status()
             
             data = response.json()
@@ -166,23 +232,146 @@ class PathaoService:
             # Return cached data even if stale
             return PathaoCity.query.all()
     
+    @classmethod
+    def _count_cache(cls, counter):
+        with cls._cache_stats_lock:
+            cls._cache_stats[counter] += 1
+    
+    @classmethod
+    def _refresh_check_due(cls, key):
+        """Whether this process may look for a running refresh of key again"""
+        now = time.monotonic()
+        with cls._cache_stats_lock:
+            last_checked = cls._refresh_checked.get(key)
+            if last_checked is not None and now - last_checked < current_app.config['PATHAO_REFRESH_CHECK_SECONDS']:
+                return False
+            cls._refresh_checked[key] = now
+        return True
+    
+    @classmethod
+    def _check_freshness(cls, key, refreshed_at, job_payload):
+        """Count a cache read and queue a background refresh if the data is stale.
+        
+        At most one refresh per key is queued or running at a time, and a
+        process looks for one at most every PATHAO_REFRESH_CHECK_SECONDS.
+        """
+        if refreshed_at and refreshed_at.tzinfo is None:
+            refreshed_at = refreshed_at.replace(tzinfo=UTC)
+        if refreshed_at and datetime.now(UTC) - refreshed_at < timedelta(hours=cls.CACHE_DURATION_HOURS):
+            cls._count_cache('hits')
+            return
+        
+        cls._count_cache('stale_hits')
+        if not cls._refresh_check_due(key):
+            return
+        
+        reference = f'pathao-cache:{key}'
+        latest = BackgroundJob.latest_for(reference, REFRESH_CACHE_JOB)
+        if latest and latest.is_active:
+            return
+        try:
+            # Callers are read paths; their transaction is not ours to commit
+            BackgroundJob.enqueue_now(REFRESH_CACHE_JOB, job_payload, reference=reference, max_attempts=1)
+        except Exception as e:
+            current_app.logger.error(f"Error queueing Pathao {key} refresh: {str(e)}")
+            return
+        cls._count_cache('refreshes_queued')
+    
+    @classmethod
+    def cache_stats(cls):
+        """Cache read counters for this process and the age of the cached data"""
+        with cls._cache_stats_lock:
+            stats = dict(cls._cache_stats)
+        
+        now = datetime.now(UTC)
+        refreshed = {
+            'cities': db.session.scalar(select(func.max(PathaoCity.last_updated))),
+            # Zone lists are refreshed per city; report the oldest
+            'zones': db.session.scalar(select(func.min(PathaoZone.last_updated))),
+            'stores': db.session.scalar(select(func.max(PathaoStore.updated_at)))
+        }
+        stats['refresh_age_seconds'] = {
+            dataset: int((now - refreshed_at.replace(tzinfo=UTC)).total_seconds()) if refreshed_at else None
+            for dataset, refreshed_at in refreshed.items()
+        }
+        return stats
+    
     @classmethod
     def parse_address(cls, address):
+        """Parse a free-text address with Pathao's address parser.
+        
+        Results are kept for ADDRESS_CACHE_TTL_HOURS in a bounded in-process
+        LRU backed by AddressParseCache, keyed by the normalised address, so
+        repeat lookups skip Pathao. Failed lookups are not cached.
+        """
+        normalized = AddressParseCache.normalize(address)
+        if not normalized:
+            return {}
+        address_hash = AddressParseCache.hash_address(normalized)
+        
+        cached = cls._address_cache_get(address_hash)
+        if cached is None:
+            try:
+                cached = AddressParseCache.lookup(address_hash)
+            except Exception as e:
+                current_app.logger.error(f"Error reading address cache: {str(e)}")
+            if cached:
+                cls._address_cache_put(address_hash, *cached)
+                cached = cached[0]
+        if cached is not None:
+            return dict(cached)
+        
+        parsed = cls._request_address_parse(address)
+        if parsed:
+            expires_at = datetime.now(UTC) + timedelta(hours=current_app.config['ADDRESS_CACHE_TTL_HOURS'])
+            try:
+                AddressParseCache.store(address_hash, normalized, parsed, expires_at)
+            except Exception as e:
+                current_app.logger.error(f"Error saving address cache: {str(e)}")
+            cls._address_cache_put(address_hash, parsed, expires_at)
+        return parsed
+    
+    @classmethod
+    def _address_cache_get(cls, address_hash):
+        with cls._address_cache_lock:
+            entry = cls._address_cache.get(address_hash)
+            if entry is None:
+                return None
+            if entry[1] <= datetime.now(UTC):
+                del cls._address_cache[address_hash]
+                return None
+            cls._address_cache.move_to_end(address_hash)
+            return entry[0]
+    
+    @classmethod
+    def _address_cache_put(cls, address_hash, result, expires_at):
+        if expires_at.tzinfo is None:
+            expires_at = expires_at.replace(tzinfo=UTC)
+        with cls._address_cache_lock:
+            cls._address_cache[address_hash] = (result, expires_at)
+            cls._address_cache.move_to_end(address_hash)
+            while len(cls._address_cache) > current_app.config['ADDRESS_CACHE_SIZE']:
+                cls._address_cache.popitem(last=False)
+    
+    @classmethod
+    def _request_address_parse(cls, address):
         # send a request to api/v1/address-parser as a string and get back the response
         try:
             access_token = cls.get_access_token()
             if not access_token:
                 return {}
             
-            config = cls.get_config()
-            url = f"{config['BASE_URL']}/aladdin/api/v1/address-parser"
             headers = {
                 "Authorization": f"Bearer {access_token}",
                 "Content-Type": "application/json; charset=UTF-8"
             }
             payload = {"address": address}
             
-            response = requests.post(url, headers=headers, json=payload, timeout=30)
+            # Read-only lookup despite being a POST
+            response = get_client().request(
+                'POST', '/aladdin/api/v1/address-parser', endpoint='address-parser', idempotent=True,
+                headers=headers, json=payload
+            )
             response.raise_for_status()
             
             data = response.json()
@@ -191,36 +380,214 @@ class PathaoService:
         except Exception as e:
             current_app.logger.error(f"Error parsing address: {str(e)}")
             return {}
+    
+    @staticmethod
+    def quote_key(store_id, city_id, zone_id, item_weight, delivery_type):
+        """DeliveryQuote key for a parcel; weights are compared in whole grams"""
+        return (int(store_id), int(city_id), int(zone_id), int(round(float(item_weight) * 1000)), int(delivery_type))
+    
+    @staticmethod
+    def price_plan_request(key):
+        """Pathao price-plan request body for a quote key"""
+        store_id, city_id, zone_id, weight_grams, delivery_type = key
+        return {
+            "store_id": store_id,
+            "item_type": 2,  # 2 for parcel
+            "delivery_type": delivery_type,
+            "item_weight": weight_grams / 1000,
+            "recipient_city": city_id,
+            "recipient_zone": zone_id
+        }
+    
+    @staticmethod
+    def fetch_price_plan(client, token, body):
+        """Get Pathao's price plan for a parcel"""
+        headers = {
+            "Authorization": f"Bearer {token}",
+            "Content-Type": "application/json; charset=UTF-8"
+        }
+        
+        # Read-only lookup despite being a POST
+        response = client.request(
+            'POST', '/aladdin/api/v1/merchant/price-plan', endpoint='price-plan', idempotent=True,
+            headers=headers, json=body
+        )
+        response.raise_for_status()
+        return response.json().get('data', {})
+    
+    @staticmethod
+    def default_store_id():
+        """Store that quotes are made for: PATHAO_DEFAULT_STORE_ID, else the first active store"""
+        configured = current_app.config.get('PATHAO_DEFAULT_STORE_ID')
+        if configured:
+            return int(configured)
+        return db.session.scalar(
+            select(PathaoStore.id).where(PathaoStore.is_active.is_(True)).order_by(PathaoStore.id).limit(1)
+        )
+    
+    @staticmethod
+    def _quote_ttl():
+        return timedelta(hours=current_app.config['DELIVERY_QUOTE_TTL_HOURS'])
+    
+    @classmethod
+    def get_delivery_quote(cls, city_id, zone_id, item_weight=None, delivery_type=None, store_id=None):
+        """Quote Pathao's delivery charge for a parcel.
+        
+        Quotes are cached in DeliveryQuote for DELIVERY_QUOTE_TTL_HOURS per
+        store, city, zone, weight and delivery type. If Pathao cannot be
+        reached an expired quote is returned, marked stale. Returns a dict
+        with the price, or None if there is no quote.
+        """
+        store_id = store_id or cls.default_store_id()
+        if not store_id:
+            return None
+        key = cls.quote_key(
+            store_id, city_id, zone_id,
+            item_weight or cls.DEFAULT_ITEM_WEIGHT, delivery_type or cls.DEFAULT_DELIVERY_TYPE
+        )
+        
+        now = datetime.now(UTC)
+        cached = DeliveryQuote.lookup(key)
+        if cached and cached[1] > now:
+            cls._count_cache('quote_hits')
+            return cls._quote_result(key, cached[0], stale=False)
+        cls._count_cache('quote_misses')
+        
+        plan = None
+        try:
+            access_token = cls.get_access_token()
+            if access_token:
+                plan = cls.fetch_price_plan(get_client(), access_token, cls.price_plan_request(key))
+        except Exception as e:
+            current_app.logger.error(f"Error fetching Pathao price plan: {str(e)}")
+        
+        if plan:
+            ttl = cls._quote_ttl()
+            try:
+                DeliveryQuote.store({key: plan}, now + ttl, now - ttl)
+            except Exception as e:
+                current_app.logger.error(f"Error caching delivery quote: {str(e)}")
+            return cls._quote_result(key, plan, stale=False)
+        if cached:
+            return cls._quote_result(key, cached[0], stale=True)
+        return None
+    
+    @staticmethod
+    def _quote_result(key, plan, stale):
+        store_id, city_id, zone_id, weight_grams, delivery_type = key
+        return {
+            'price': float(DeliveryQuote.plan_price(plan)),
+            'store_id': store_id,
+            'city_id': city_id,
+            'zone_id': zone_id,
+            'item_weight': weight_grams / 1000,
+            'delivery_type': delivery_type,
+            'stale': stale
+        }
+    
+    @classmethod
+    def prefetch_delivery_quotes(cls, limit=None, max_workers=None):
+        """Quote the most-ordered zones ahead of time.
+        
+        Takes the DELIVERY_QUOTE_PREFETCH_ZONES zones with the most orders in
+        the last DELIVERY_QUOTE_PREFETCH_DAYS and fetches the quotes that are
+        missing or expired for the default store, weight and delivery type,
+        concurrently. Returns a summary dict. Raises RuntimeError if there is
+        no store or access token.
+        """
+        config = current_app.config
+        store_id = cls.default_store_id()
+        if not store_id:
+            raise RuntimeError('No Pathao store to quote for')
+        
+        since = datetime.now(UTC) - timedelta(days=config['DELIVERY_QUOTE_PREFETCH_DAYS'])
+        zones = db.session.execute(
+            select(Order.city_id, Order.zone_id)
+            .where(Order.created_at >= since, Order.city_id.isnot(None), Order.zone_id.isnot(None))
+            .group_by(Order.city_id, Order.zone_id)
+            .order_by(func.count().desc())
+            .limit(limit or config['DELIVERY_QUOTE_PREFETCH_ZONES'])
+        ).all()
+        keys = [
+            cls.quote_key(store_id, city_id, zone_id, cls.DEFAULT_ITEM_WEIGHT, cls.DEFAULT_DELIVERY_TYPE)
+            for city_id, zone_id in zones
+        ]
+        fresh = DeliveryQuote.fresh_keys(keys)
+        missing = [key for key in keys if key not in fresh]
+        summary = {'zones': len(keys), 'fetched': 0, 'failed': 0}
+        if not missing:
+            return summary
+        
+        access_token = cls.get_access_token()
+        if not access_token:
+            raise RuntimeError('Failed to get access token')
+        
+        outcomes = run_concurrently(AsyncPathaoService.fetch_price_plan, {
+            key: (access_token, cls.price_plan_request(key))
+            for key in missing
+        }, max_workers)
+        
+        plans = {}
+        for key, (plan, error) in outcomes.items():
+            if error or not plan:
+                current_app.logger.error(f"Error prefetching delivery quote {key}: {str(error or 'empty plan')}")
+                summary['failed'] += 1
+            else:
+                plans[key] = plan
+        
+        now = datetime.now(UTC)
+        ttl = cls._quote_ttl()
+        DeliveryQuote.store(plans, now + ttl, now - ttl)
+        summary['fetched'] = len(plans)
+        return summary
+    
+    @classmethod
+    def schedule_quote_prefetch(cls):
+        """Queue a prefetch of common zones' quotes unless one ran recently.
+        
+        A prefetch runs at most every half DELIVERY_QUOTE_TTL_HOURS, and a
+        process looks for one at most every PATHAO_REFRESH_CHECK_SECONDS.
+        """
+        if not cls._refresh_check_due('quotes'):
+            return
+        
+        reference = 'pathao-cache:quotes'
+        latest = BackgroundJob.latest_for(reference, REFRESH_CACHE_JOB)
+        if latest and (latest.is_active or
+                       datetime.now(UTC) - latest.updated_at.replace(tzinfo=UTC) < cls._quote_ttl() / 2):
+            return
+        BackgroundJob.enqueue_now(REFRESH_CACHE_JOB, {'dataset': 'quotes'}, reference=reference, max_attempts=1)
+        cls._count_cache('refreshes_queued')
 
 
     @classmethod
     def get_zones(cls, city_id, force_refresh=False):
-        """Get zones for a city with caching"""
+        """Get zones for a city with caching, refreshed in the background like get_cities"""
         try:
             # Check cache first
             if not force_refresh:
-                cache_cutoff = datetime.now(UTC) - timedelta(hours=cls.CACHE_DURATION_HOURS)
-                cached_zones = PathaoZone.query.filter(
-                    PathaoZone.city_id == city_id,
-                    PathaoZone.last_updated > cache_cutoff
-                ).all()
-                
+                cached_zones = PathaoZone.query.filter_by(city_id=city_id).all()
                 if cached_zones:
+                    cls._check_freshness(
+                        f'zones:{city_id}', max(zone.last_updated for zone in cached_zones),
+                        {'dataset': 'zones', 'city_id': city_id}
+                    )
                     return cached_zones
+                cls._count_cache('misses')
             
             # Fetch from API
             access_token = cls.get_access_token()
             if not access_token:
                 return []
             
-            config = cls.get_config()
-            url = f"{config['BASE_URL']}/aladdin/api/v1/cities/{city_id}/zone-list"
             headers = {
                 "Authorization": f"Bearer {access_token}",
                 "Content-Type": "application/json; charset=UTF-8"
             }
             
-            response = requests.get(url, headers=headers, timeout=30)
+            response = get_client().request(
+                'GET', f'/aladdin/api/v1/cities/{city_id}/zone-list', endpoint='zone-list', headers=headers
+            )
             response.raise_for_status()
             
             data = response.json()
@@ -242,92 +609,154 @@ class PathaoService:
     def _update_cities_cache(cls, cities_data):
         """Update cities cache in database"""
         try:
-            for city_data in cities_data:
-                city = PathaoCity.query.filter_by(city_id=city_data['city_id']).first()
-                if city:
-                    city.city_name = city_data['city_name']
-                    city.last_updated = datetime.now(UTC)
-                else:
-                    city = PathaoCity(
-                        city_id=city_data['city_id'],
-                        city_name=city_data['city_name'],
-                        last_updated=datetime.now(UTC)
-                    )
-                    db.session.add(city)
-            
+            cls._write_cities(cities_data)
             db.session.commit()
+            invalidate_location_index()
             
         except Exception as e:
             current_app.logger.error(f"Error updating cities cache: {str(e)}")
             db.session.rollback()
     
+    @staticmethod
+    def _write_cities(cities_data):
+        """Upsert the full city list and remove cities no longer listed"""
+        if not cities_data:
+            return  # Never treat an empty response as "every city was removed"
+        
+        now = datetime.now(UTC)
+        stmt = dialect_insert(PathaoCity)
+        db.session.execute(
+            stmt.on_conflict_do_update(
+                index_elements=['city_id'],
+                set_={'city_name': stmt.excluded.city_name, 'last_updated': stmt.excluded.last_updated}
+            ),
+            [{'city_id': city['city_id'], 'city_name': city['city_name'], 'last_updated': now} for city in cities_data]
+        )
+        
+        city_ids = [city['city_id'] for city in cities_data]
+        db.session.execute(delete(PathaoZone).where(PathaoZone.city_id.notin_(city_ids)))
+        db.session.execute(delete(PathaoCity).where(PathaoCity.city_id.notin_(city_ids)))
+        CacheVersion.bump(LOCATION_CACHE)
+    
     @classmethod
     def _update_zones_cache(cls, city_id, zones_data):
         """Update zones cache in database"""
         try:
-            for zone_data in zones_data:
-                zone = PathaoZone.query.filter_by(zone_id=zone_data['zone_id']).first()
-                if zone:
-                    zone.zone_name = zone_data['zone_name']
-                    zone.city_id = city_id
-                    zone.last_updated = datetime.now(UTC)
-                else:
-                    zone = PathaoZone(
-                        zone_id=zone_data['zone_id'],
-                        zone_name=zone_data['zone_name'],
-                        city_id=city_id,
-                        last_updated=datetime.now(UTC)
-                    )
-                    db.session.add(zone)
-            
+            cls._write_zones({city_id: zones_data})
             db.session.commit()
+            invalidate_location_index()
             
         except Exception as e:
             current_app.logger.error(f"Error updating zones cache: {str(e)}")
             db.session.rollback()
     
+    @staticmethod
+    def _write_zones(zones_by_city):
+        """Upsert the zone lists of the given cities and remove zones no longer listed.
+        
+        zones_by_city maps city ids to their full zone lists. Cities with an
+        empty list are left alone.
+        """
+        zones_by_city = {city_id: zones_data for city_id, zones_data in zones_by_city.items() if zones_data}
+        if not zones_by_city:
+            return
+        
+        now = datetime.now(UTC)
+        rows = [
+            {'zone_id': zone['zone_id'], 'zone_name': zone['zone_name'], 'city_id': city_id, 'last_updated': now}
+            for city_id, zones_data in zones_by_city.items()
+            for zone in zones_data
+        ]
+        stmt = dialect_insert(PathaoZone)
+        db.session.execute(
+            stmt.on_conflict_do_update(
+                index_elements=['zone_id'],
+                set_={
+                    'zone_name': stmt.excluded.zone_name,
+                    'city_id': stmt.excluded.city_id,
+                    'last_updated': stmt.excluded.last_updated
+                }
+            ),
+            rows
+        )
+        db.session.execute(delete(PathaoZone).where(
+            PathaoZone.city_id.in_(list(zones_by_city)),
+            PathaoZone.zone_id.notin_([row['zone_id'] for row in rows])
+        ))
+        CacheVersion.bump(LOCATION_CACHE)
+    
+    
+    @classmethod
+    def lookup_location(cls, city_id, zone_id):
+        """Get location names if the zone belongs to the city, else None"""
+        return get_location_index().lookup(city_id, zone_id)
     
     @classmethod
     def get_location_names(cls, city_id=None, zone_id=None):
         """Get location names for given IDs"""
+        index = get_location_index()
         result = {}
         
         if city_id:
-            city = PathaoCity.query.filter_by(city_id=city_id).first()
-            result['city_name'] = city.city_name if city else None
+            result['city_name'] = index.city_names.get(city_id)
         
         if zone_id:
-            zone = PathaoZone.query.filter_by(zone_id=zone_id).first()
-            result['zone_name'] = zone.zone_name if zone else None
+            zone = index.zones.get(zone_id)
+            result['zone_name'] = zone[1] if zone else None
         
         return result
+    
+    @classmethod
+    def cities_payload(cls):
+        """Serialised city list for the order form, refreshed from Pathao when due"""
+        index = get_location_index()
+        if not index.city_names:
+            cls.get_cities()
+            index = get_location_index()
+        else:
+            cls._check_freshness('cities', index.cities_updated_at, {'dataset': 'cities'})
+        return index.cities_json
+    
+    @classmethod
+    def zones_payload(cls, city_id):
+        """Serialised zone list of a city, refreshed from Pathao when due"""
+        index = get_location_index()
+        if city_id not in index.city_zones:
+            cls.get_zones(city_id)
+            index = get_location_index()
+        else:
+            cls._check_freshness(
+                f'zones:{city_id}', index.zones_updated_at.get(city_id), {'dataset': 'zones', 'city_id': city_id}
+            )
+        return index.zones_json(city_id)
 
 
 
     @classmethod
     def get_stores(cls, force_refresh=False):
-        """Get list of stores with caching"""
+        """Get list of stores with caching, refreshed in the background like get_cities"""
         try:
             # Check cache first
             if not force_refresh:
-                cache_cutoff = datetime.now(UTC) - timedelta(hours=cls.CACHE_DURATION_HOURS)
-                cached_stores = PathaoStore.query.filter(PathaoStore.updated_at > cache_cutoff).all()
+                cached_stores = PathaoStore.query.all()
                 if cached_stores:
+                    cls._check_freshness(
+                        'stores', max(store.updated_at for store in cached_stores), {'dataset': 'stores'}
+                    )
                     return cached_stores
+                cls._count_cache('misses')
 
             # Fetch from API
             access_token = cls.get_access_token()
             if not access_token:
                 return []
 
-            config = cls.get_config()
-            url = f"{config['BASE_URL']}/aladdin/api/v1/stores"
             headers = {
                 "Authorization": f"Bearer {access_token}",
                 "Content-Type": "application/json"
             }
 
-            response = requests.get(url, headers=headers, timeout=30)
+            response = get_client().request('GET', '/aladdin/api/v1/stores', endpoint='stores', headers=headers)
             response.raise_for_status()
 
             data = response.json()
@@ -348,68 +777,274 @@ class PathaoService:
     def _update_stores_cache(cls, stores_data):
         """Update stores cache in database"""
         try:
-            for store_data in stores_data:
-                store = PathaoStore.query.filter_by(id=store_data['store_id']).first()
-                if store:
-                    store.store_name = store_data.get('store_name', store.store_name)
-                    store.store_address = store_data.get('store_address', store.store_address)
-                    store.updated_at = datetime.now(UTC)
-                else:
-                    new_store = PathaoStore(
-                        id=store_data['store_id'],
-                        store_name=store_data.get('store_name', ''),
-                        store_address=store_data.get('store_address', ''),
-                        updated_at=datetime.now(UTC)
-                    )
-                    db.session.add(new_store)
+            cls._write_stores(stores_data)
             db.session.commit()
 
         except Exception as e:
             current_app.logger.error(f"Error updating stores cache: {str(e)}")
             db.session.rollback()
 
+    @staticmethod
+    def _write_stores(stores_data):
+        """Upsert the full store list and remove stores no longer listed"""
+        if not stores_data:
+            return
+
+        now = datetime.now(UTC)
+        stmt = dialect_insert(PathaoStore)
+        db.session.execute(
+            stmt.on_conflict_do_update(
+                index_elements=['id'],
+                set_={
+                    'store_name': stmt.excluded.store_name,
+                    'store_address': stmt.excluded.store_address,
+                    'updated_at': stmt.excluded.updated_at
+                }
+            ),
+            [
+                {
+                    'id': store['store_id'],
+                    'store_name': store.get('store_name', ''),
+                    'store_address': store.get('store_address', ''),
+                    'is_active': True,
+                    'created_at': now,
+                    'updated_at': now
+                }
+                for store in stores_data
+            ]
+        )
+        db.session.execute(delete(PathaoStore).where(
+            PathaoStore.id.notin_([store['store_id'] for store in stores_data])
+        ))
+
+    @staticmethod
+    def fetch_list(client, token, path, endpoint):
+        """Get a Pathao list endpoint's items"""
+        headers = {
+            "Authorization": f"Bearer {token}",
+            "Content-Type": "application/json; charset=UTF-8"
+        }
+
+        response = client.request('GET', path, endpoint=endpoint, headers=headers)
+        response.raise_for_status()
+        return response.json().get('data', {}).get('data', [])
+
+    @classmethod
+    def refresh_location_data(cls, max_workers=None):
+        """Re-fetch all cities, zones and stores and swap them in at once.
+
+        Everything is downloaded first, with zone lists fetched concurrently
+        on one event loop (at most max_workers requests in flight),
+        and then written in a single transaction, so readers see either the
+        old or the new data and never an empty table. Rows no longer listed
+        by Pathao are removed. If the city list cannot be fetched nothing is
+        changed; cities whose zones or a store list that could not be
+        fetched keep their current rows. Returns a summary dict.
+        Raises RuntimeError if no access token or city list can be obtained.
+        """
+        token = cls.get_access_token()
+        if not token:
+            raise RuntimeError('Failed to get access token')
+
+        client = get_client()
+        cities_data = cls.fetch_list(client, token, '/aladdin/api/v1/city-list', 'city-list')
+        if not cities_data:
+            raise RuntimeError('Pathao returned no cities')
+        outcomes = run_concurrently(AsyncPathaoService.fetch_list, {
+            city['city_id']: (token, f"/aladdin/api/v1/cities/{city['city_id']}/zone-list", 'zone-list')
+            for city in cities_data
+        }, max_workers)
+        try:
+            stores_data = cls.fetch_list(client, token, '/aladdin/api/v1/stores', 'stores')
+        except Exception as e:
+            current_app.logger.error(f"Error fetching stores: {str(e)}")
+            stores_data = None
+
+        failed_cities = []
+        zones_by_city = {}
+        for city_id, (zones_data, error) in outcomes.items():
+            if error:
+                current_app.logger.error(f"Error fetching zones for city {city_id}: {str(error)}")
+                failed_cities.append(city_id)
+            else:
+                zones_by_city[city_id] = zones_data
+
+        try:
+            cls._write_cities(cities_data)
+            cls._write_zones(zones_by_city)
+            cls._write_stores(stores_data)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        invalidate_location_index()
+
+        return {
+            'cities': len(cities_data),
+            'zones': sum(len(zones_data) for zones_data in zones_by_city.values()),
+            'stores': len(stores_data) if stores_data is not None else None,
+            'failed_cities': sorted(failed_cities)
+        }
+
 
+    @staticmethod
+    def build_order_payload(order, store_id):
+        """Build the Pathao create-order request body for an order"""
+        customer = order.customer
+        return {
+            "store_id": int(store_id),
+            "merchant_order_id": str(order.id),
+            "recipient_name": customer.name,
+            "recipient_phone": customer.phone,
+            "recipient_address": customer.address,
+            "recipient_city": order.city_id,
+            "recipient_zone": order.zone_id,
+            "delivery_type": order.delivery_type or PathaoService.DEFAULT_DELIVERY_TYPE,
+            "item_type": 2,  # 2 for parcel
+            "item_quantity": order.item_count,
+            "item_weight": float(order.item_weight or PathaoService.DEFAULT_ITEM_WEIGHT),
+            "item_description": "Mixed order",
+            "amount_to_collect": int(order.total_amount),
+        }
+    
+    @staticmethod
+    def submit_order(client, token, order_data):
+        """Send a prepared order to Pathao.
+        
+        Not retried once sent, as Pathao would create the order twice.
+        """
+        headers = {
+            "Authorization": f"Bearer {token}",
+            "Content-Type": "application/json"
+        }
+        
+        response = client.request('POST', '/aladdin/api/v1/orders', endpoint='create-order', headers=headers, json=order_data)
+        response.raise_for_status()
+        return response.json()
+    
     @classmethod
     def create_order(cls, order, store_id=None):
-        """Create order in Pathao system with specified store"""
+        """Create order in Pathao system with specified store.
+        
+        When the call itself fails, the response carries 'retryable': True
+        only if the order is known not to have reached Pathao, so sending it
+        again cannot create a second consignment.
+        """
         try:
             token = cls.get_access_token()
             if not token:
-                return {'code': 400, 'message': 'Failed to get access token'}
-            
-            customer = order.customer
+                return {'code': 400, 'message': 'Failed to get access token', 'retryable': True}
             
             # Use provided store_id or fallback to default
             if store_id is None:
                 current_app.logger.error(f"Error creating Pathao order: No store found")
                 return {'code': 500, 'message': f'Failed to create order: No store found'}
             
-            config = cls.get_config()
-            order_data = {
-                "store_id": int(store_id),
-                "merchant_order_id": str(order.id),
-                "recipient_name": customer.name,
-                "recipient_phone": customer.phone,
-                "recipient_address": customer.address,
-                "recipient_city": order.city_id,
-                "recipient_zone": order.zone_id,
-                "delivery_type": 48,
-                "item_type": 2,  # 2 for parcel
-                "item_quantity": order.item_count,
-                "item_weight": float(0.5),
-                "item_description": "Mixed order",
-                "amount_to_collect": int(order.total_amount),
-            }
-            url = f"{config['BASE_URL']}/aladdin/api/v1/orders"
-            headers = {
-                "Authorization": f"Bearer {token}",
-                "Content-Type": "application/json"
-            }
-            
-            response = requests.post(url, headers=headers, json=order_data, timeout=30)
-            response.raise_for_status()
-            return response.json()
+            return cls.submit_order(get_client(), token, cls.build_order_payload(order, store_id))
             
         except Exception as e:
             current_app.logger.error(f"Error creating Pathao order: {str(e)}")
-            return {'code': 500, 'message': f'Failed to create order: {str(e)}'}
+            return {'code': 500, 'message': f'Failed to create order: {str(e)}', 'retryable': cls._order_not_created(e)}
+    
+    @staticmethod
+    def _order_not_created(error):
+        """Whether a failed create-order call certainly left no order in Pathao"""
+        if never_sent(error):
+            return True
+        # Rate limited or unavailable: Pathao turned the request away unprocessed
+        response = getattr(error, 'response', None)
+        return response is not None and response.status_code in (429, 503)
+    
+    @staticmethod
+    def _ensure_circuit_closed(endpoint):
+        """Fail a whole batch up front instead of per item while Pathao is down"""
+        if get_client().circuit(endpoint).is_open:
+            raise RuntimeError(f'Pathao {endpoint} is unavailable (circuit open)')
+    
+    @classmethod
+    def create_orders(cls, orders, store_id, max_workers=None):
+        """Create many orders in Pathao concurrently.
+        
+        Request bodies and the access token are prepared up front; the HTTP
+        calls then run on one event loop with at most max_workers in flight.
+        Returns {order id: response}, where a failed order gets a response
+        like create_order's errors, including 'retryable'.
+        Raises RuntimeError if order creation's circuit is open or no access
+        token can be obtained.
+        """
+        cls._ensure_circuit_closed('create-order')
+        token = cls.get_access_token()
+        if not token:
+            raise RuntimeError('Failed to get access token')
+        
+        outcomes = run_concurrently(AsyncPathaoService.submit_order, {
+            order.id: (token, cls.build_order_payload(order, store_id))
+            for order in orders
+        }, max_workers)
+        
+        responses = {}
+        for order_id, (response, error) in outcomes.items():
+            if error:
+                current_app.logger.error(f"Error creating Pathao order {order_id}: {str(error)}")
+                response = {
+                    'code': 500,
+                    'message': f'Failed to create order: {str(error)}',
+                    'retryable': cls._order_not_created(error)
+                }
+            responses[order_id] = response
+        return responses
+    
+    @staticmethod
+    def parse_time(value):
+        """Parse a Pathao timestamp into a naive UTC datetime, or None"""
+        if not value:
+            return None
+        try:
+            parsed = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+        except ValueError:
+            return None
+        if parsed.tzinfo:
+            parsed = parsed.astimezone(UTC).replace(tzinfo=None)
+        return parsed
+    
+    @classmethod
+    def get_order_statuses(cls, consignment_ids, max_workers=None):
+        """Fetch the status of many consignments concurrently.
+        
+        Returns {consignment id: (status, status time or None)}; consignments
+        that could not be fetched are left out and logged. Raises
+        RuntimeError if the order-info circuit is open or no access token
+        can be obtained.
+        """
+        cls._ensure_circuit_closed('order-info')
+        token = cls.get_access_token()
+        if not token:
+            raise RuntimeError('Failed to get access token')
+        
+        outcomes = run_concurrently(AsyncPathaoService.fetch_order_info, {
+            consignment_id: (token, consignment_id)
+            for consignment_id in consignment_ids
+        }, max_workers)
+        
+        statuses = {}
+        for consignment_id, (data, error) in outcomes.items():
+            if error or not data.get('order_status'):
+                current_app.logger.error(f"Error fetching Pathao status for {consignment_id}: {str(error or 'no status')}")
+                continue
+            statuses[consignment_id] = (data['order_status'], cls.parse_time(data.get('updated_at')))
+        return statuses
+
+
+@job_handler(REFRESH_CACHE_JOB)
+def refresh_cache(payload):
+    """Background refresh of stale cities, zones or stores, or a delivery quote prefetch"""
+    dataset = payload['dataset']
+    if dataset == 'cities':
+        PathaoService.get_cities(force_refresh=True)
+    elif dataset == 'zones':
+        PathaoService.get_zones(payload['city_id'], force_refresh=True)
+    elif dataset == 'stores':
+        PathaoService.get_stores(force_refresh=True)
+    elif dataset == 'quotes':
+        return {'dataset': dataset, **PathaoService.prefetch_delivery_quotes()}
+    return {'dataset': dataset}
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+Record and replay Pathao webhook callbacks for load testing.
+
+Usage:
+  python3 replay_webhooks.py export callbacks.jsonl [--limit 10000]
+  python3 replay_webhooks.py send callbacks.jsonl --url http://localhost:5000/webhooks/pathao \\
+      --secret $PATHAO_WEBHOOK_SECRET [--concurrency 20] [--repeat 5] [--shuffle]
+
+export writes the raw callbacks stored in the webhook inbox, one JSON
+object per line. send posts them to a running server and reports
+throughput and response latency.
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+def export_callbacks(args):
+    from app import create_app
+    from models import PathaoWebhookEvent
+
+    app = create_app()
+
+    with app.app_context():
+        query = PathaoWebhookEvent.query.order_by(PathaoWebhookEvent.id)
+        if args.limit:
+            query = query.limit(args.limit)
+
+        count = 0
+        with open(args.path, 'w') as f:
+            for event in query.yield_per(1000):
+                f.write(event.payload + '\n')
+                count += 1
+
+    print(f"Exported {count} callbacks to {args.path}.")
+
+def send_callbacks(args):
+    with open(args.path) as f:
+        payloads = [json.loads(line) for line in f if line.strip()]
+    payloads = payloads * args.repeat
+    if args.shuffle:
+        random.shuffle(payloads)
+    if not payloads:
+        print("No callbacks to send.")
+        return
+
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_maxsize=args.concurrency)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    headers = {'X-PATHAO-Signature': args.secret}
+
+    def send(payload):
+        started = time.perf_counter()
+        try:
+            status = session.post(args.url, json=payload, headers=headers, timeout=30).status_code
+        except requests.RequestException:
+            status = 'error'
+        return status, time.perf_counter() - started
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        results = list(executor.map(send, payloads))
+    elapsed = time.perf_counter() - started
+
+    latencies = sorted(latency * 1000 for _, latency in results)
+
+    def percentile(p):
+        return latencies[min(len(latencies) - 1, int(len(latencies) * p / 100))]
+
+    statuses = Counter(status for status, _ in results)
+    print(f"Sent {len(results)} callbacks in {elapsed:.2f}s ({len(results) / elapsed:.0f}/s)")
+    print("Responses: " + ", ".join(f"{status}: {count}" for status, count in sorted(statuses.items(), key=str)))
+    print(f"Latency ms: p50 {percentile(50):.1f}, p95 {percentile(95):.1f}, "
+          f"p99 {percentile(99):.1f}, max {latencies[-1]:.1f}")
+
+def replay_webhooks():
+    parser = argparse.ArgumentParser(description='Record and replay Pathao webhook callbacks')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    export_parser = commands.add_parser('export', help='Write stored callbacks to a JSON-lines file')
+    export_parser.add_argument('path', help='Output file')
+    export_parser.add_argument('--limit', type=int, help='Export at most this many callbacks')
+    export_parser.set_defaults(func=export_callbacks)
+
+    send_parser = commands.add_parser('send', help='Post callbacks from a JSON-lines file to a server')
+    send_parser.add_argument('path', help='JSON-lines file of callbacks')
+    send_parser.add_argument('--url', required=True, help='Webhook URL, e.g. http://localhost:5000/webhooks/pathao')
+    send_parser.add_argument('--secret', default=os.environ.get('PATHAO_WEBHOOK_SECRET', ''),
+                             help='Webhook secret (default: PATHAO_WEBHOOK_SECRET)')
+    send_parser.add_argument('--concurrency', type=int, default=10, help='Parallel requests')
+    send_parser.add_argument('--repeat', type=int, default=1, help='Send every callback this many times')
+    send_parser.add_argument('--shuffle', action='store_true', help='Send in random order')
+    send_parser.set_defaults(func=send_callbacks)
+
+    args = parser.parse_args()
+    args.func(args)
+
+if __name__ == '__main__':
+    replay_webhooks()
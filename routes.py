@@ -1,14 +1,30 @@
-from flask import Blueprint, render_template, redirect, url_for, flash, request, jsonify
+from flask import Blueprint, render_template, redirect, url_for, flash, request, jsonify, current_app
 from flask_login import login_required, current_user
 from sqlalchemy import func, desc
+from sqlalchemy.orm import joinedload
 from datetime import datetime, timedelta, UTC
-from models import db, User, Product, ProductType, SizeGroup, SizeGroupMapping, Order, OrderItem, Customer, PathaoDelivery, PathaoStore
+import uuid
+from models import db, User, Product, ProductType, SizeGroup, SizeGroupMapping, Order, OrderItem, Customer, PathaoDelivery, PathaoStore, StockHold, IdempotencyKey, BackgroundJob, load_profile
 from forms import ProductForm, ProductTypeForm, SizeGroupForm, OrderItemForm, UpdateOrderStatusForm, ReportFilterForm, CreateOrderForm
 from pathao_service import PathaoService
+from pathao_http import get_client, sync_circuits
+from order_service import OrderAssembler, InventorySnapshot
+from order_import import OrderImporter
+from delivery_sync import SYNC_DELIVERIES_JOB
+from shipping import queue_shipping_request, queue_bulk_shipping, release_unshipped, order_reference, CREATE_ORDER_JOB, BULK_CREATE_ORDERS_JOB
 from auth import admin_required
 
 main = Blueprint('main', __name__)
 
+def replay_request(record, pending_url):
+    """Answer a resubmitted request from the stored result of the original"""
+    if record and record.is_completed:
+        result = record.result
+        flash(result['message'], result['category'])
+        return redirect(result['redirect'])
+    flash('This request is already being processed. Please wait a moment.', 'info')
+    return redirect(pending_url)
+
 @main.route('/')
 def index():
     if current_user.is_authenticated:
@@ -28,7 +44,7 @@ def dashboard():
     stats['total_users'] = User.query.filter_by(is_active=True).count()
 
     # Recent orders
-    recent_orders = Order.query.order_by(desc(Order.created_at)).limit(5).all()
+    recent_orders = Order.query.options(*load_profile('dashboard')).order_by(desc(Order.created_at)).limit(5).all()
 
     # Low stock products
     low_stock_products = Product.query.filter(Product.quantity < 10).limit(5).all()
@@ -44,7 +60,7 @@ def inventory():
     page = request.args.get('page', 1, type=int)
     search = request.args.get('search', '', type=str)
     
-    query = Product.query
+    query = Product.query.options(*load_profile('inventory'))
     if search:
         query = query.filter(Product.name.contains(search))
     
@@ -146,7 +162,7 @@ def orders():
     page = request.args.get('page', 1, type=int)
     status_filter = request.args.get('status', '', type=str)
     
-    query = Order.query
+    query = Order.query.options(*load_profile('orders'))
 
     if status_filter:
         query = query.filter_by(status=status_filter)
@@ -163,10 +179,84 @@ def orders():
                          status_filter=status_filter,
                          update_status_form=update_status_form)
 
+@main.route('/orders/ship', methods=['POST'])
+@login_required
+def ship_orders():
+    """Send the selected orders to Pathao as one background batch"""
+    try:
+        order_ids = sorted({int(order_id) for order_id in request.form.getlist('order_ids')})
+    except ValueError:
+        order_ids = []
+    if not order_ids:
+        flash('Please select at least one order to ship.', 'error')
+        return redirect(url_for('main.orders'))
+    
+    pathao_store_id = request.form.get('store_id')
+    store = PathaoStore.query.get(pathao_store_id) if pathao_store_id else None
+    if not store:
+        flash('Please select a store.', 'error')
+        return redirect(url_for('main.orders'))
+    
+    try:
+        job, queued_ids = queue_bulk_shipping(order_ids, store.id)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"Error queueing bulk shipping: {str(e)}")
+        flash('Failed to queue shipping requests. Please try again.', 'error')
+        return redirect(url_for('main.orders'))
+    
+    if not job:
+        flash('Shipping was already requested for all selected orders.', 'info')
+        return redirect(url_for('main.orders'))
+    
+    skipped = len(order_ids) - len(queued_ids)
+    message = f'{len(queued_ids)} orders queued for shipping from {store.store_name}.'
+    if skipped:
+        message += f' {skipped} already requested orders were skipped.'
+    flash(message, 'success')
+    return redirect(url_for('main.shipping_batch', job_id=job.id))
+
+@main.route('/orders/ship/<int:job_id>')
+@login_required
+def shipping_batch(job_id):
+    """Progress and per-order results of a bulk shipping request"""
+    job = BackgroundJob.query.filter_by(id=job_id, kind=BULK_CREATE_ORDERS_JOB).first_or_404()
+    return render_template('shipping_batch.html', job=job, result=job.result_data)
+
+@main.route('/deliveries/sync', methods=['POST'])
+@login_required
+@admin_required
+def sync_deliveries():
+    """Queue a refresh of Pathao statuses for deliveries still in flight"""
+    running = BackgroundJob.latest_for('deliveries', SYNC_DELIVERIES_JOB)
+    if running and running.is_active:
+        flash('A delivery status sync is already in progress.', 'info')
+        return redirect(url_for('main.orders'))
+    
+    BackgroundJob.enqueue(
+        SYNC_DELIVERIES_JOB, {},
+        reference='deliveries',
+        max_attempts=current_app.config['JOB_MAX_ATTEMPTS']
+    )
+    db.session.commit()
+    flash('Delivery status sync queued. Order statuses will update shortly.', 'success')
+    return redirect(url_for('main.orders'))
+
 @main.route('/create_order', methods=['GET', 'POST'])
 @login_required
 def create_order():
     form = CreateOrderForm()
+    if not form.hold_key.data:
+        form.hold_key.data = uuid.uuid4().hex
+    if not form.idempotency_key.data:
+        form.idempotency_key.data = uuid.uuid4().hex
+    
+    # A resubmitted form gets the original result without revalidating
+    if request.method == 'POST':
+        previous = IdempotencyKey.lookup('create_order', form.idempotency_key.data, current_user.id)
+        if previous:
+            return replay_request(previous, url_for('main.orders'))
     
     if form.validate_on_submit():
         products_data = form.get_products_data()
@@ -175,94 +265,132 @@ def create_order():
             flash('Please select at least one product', 'error')
             return redirect(url_for('main.create_order'))
         
+        claim, claimed = IdempotencyKey.claim(
+            'create_order', form.idempotency_key.data, current_user.id,
+            current_app.config['IDEMPOTENCY_KEY_HOURS']
+        )
+        if not claimed:
+            return replay_request(claim, url_for('main.orders'))
+        
         try:
-            # Create or get customer
-            customer = Customer(
-                name=form.customer_name.data,
-                phone=form.customer_phone.data,
-                address=form.customer_address.data
+            # Reuse the customer with this phone number, or create one
+            customer_id = Customer.upsert(
+                form.customer_name.data,
+                form.customer_phone.data,
+                form.customer_address.data
             )
-            db.session.add(customer)
-            db.session.flush()  # Get customer ID
             
-            # Get location names from Pathao service
-            location_names = PathaoService.get_location_names(
-                city_id=form.city_id.data,
-                zone_id=form.zone_id.data
-            )
+            # Location names were looked up while validating the form
+            location_names = form.location_names
             
             # Create order with customer and location information
             order = Order(
                 user_id=current_user.id,
-                customer_id=customer.id,
+                customer_id=customer_id,
                 city_id=form.city_id.data,
                 city_name=location_names.get('city_name'),
                 zone_id=form.zone_id.data,
                 zone_name=location_names.get('zone_name'),
-                delivery_charge=form.delivery_charge.data or 0.00,
+                item_weight=form.item_weight.data,
+                delivery_type=form.delivery_type.data,
+                delivery_charge=form.delivery_charge.data,
                 discount=form.discount.data or 0.00,
                 total_amount=0
             )
             db.session.add(order)
             db.session.flush()  # Get order ID
             
-            # Process each product in the order
-            for product_data in products_data:
-                product_id = int(product_data['product_id'])
-                quantity = int(product_data['quantity'])
-                
-                product = Product.query.get(product_id)
-                if not product:
-                    raise ValueError(f'Product with ID {product_id} not found')
-                
-                if not product.can_fulfill_order(quantity):
-                    available = product.get_total_available_quantity()
-                    raise ValueError(f'Only {available} items available for {product.get_display_name()}')
-                
-                # Create order item
-                order_item = OrderItem(
-                    order_id=order.id,
-                    product_id=product.id,
-                    quantity=quantity,
-                    unit_price=product.price
-                )
-                db.session.add(order_item)
-                db.session.flush()  # Get the OrderItem ID
-                
-                # Generate and set tracking code
-                order_item.update_tracking_code()
-                
-                # Update product stock using the smart fulfillment system
-                if not product.fulfill_order(quantity):
-                    raise ValueError(f'Failed to fulfill order for {product.get_display_name()}')
+            # Allocate stock and write all order items in bulk
+            subtotal = OrderAssembler(
+                products_data,
+                snapshot=form.inventory_snapshot,
+                hold_key=form.hold_key.data
+            ).write(order)
             
             # Calculate total
-            order.calculate_total()
+            order.calculate_total(subtotal)
+            
+            total_items = sum(int(p['quantity']) for p in products_data)
+            message = f'Order #{order.id} created successfully for {form.customer_name.data} with {total_items} items!'
+            order_url = url_for('main.order_details', order_id=order.id)
+            claim.complete({'redirect': order_url, 'message': message, 'category': 'success'})
             
             db.session.commit()
             
-            total_items = sum(int(p['quantity']) for p in products_data)
-            flash(f'Order #{order.id} created successfully for {customer.name} with {total_items} items!', 'success')
-            return redirect(url_for('main.order_details', order_id=order.id))
+            flash(message, 'success')
+            return redirect(order_url)
             
         except ValueError as ve:
-            db.session.rollback()
+            claim.release()
             flash(str(ve), 'error')
         except Exception as e:
-            db.session.rollback()
+            claim.release()
             flash('Error creating order. Please try again.', 'error')
     
+    if request.method == 'GET':
+        try:
+            PathaoService.schedule_quote_prefetch()
+        except Exception as e:
+            db.session.rollback()
+            current_app.logger.error(f"Error scheduling delivery quote prefetch: {str(e)}")
+    
     return render_template('create_order.html', form=form)
 
+@main.route('/orders/import', methods=['POST'])
+@login_required
+def import_orders():
+    """Bulk-create orders from an uploaded CSV or JSON-lines file.
+    
+    Used by the import dialog on the orders page. Like the other JSON
+    endpoints it needs a logged-in session and the page's CSRF token in an
+    X-CSRFToken header (or a csrf_token form field); returns a per-row report.
+    """
+    upload = request.files.get('file')
+    if not upload or not upload.filename:
+        return jsonify({'error': 'No file provided'}), 400
+    
+    fmt = request.form.get('format') or upload.filename.rsplit('.', 1)[-1].lower()
+    if fmt == 'jsonl' or fmt == 'ndjson':
+        fmt = 'jsonl'
+    elif fmt != 'csv':
+        return jsonify({'error': 'Unsupported file format. Use CSV or JSON lines'}), 400
+    
+    chunk_size = request.form.get('chunk_size', type=int)
+    
+    try:
+        importer = OrderImporter(current_user.id, chunk_size=chunk_size)
+        report = importer.run(OrderImporter.read_rows(upload.stream, fmt))
+        return jsonify(report)
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"Error importing orders: {str(e)}")
+        return jsonify({'error': 'Failed to import orders'}), 500
+
 @main.route('/order_details/<int:order_id>')
 @login_required
 def order_details(order_id):
-    order = Order.query.get_or_404(order_id)
+    order = Order.query.options(*load_profile('order_details')).get_or_404(order_id)
     
     # Create form for CSRF token generation
     update_status_form = UpdateOrderStatusForm()
     
-    return render_template('order_details.html', order=order, update_status_form=update_status_form)
+    # Latest Pathao submission, shown while it is queued or if it failed
+    shipping_job = BackgroundJob.latest_for(order_reference(order.id), CREATE_ORDER_JOB)
+    
+    # Requested without a recorded delivery: a send may have failed in a way
+    # only a person can resolve by checking Pathao
+    can_release_shipping = (
+        order.shipping_requested
+        and not (shipping_job and shipping_job.is_active)
+        and not PathaoDelivery.query.filter_by(merchant_order_id=order.id).first()
+    )
+    
+    return render_template('order_details.html',
+                         order=order,
+                         update_status_form=update_status_form,
+                         shipping_request_key=uuid.uuid4().hex,
+                         shipping_job=shipping_job,
+                         can_release_shipping=can_release_shipping)
 
 @main.route('/update_order_status', methods=['POST'])
 @login_required
@@ -314,7 +442,7 @@ def generate_report():
         end_date = end_date.replace(hour=23, minute=59, second=59)  # End of day
         
         # Base query
-        orders_query = Order.query
+        orders_query = Order.query.options(*load_profile('report'))
 
         # Filter by date range
         orders = orders_query.filter(
@@ -557,6 +685,38 @@ def delete_size_group(size_group_id):
     return redirect(url_for('main.size_groups'))
 
 # API Routes for dynamic form updates
+@main.route('/api/customers/lookup')
+@login_required
+def api_customer_lookup():
+    """API endpoint to find a returning customer by phone number"""
+    customer = Customer.find_by_phone(request.args.get('phone', ''))
+    if not customer:
+        return jsonify({'found': False})
+    
+    return jsonify({
+        'found': True,
+        'id': customer.id,
+        'name': customer.name,
+        'phone': customer.phone,
+        'address': customer.address
+    })
+
+@main.route('/api/jobs/<int:job_id>')
+@login_required
+def api_job_status(job_id):
+    """API endpoint to poll the status of a background job"""
+    job = BackgroundJob.query.get_or_404(job_id)
+    return jsonify({
+        'id': job.id,
+        'kind': job.kind,
+        'status': job.status,
+        'attempts': job.attempts,
+        'max_attempts': job.max_attempts,
+        'next_attempt_at': job.run_at.isoformat() if job.status == 'queued' else None,
+        'last_error': job.last_error,
+        'result': job.result_data
+    })
+
 @main.route('/api/size-groups/<int:product_type_id>')
 @login_required
 def get_size_groups_for_product_type(product_type_id):
@@ -577,11 +737,7 @@ def get_size_groups_for_product_type(product_type_id):
 def api_cities():
     """API endpoint to get list of cities from Pathao"""
     try:
-        cities = PathaoService.get_cities()
-        return jsonify([
-            {'id': city.city_id, 'name': city.city_name}
-            for city in cities
-        ])
+        return current_app.response_class(PathaoService.cities_payload(), mimetype='application/json')
     except Exception as e:
         return jsonify({'error': 'Failed to fetch cities'}), 500
 
@@ -590,11 +746,7 @@ def api_cities():
 def api_zones(city_id):
     """API endpoint to get zones for a specific city"""
     try:
-        zones = PathaoService.get_zones(city_id)
-        return jsonify([
-            {'id': zone.zone_id, 'name': zone.zone_name}
-            for zone in zones
-        ])
+        return current_app.response_class(PathaoService.zones_payload(city_id), mimetype='application/json')
     except Exception as e:
         return jsonify({'error': 'Failed to fetch zones'}), 500
 
@@ -604,7 +756,11 @@ def api_zones(city_id):
 def api_products():
     """API endpoint to get list of available products for order creation"""
     try:
-        products = Product.query.filter(Product.quantity > 0).all()
+        # Out-of-stock siblings are needed too, so load everything once
+        products = Product.query.options(joinedload(Product.product_type)).all()
+        snapshot = InventorySnapshot.for_products(
+            products, exclude_hold_key=request.args.get('hold_key')
+        )
         return jsonify([
             {
                 'id': product.id,
@@ -613,14 +769,82 @@ def api_products():
                 'size': product.size,
                 'price': float(product.price),
                 'stock': product.quantity,
-                'total_available': product.get_total_available_quantity(),
+                'total_available': snapshot.total_available(product.id),
                 'display_text': f"{product.get_display_name()} - {product.product_code} - {product.size} - ${product.price} (Stock: {product.quantity})"
             }
             for product in products
+            if product.quantity > 0
         ])
     except Exception as e:
         return jsonify({'error': 'Failed to fetch products'}), 500
 
+@main.route('/api/holds', methods=['POST'])
+@login_required
+def api_place_hold():
+    """API endpoint to place or refresh a stock hold for an order form row"""
+    data = request.get_json(silent=True) or {}
+    hold_key = str(data.get('hold_key', '')).strip()
+    try:
+        product_id = int(data.get('product_id'))
+        quantity = int(data.get('quantity'))
+    except (TypeError, ValueError):
+        return jsonify({'success': False, 'message': 'Invalid product or quantity'}), 400
+    
+    if not hold_key or len(hold_key) > 64 or quantity < 1:
+        return jsonify({'success': False, 'message': 'Invalid hold request'}), 400
+    
+    try:
+        StockHold.sweep_expired()
+        
+        snapshot = InventorySnapshot.load([product_id], exclude_hold_key=hold_key)
+        if not snapshot.get(product_id):
+            return jsonify({'success': False, 'message': 'Product not found'}), 404
+        
+        available = snapshot.total_available(product_id)
+        if quantity > available:
+            db.session.commit()
+            return jsonify({
+                'success': False,
+                'available': available,
+                'message': f'Only {available} items available'
+            }), 409
+        
+        hold = StockHold.query.filter_by(hold_key=hold_key, product_id=product_id).first()
+        if hold and hold.user_id != current_user.id:
+            return jsonify({'success': False, 'message': 'Invalid hold request'}), 403
+        if not hold:
+            hold = StockHold(hold_key=hold_key, product_id=product_id, user_id=current_user.id)
+            db.session.add(hold)
+        hold.quantity = quantity
+        hold.expires_at = datetime.now(UTC) + timedelta(minutes=current_app.config['STOCK_HOLD_MINUTES'])
+        db.session.commit()
+        
+        return jsonify({
+            'success': True,
+            'available': available,
+            'expires_at': hold.expires_at.isoformat()
+        })
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"Error placing stock hold: {str(e)}")
+        return jsonify({'success': False, 'message': 'Failed to place hold'}), 500
+
+@main.route('/api/holds/<hold_key>/<int:product_id>', methods=['DELETE'])
+@login_required
+def api_release_hold(hold_key, product_id):
+    """API endpoint to release a stock hold when a row is removed from the order form"""
+    try:
+        StockHold.query.filter_by(
+            hold_key=hold_key,
+            product_id=product_id,
+            user_id=current_user.id
+        ).delete(synchronize_session=False)
+        db.session.commit()
+        return jsonify({'success': True})
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'message': 'Failed to release hold'}), 500
+
 @main.route('/api/parse-address', methods=['POST'])
 @login_required
 def api_parse_address():
@@ -644,6 +868,35 @@ def api_parse_address():
         return jsonify({'error': 'Failed to parse address'}), 500
 
 
+@main.route('/api/delivery-quote')
+@login_required
+def api_delivery_quote():
+    """API endpoint to quote the Pathao delivery charge for the order form"""
+    city_id = request.args.get('city_id', type=int)
+    zone_id = request.args.get('zone_id', type=int)
+    if not city_id or not zone_id:
+        return jsonify({'error': 'City and zone are required'}), 400
+    
+    item_weight = request.args.get('weight', type=float)
+    if item_weight is not None and not 0.1 <= item_weight <= 30:
+        return jsonify({'error': 'Parcel weight must be between 0.1 and 30 kg'}), 400
+    delivery_type = request.args.get('delivery_type', type=int)
+    if delivery_type is not None and delivery_type not in PathaoService.DELIVERY_TYPES:
+        return jsonify({'error': 'Unknown delivery type'}), 400
+    
+    try:
+        quote = PathaoService.get_delivery_quote(
+            city_id, zone_id, item_weight, delivery_type, request.args.get('store_id', type=int)
+        )
+        if not quote:
+            return jsonify({'error': 'No delivery charge quote available'}), 404
+        
+        return jsonify({'success': True, 'data': quote})
+    except Exception as e:
+        current_app.logger.error(f"Error quoting delivery charge: {str(e)}")
+        return jsonify({'error': 'Failed to quote delivery charge'}), 500
+
+
 @main.route('/api/stores')
 @login_required
 def api_stores():
@@ -696,6 +949,39 @@ def api_stores():
             current_app.logger.error(f"Fallback store fetch failed: {str(fallback_error)}")
             return jsonify({'error': 'Failed to fetch stores'}), 500
 
+@main.route('/api/pathao/stats')
+@login_required
+@admin_required
+def api_pathao_stats():
+    """API endpoint to see where time goes in Pathao calls made by this process"""
+    return jsonify({'http': get_client().stats(), 'cache': PathaoService.cache_stats()})
+
+@main.route('/admin/pathao')
+@login_required
+@admin_required
+def pathao_status():
+    """Circuit breaker state and call statistics of the Pathao integration"""
+    client = get_client()
+    sync_circuits(client)
+    circuits = {endpoint: breaker.summary() for endpoint, breaker in sorted(client.circuits.items())}
+    return render_template('pathao_status.html', circuits=circuits, http_stats=client.stats(),
+                           cache_stats=PathaoService.cache_stats(), client=client)
+
+@main.route('/admin/pathao/circuits/<name>/reset', methods=['POST'])
+@login_required
+@admin_required
+def reset_pathao_circuit(name):
+    """Close an open circuit for every worker, e.g. after Pathao recovered"""
+    client = get_client()
+    if name not in client.circuits:
+        flash(f'Unknown Pathao endpoint "{name}".', 'error')
+        return redirect(url_for('main.pathao_status'))
+    
+    client.circuit(name).reset()
+    sync_circuits(client)
+    flash(f'Circuit for {name} closed.', 'success')
+    return redirect(url_for('main.pathao_status'))
+
 
 # User Management API Routes
 @main.route('/api/users/<int:user_id>/toggle-status', methods=['POST'])
@@ -764,49 +1050,77 @@ def api_delete_user(user_id):
         db.session.rollback()
         return jsonify({'success': False, 'message': 'Failed to delete user'}), 500
 
+@main.route('/orders/<int:order_id>/release_shipping', methods=['POST'])
+@login_required
+@admin_required
+def release_shipping(order_id):
+    """Let an order be shipped again once an admin has found no consignment for it in Pathao"""
+    order = Order.query.get_or_404(order_id)
+    order_url = url_for('main.order_details', order_id=order.id)
+    
+    shipping_job = BackgroundJob.latest_for(order_reference(order.id), CREATE_ORDER_JOB)
+    if shipping_job and shipping_job.is_active:
+        flash('The order is still being sent to Pathao.', 'info')
+        return redirect(order_url)
+    
+    # Orders with a recorded delivery are never released
+    release_unshipped([order.id])
+    db.session.commit()
+    if order.shipping_requested:
+        flash('This order already has a Pathao delivery.', 'info')
+    else:
+        flash('Shipping can be requested again for this order.', 'success')
+    return redirect(order_url)
+
 @main.route('/request_shipping/<int:order_id>', methods=['POST'])
 @login_required
 def request_shipping(order_id):
     order = Order.query.get_or_404(order_id)
+    order_url = url_for('main.order_details', order_id=order.id)
+    
+    # A resubmitted request gets the original result without calling Pathao again
+    request_key = request.form.get('idempotency_key')
+    if request_key:
+        previous = IdempotencyKey.lookup('request_shipping', request_key, current_user.id)
+        if previous:
+            return replay_request(previous, order_url)
+    
     if order.shipping_requested:
         flash('Shipping already requested for this order.', 'info')
     else:
-        # Get store_id from form data
+        claim = None
+        if request_key:
+            claim, claimed = IdempotencyKey.claim(
+                'request_shipping', request_key, current_user.id,
+                current_app.config['IDEMPOTENCY_KEY_HOURS']
+            )
+            if not claimed:
+                return replay_request(claim, order_url)
+        
+        # Pathao is called by a background worker; the order page polls the job
         pathao_store_id = request.form.get('store_id')
-        store_name = PathaoStore.query.get(pathao_store_id).store_name
-        # Trigger create order request to Pathao
-        from pathao_service import PathaoService
+        store = PathaoStore.query.get(pathao_store_id) if pathao_store_id else None
+        if not store:
+            if claim:
+                claim.release()
+            flash('Please select a store.', 'error')
+            return redirect(order_url)
+        
         try:
-            response = PathaoService.create_order(order, store_id=pathao_store_id)
-            if response.get('code') == 200:
-                # Extract delivery data from response
-                delivery_data = response.get('data', {})                
-                # Create PathaoDelivery record
-                try:
-                    from models import PathaoDelivery
-                    pathao_delivery = PathaoDelivery(
-                        consignment_id=delivery_data.get('consignment_id'),
-                        merchant_order_id=order.id,
-                        order_status=delivery_data.get('order_status', 'Pending'),
-                        delivery_fee=delivery_data.get('delivery_fee', 0)
-                    )
-                    
-                    db.session.add(pathao_delivery)
-                    order.shipping_requested = True
-                    order.updated_at = datetime.now(UTC)
-                    db.session.commit()
-                    
-                    flash(f'Shipping request sent to Pathao successfully from {store_name}. Tracking ID: {pathao_delivery.consignment_id}', 'success')
-                except Exception as db_error:
-                    db.session.rollback()
-                    # Still mark as requested since Pathao accepted the order
-                    order.shipping_requested = True
-                    order.updated_at = datetime.now(UTC)
-                    db.session.commit()
-                    flash(f'Shipping request sent to Pathao successfully from {store_name}, but failed to save tracking info: {str(db_error)}', 'warning')
-                    
+            job = queue_shipping_request(order, store.id)
+            if job:
+                message = f'Shipping request for {store.store_name} queued. Tracking details will appear once Pathao confirms.'
+                category = 'success'
             else:
-                flash('Failed to send order to Pathao: ' + response.get('message', 'Unknown error'), 'error')
+                message = 'Shipping already requested for this order.'
+                category = 'info'
+            if claim:
+                claim.complete({'redirect': order_url, 'message': message, 'category': category})
+            db.session.commit()
+            flash(message, category)
         except Exception as e:
-            flash(f'Pathao API error: {str(e)}', 'error')
-    return redirect(url_for('main.order_details', order_id=order.id))
+            if claim:
+                claim.release()
+            current_app.logger.error(f"Error queueing shipping request: {str(e)}")
+            flash('Failed to queue shipping request. Please try again.', 'error')
+    return redirect(order_url)
@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+"""
+Run background job workers (Pathao shipping requests and other queued work).
+
+Usage: python3 run_worker.py [--threads 4]
+
+Run one or more of these next to the web server. Jobs are stored in the
+application database, so any number of worker processes can share the queue.
+"""
+
+import argparse
+import os
+import signal
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from app import create_app
+from job_queue import start_workers
+
+def run_worker():
+    parser = argparse.ArgumentParser(description='Run background job workers')
+    parser.add_argument('--threads', type=int, help='Worker threads (default: JOB_WORKER_THREADS)')
+    args = parser.parse_args()
+
+    app = create_app()
+    workers = start_workers(app, args.threads)
+    print(f"Started {len(workers)} job worker threads. Press Ctrl+C to stop.")
+
+    def stop(signum, frame):
+        for worker in workers:
+            worker.stop()
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+
+    # Finish the jobs in progress before exiting
+    for worker in workers:
+        while worker.is_alive():
+            worker.join(timeout=1)
+
+    print("Job workers stopped.")
+
+if __name__ == '__main__':
+    run_worker()
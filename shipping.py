@@ -0,0 +1,229 @@
+from datetime import datetime, UTC
+from flask import current_app
+from sqlalchemy import update, insert, exists
+from sqlalchemy.orm import joinedload, selectinload
+from models import db, Order, PathaoDelivery, BackgroundJob
+from pathao_service import PathaoService
+from job_queue import JobError, JobNeedsCheck, job_handler
+
+CREATE_ORDER_JOB = 'pathao_create_order'
+BULK_CREATE_ORDERS_JOB = 'pathao_bulk_create_orders'
+
+
+def order_reference(order_id):
+    """Job reference used for an order's shipping jobs"""
+    return f'order:{order_id}'
+
+
+def queue_shipping_request(order, store_id):
+    """Mark the order as requested and queue its Pathao submission.
+
+    The flag is set with a conditional UPDATE, so two concurrent requests
+    for the same order cannot both queue a job. Returns the job, or None
+    if shipping was already requested. Committed with the caller's
+    transaction.
+    """
+    claimed = db.session.execute(
+        update(Order)
+        .where(Order.id == order.id, Order.shipping_requested.isnot(True))
+        .values(shipping_requested=True, updated_at=datetime.now(UTC))
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    if not claimed:
+        return None
+
+    db.session.expire(order, ['shipping_requested', 'updated_at'])
+    return BackgroundJob.enqueue(
+        CREATE_ORDER_JOB,
+        {'order_id': order.id, 'store_id': int(store_id)},
+        reference=order_reference(order.id),
+        max_attempts=current_app.config['JOB_MAX_ATTEMPTS']
+    )
+
+
+def shipping_failed(payload, error):
+    """Let the order be sent again once every attempt has failed"""
+    db.session.execute(
+        update(Order)
+        .where(Order.id == payload['order_id'])
+        .values(shipping_requested=False, updated_at=datetime.now(UTC))
+        .execution_options(synchronize_session=False)
+    )
+
+
+# Pathao may have received the order by the time a worker stops, so it is never re-run
+@job_handler(CREATE_ORDER_JOB, on_failure=shipping_failed, reclaim=False)
+def create_pathao_order(payload):
+    """Submit an order to Pathao and record the consignment"""
+    order = db.session.get(Order, payload['order_id'])
+    if order is None:
+        raise LookupError(f"Order {payload['order_id']} not found")
+
+    response = PathaoService.create_order(order, store_id=payload['store_id'])
+    if response.get('code') != 200:
+        message = response.get('message', 'Unknown error')
+        if response.get('retryable'):
+            raise JobError(message)
+        if response.get('retryable') is False:
+            # Pathao may have created the consignment anyway, so sending the order
+            # again could duplicate it; it stays requested until a person has checked
+            raise JobNeedsCheck(f'{message} (check Pathao for order {order.id} before shipping it again)')
+        # Rejected by Pathao; sending the same order again would fail the same way
+        raise RuntimeError(message)
+
+    delivery_data = response.get('data', {})
+    consignment_id = delivery_data.get('consignment_id')
+    try:
+        db.session.add(PathaoDelivery(
+            consignment_id=consignment_id,
+            merchant_order_id=order.id,
+            order_status=delivery_data.get('order_status', 'Pending'),
+            is_final=PathaoDelivery.is_final_status(delivery_data.get('order_status', 'Pending')),
+            delivery_fee=delivery_data.get('delivery_fee', 0)
+        ))
+        order.updated_at = datetime.now(UTC)
+        db.session.flush()
+    except Exception as db_error:
+        # Pathao accepted the order, so it must not be retried or sent again
+        db.session.rollback()
+        current_app.logger.error(f"Error saving Pathao delivery for order {payload['order_id']}: {str(db_error)}")
+        return {
+            'consignment_id': consignment_id,
+            'warning': f'Failed to save tracking info: {str(db_error)}'
+        }
+
+    return {'consignment_id': consignment_id}
+
+
+def queue_bulk_shipping(order_ids, store_id):
+    """Mark many orders as requested and queue one job that ships them together.
+
+    Orders already requested are skipped. Returns (job, queued order ids);
+    the job is None when no order was left to ship. Committed with the
+    caller's transaction.
+    """
+    queued_ids = sorted(db.session.scalars(
+        update(Order)
+        .where(Order.id.in_(order_ids), Order.shipping_requested.isnot(True))
+        .values(shipping_requested=True, updated_at=datetime.now(UTC))
+        .returning(Order.id)
+        .execution_options(synchronize_session=False)
+    ).all())
+    if not queued_ids:
+        return None, []
+
+    job = BackgroundJob.enqueue(
+        BULK_CREATE_ORDERS_JOB,
+        {'order_ids': queued_ids, 'store_id': int(store_id)},
+        max_attempts=current_app.config['JOB_MAX_ATTEMPTS']
+    )
+    return job, queued_ids
+
+
+def release_unshipped(order_ids):
+    """Let orders without a recorded delivery be sent again"""
+    if not order_ids:
+        return
+    db.session.execute(
+        update(Order)
+        .where(
+            Order.id.in_(order_ids),
+            ~exists().where(PathaoDelivery.merchant_order_id == Order.id)
+        )
+        .values(shipping_requested=False, updated_at=datetime.now(UTC))
+        .execution_options(synchronize_session=False)
+    )
+
+
+def save_deliveries(rows):
+    """Insert PathaoDelivery rows in one statement.
+
+    If the bulk insert fails, rows are saved one by one so a single bad row
+    cannot lose the others. Returns {order id: error} for rows not saved.
+    """
+    try:
+        with db.session.begin_nested():
+            db.session.execute(insert(PathaoDelivery), rows)
+        return {}
+    except Exception as e:
+        current_app.logger.error(f"Error bulk saving Pathao deliveries: {str(e)}")
+
+    errors = {}
+    for row in rows:
+        try:
+            with db.session.begin_nested():
+                db.session.execute(insert(PathaoDelivery), [row])
+        except Exception as e:
+            errors[row['merchant_order_id']] = str(e)
+    return errors
+
+
+def bulk_shipping_failed(payload, error):
+    """Release every order of a batch that never reached Pathao"""
+    release_unshipped(payload['order_ids'])
+
+
+@job_handler(BULK_CREATE_ORDERS_JOB, on_failure=bulk_shipping_failed, reclaim=False)
+def create_pathao_orders(payload):
+    """Submit a batch of orders to Pathao concurrently and record the consignments.
+
+    Failed orders are reported individually and do not abort the rest of
+    the batch. Those certainly not created are released so they can be
+    shipped again; the others may exist in Pathao anyway and stay
+    requested until a person has checked. Once orders
+    have been sent the job is never retried, as that would send them twice:
+    it is only retried when nothing was sent, and a job whose worker stops
+    mid-batch is failed for a person to check rather than reclaimed.
+    """
+    order_ids = payload['order_ids']
+    orders = Order.query.options(
+        joinedload(Order.customer),
+        selectinload(Order.order_items)
+    ).filter(Order.id.in_(order_ids)).all()
+
+    try:
+        responses = PathaoService.create_orders(orders, payload['store_id'])
+    except RuntimeError as e:
+        # Nothing was sent yet, so the whole batch can safely be retried
+        raise JobError(str(e))
+
+    now = datetime.now(UTC)
+    rows = []
+    failed = {order_id: 'Order not found' for order_id in set(order_ids) - set(responses)}
+    uncertain = set()
+    for order_id, response in responses.items():
+        delivery_data = response.get('data') or {}
+        if response.get('code') != 200 or not delivery_data.get('consignment_id'):
+            failed[order_id] = response.get('message', 'Unknown error')
+            if response.get('retryable') is False:
+                uncertain.add(order_id)
+                failed[order_id] += f' (check Pathao for order {order_id} before shipping it again)'
+            continue
+        rows.append({
+            'consignment_id': delivery_data['consignment_id'],
+            'merchant_order_id': order_id,
+            'order_status': delivery_data.get('order_status', 'Pending'),
+            'is_final': PathaoDelivery.is_final_status(delivery_data.get('order_status', 'Pending')),
+            'delivery_fee': delivery_data.get('delivery_fee', 0),
+            'created_at': now,
+            'updated_at': now
+        })
+
+    # Accepted by Pathao even if saving fails, so these stay requested
+    warnings = save_deliveries(rows) if rows else {}
+    release_unshipped([order_id for order_id in failed if order_id not in uncertain])
+
+    return {
+        'shipped': [
+            {
+                'order_id': row['merchant_order_id'],
+                'consignment_id': row['consignment_id'],
+                'warning': warnings.get(row['merchant_order_id'])
+            }
+            for row in sorted(rows, key=lambda row: row['merchant_order_id'])
+        ],
+        'failed': [
+            {'order_id': order_id, 'error': error}
+            for order_id, error in sorted(failed.items())
+        ]
+    }
@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+"""
+Refresh Pathao delivery statuses for parcels still in flight.
+
+Usage: python3 sync_deliveries.py [--batch-size 100] [--no-order-update]
+
+Suitable for cron; only deliveries not yet in a final status are checked.
+"""
+
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from app import create_app
+from delivery_sync import DeliveryStatusSync
+
+def sync_deliveries():
+    parser = argparse.ArgumentParser(description='Refresh Pathao delivery statuses')
+    parser.add_argument('--batch-size', type=int, help='Deliveries fetched and written per batch')
+    parser.add_argument('--no-order-update', action='store_true', help='Leave order statuses unchanged')
+    args = parser.parse_args()
+
+    app = create_app()
+
+    with app.app_context():
+        sync = DeliveryStatusSync(
+            batch_size=args.batch_size,
+            update_orders=False if args.no_order_update else None
+        )
+        try:
+            stats = sync.run()
+        except RuntimeError as e:
+            print(f"Sync failed: {e}")
+            sys.exit(1)
+
+        print(f"Done. {stats['checked']} deliveries checked, {stats['changed']} changed, "
+              f"{stats['unavailable']} unavailable, {stats['orders_updated']} orders updated.")
+
+if __name__ == '__main__':
+    sync_deliveries()
@@ -0,0 +1,188 @@
+import json
+from datetime import datetime, timedelta, UTC
+from flask import current_app
+from sqlalchemy import select, update, delete
+from models import db, PathaoDelivery, PathaoWebhookEvent, BackgroundJob
+from pathao_service import PathaoService
+from delivery_sync import delivery_rows_query, apply_status_updates
+from job_queue import job_handler
+
+WEBHOOK_INBOX_JOB = 'pathao_webhook_inbox'
+WEBHOOK_INBOX_REFERENCE = 'webhook-inbox'
+
+
+def parse_event(payload):
+    """Validate a Pathao status callback and extract what the inbox stores.
+
+    The status is taken from order_status when present, otherwise from the
+    event name ('order.pickup-requested' -> 'Pickup_Requested'). Raises
+    ValueError for payloads that carry no usable status.
+    """
+    if not isinstance(payload, dict):
+        raise ValueError('Invalid payload')
+
+    consignment_id = str(payload.get('consignment_id') or '').strip()
+    if not consignment_id or len(consignment_id) > 50:
+        raise ValueError('Missing or invalid consignment_id')
+
+    event = str(payload.get('event') or '')[:50] or None
+    status = payload.get('order_status')
+    if not status and event and event.startswith('order.'):
+        status = event[len('order.'):].replace('-', '_').replace('.', '_').title()
+    if not status or len(str(status)) > 50:
+        raise ValueError('Missing or invalid order status')
+
+    event_time = (
+        PathaoService.parse_time(payload.get('updated_at'))
+        or PathaoService.parse_time(payload.get('timestamp'))
+        or datetime.now(UTC).replace(tzinfo=None)
+    )
+    return {
+        'consignment_id': consignment_id,
+        'event': event,
+        'order_status': str(status),
+        'event_time': event_time
+    }
+
+
+def record_event(payload):
+    """Append a callback to the inbox and make sure a consumer job is queued.
+
+    Only an insert and an indexed lookup, so the webhook can answer quickly;
+    the merge into PathaoDelivery happens in the background. Commits.
+    """
+    event = parse_event(payload)
+    db.session.add(PathaoWebhookEvent(payload=json.dumps(payload), **event))
+
+    queue_consumer(current_app.config['WEBHOOK_BATCH_DELAY_SECONDS'])
+    db.session.commit()
+
+
+def queue_consumer(delay_seconds):
+    """Queue a consumer job unless one is already waiting"""
+    # One queued consumer is enough; it drains every pending event when it runs
+    queued = BackgroundJob.query.filter_by(
+        reference=WEBHOOK_INBOX_REFERENCE, status='queued'
+    ).first()
+    if not queued:
+        BackgroundJob.enqueue(
+            WEBHOOK_INBOX_JOB, {},
+            reference=WEBHOOK_INBOX_REFERENCE,
+            max_attempts=current_app.config['JOB_MAX_ATTEMPTS'],
+            delay_seconds=delay_seconds
+        )
+
+
+class WebhookInboxConsumer:
+    """Merge pending webhook events into PathaoDelivery in batches.
+
+    Within a batch only the latest event per consignment is applied, and
+    events older than the stored status are ignored, so out-of-order
+    callbacks cannot move a delivery backwards. Events for consignments
+    without a PathaoDelivery row yet (e.g. a callback that arrives before
+    the shipping job has saved the delivery) stay pending and are retried
+    until WEBHOOK_UNKNOWN_RETRY_HOURS after they were received.
+    """
+
+    def __init__(self, batch_size=None, update_orders=None):
+        config = current_app.config
+        self.batch_size = batch_size or config['WEBHOOK_BATCH_SIZE']
+        self.update_orders = config['DELIVERY_SYNC_UPDATE_ORDERS'] if update_orders is None else update_orders
+        self.stats = {'events': 0, 'changed': 0, 'unknown': 0, 'expired': 0, 'orders_updated': 0}
+        self.cursor = 0  # Highest event id read, so waiting events are read once per drain
+
+    def drain(self):
+        """Process batches until the inbox is empty and return the statistics"""
+        while self.process_batch():
+            pass
+        self.purge_processed()
+        if self.stats['unknown']:
+            # Retry events still waiting for their delivery later
+            queue_consumer(current_app.config['WEBHOOK_UNKNOWN_RETRY_SECONDS'])
+            db.session.commit()
+        return self.stats
+
+    def process_batch(self):
+        """Merge one batch of pending events; returns the number read"""
+        events = db.session.execute(
+            select(
+                PathaoWebhookEvent.id,
+                PathaoWebhookEvent.consignment_id,
+                PathaoWebhookEvent.order_status,
+                PathaoWebhookEvent.event_time,
+                PathaoWebhookEvent.received_at
+            )
+            .where(PathaoWebhookEvent.processed_at.is_(None), PathaoWebhookEvent.id > self.cursor)
+            .order_by(PathaoWebhookEvent.id)
+            .limit(self.batch_size)
+        ).all()
+        if not events:
+            return 0
+        self.cursor = events[-1].id
+
+        # Latest event per consignment; arrival order breaks ties
+        latest = {}
+        for event in events:
+            current = latest.get(event.consignment_id)
+            if current is None or (event.event_time, event.id) >= (current.event_time, current.id):
+                latest[event.consignment_id] = event
+
+        deliveries = db.session.execute(
+            delivery_rows_query().where(PathaoDelivery.consignment_id.in_(list(latest)))
+        ).all()
+        changed, orders_updated = apply_status_updates(
+            deliveries,
+            {cid: (event.order_status, event.event_time) for cid, event in latest.items()},
+            self.update_orders
+        )
+
+        # Unknown consignments are kept for a later drain until they expire
+        known = {delivery.consignment_id for delivery in deliveries}
+        expire_before = (
+            datetime.now(UTC) - timedelta(hours=current_app.config['WEBHOOK_UNKNOWN_RETRY_HOURS'])
+        ).replace(tzinfo=None)
+        done = []
+        waiting = set()
+        for event in events:
+            if event.consignment_id in known:
+                done.append(event.id)
+            elif event.received_at is not None and event.received_at < expire_before:
+                done.append(event.id)
+                self.stats['expired'] += 1
+            else:
+                waiting.add(event.consignment_id)
+
+        if done:
+            db.session.execute(
+                update(PathaoWebhookEvent)
+                .where(PathaoWebhookEvent.id.in_(done))
+                .values(processed_at=datetime.now(UTC))
+                .execution_options(synchronize_session=False)
+            )
+        db.session.commit()
+
+        self.stats['events'] += len(done)
+        self.stats['changed'] += changed
+        self.stats['unknown'] += len(waiting)
+        self.stats['orders_updated'] += orders_updated
+        return len(events)
+
+    def purge_processed(self):
+        """Delete merged or expired events older than the retention period"""
+        cutoff = datetime.now(UTC) - timedelta(days=current_app.config['WEBHOOK_RETENTION_DAYS'])
+        db.session.execute(delete(PathaoWebhookEvent).where(
+            PathaoWebhookEvent.processed_at.isnot(None),
+            PathaoWebhookEvent.processed_at < cutoff
+        ))
+        db.session.commit()
+
+
+@job_handler(WEBHOOK_INBOX_JOB)
+def consume_webhook_inbox(payload):
+    """Background job wrapper around WebhookInboxConsumer"""
+    stats = WebhookInboxConsumer().drain()
+    if stats['expired']:
+        current_app.logger.warning(
+            f"Dropped {stats['expired']} webhook events for consignments that were never recorded"
+        )
+    return stats
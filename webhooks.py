@@ -0,0 +1,26 @@
+import hmac
+from flask import Blueprint, request, jsonify, current_app
+from webhook_inbox import record_event
+
+webhooks = Blueprint('webhooks', __name__)
+
+@webhooks.route('/pathao', methods=['POST'])
+def pathao_webhook():
+    """Receive a Pathao delivery status callback into the local inbox"""
+    secret = current_app.config['PATHAO_WEBHOOK_SECRET']
+    signature = request.headers.get('X-PATHAO-Signature', '')
+    if not secret or not hmac.compare_digest(signature.encode(), secret.encode()):
+        return jsonify({'error': 'Invalid signature'}), 401
+    
+    payload = request.get_json(silent=True)
+    
+    # Pathao sends a test event when the webhook is set up
+    if isinstance(payload, dict) and payload.get('event') == 'webhook_integration':
+        return jsonify({'status': 'accepted'}), 202
+    
+    try:
+        record_event(payload)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    return jsonify({'status': 'accepted'}), 202